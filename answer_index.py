@@ -0,0 +1,131 @@
+import bisect
+from collections import defaultdict
+
+# Per-question answer distributions over a QuestionAnalyzer's profiles, built
+# in one pass so that interactive questions about a question ("what do the
+# high match profiles answer?", "who accepts my answer?") are dictionary
+# lookups instead of scans over every profile.
+#
+# For each question, counts are kept per (their answer, match percentage)
+# cell as [profiles, my_bad, their_bad], my_bad and their_bad counting as in
+# QuestionStats: my answer is not acceptable to them / theirs not to me, both
+# only on questions the viewing account answered. Cells also count how many
+# of their answers were acceptable to me (their_answer_matches), for
+# accepted_answers; that count does not depend on my having answered.
+# Profiles only record their answer, not its importance to them, so the
+# split by importance is by the viewing account's importance for the question.
+
+_N, _MY_BAD, _THEIR_BAD, _ACCEPTED = 0, 1, 2, 3
+
+class AnswerIndex(object):
+    def __init__(self, profiles, my_questions=None):
+        # profiles: anything with questions and match_percentage
+        # my_questions: question id -> question with .importance (as in
+        # QuestionAnalyzer.shadow_questions), for by_importance
+        # keys are question ids, values are {(their_answer, match_percentage): [n, my_bad, their_bad, accepted]}
+        self.cells = defaultdict(dict)
+        self.texts = {}
+        for profile in profiles:
+            mp = profile.match_percentage
+            for question in profile.questions:
+                cells = self.cells[question.id]
+                key = (question.their_answer, mp)
+                cell = cells.get(key)
+                if cell is None:
+                    cell = cells[key] = [0, 0, 0, 0]
+                cell[_N] += 1
+                if question.their_answer_matches:
+                    cell[_ACCEPTED] += 1
+                if question.my_answer is not None:
+                    if not question.my_answer_matches:
+                        cell[_MY_BAD] += 1
+                    if not question.their_answer_matches:
+                        cell[_THEIR_BAD] += 1
+                if question.id not in self.texts:
+                    self.texts[question.id] = question.text
+        self.cells = dict(self.cells)
+        self.my_questions = my_questions or {}
+        # (lower case text, id), sorted, for prefix lookups
+        self._sorted_texts = sorted((text.lower(), id) for id, text in self.texts.iteritems())
+        self._by_start = defaultdict(list)
+        for id, text in self.texts.iteritems():
+            self._by_start[text[:50]].append(id)
+        self._histograms = {}
+
+    def _cells(self, id, min_mp=None):
+        for (answer, mp), cell in self.cells.get(id, {}).iteritems():
+            if min_mp is None or (mp is not None and mp >= min_mp):
+                yield answer, cell
+
+    def histogram(self, id, min_mp=None):
+        # {their answer: number of profiles}, over profiles with at least min_mp
+        if min_mp is None and id in self._histograms:
+            return self._histograms[id]
+        histogram = defaultdict(int)
+        for answer, cell in self._cells(id, min_mp):
+            if answer is not None:
+                histogram[answer] += cell[_N]
+        histogram = dict(histogram)
+        if min_mp is None:
+            self._histograms[id] = histogram
+        return histogram
+
+    def by_answer(self, id, min_mp=None):
+        # {their answer: [profiles, my_bad, their_bad]}
+        counts = {}
+        for answer, cell in self._cells(id, min_mp):
+            total = counts.setdefault(answer, [0, 0, 0])
+            for i in (_N, _MY_BAD, _THEIR_BAD):
+                total[i] += cell[i]
+        return counts
+
+    def totals(self, id, min_mp=None):
+        # [profiles, my_bad, their_bad] over every answer
+        total = [0, 0, 0]
+        for answer, cell in self._cells(id, min_mp):
+            for i in (_N, _MY_BAD, _THEIR_BAD):
+                total[i] += cell[i]
+        return total
+
+    def most_common_answer(self, id, min_mp=None):
+        # The answer most profiles (with at least min_mp) gave, or None.
+        histogram = self.histogram(id, min_mp)
+        if not histogram:
+            return None
+        return max(sorted(histogram), key=histogram.get)
+
+    def accepted_answers(self, id, min_mp=None):
+        # Their answers that were acceptable to me at least once, most often first.
+        counts = defaultdict(int)
+        for answer, cell in self._cells(id, min_mp):
+            if answer is not None and cell[_ACCEPTED]:
+                counts[answer] += cell[_ACCEPTED]
+        return [answer for answer, n in sorted(counts.iteritems(), key=lambda item: (-item[1], item[0]))]
+
+    def acceptance(self, id, min_mp=None):
+        # Fraction of the profiles (with at least min_mp) that find my answer acceptable.
+        n, my_bad, their_bad = self.totals(id, min_mp)
+        return 1 - float(my_bad) / n if n else None
+
+    def by_importance(self):
+        # {my importance: [profiles, my_bad, their_bad]} over the questions I answered.
+        counts = {}
+        for id, question in self.my_questions.iteritems():
+            total = counts.setdefault(question.importance, [0, 0, 0])
+            for i, n in enumerate(self.totals(id)):
+                total[i] += n
+        return counts
+
+    def with_prefix(self, prefix):
+        # Question ids whose text starts with prefix (ignoring case), in text order.
+        prefix = prefix.lower()
+        i = bisect.bisect_left(self._sorted_texts, (prefix,))
+        ids = []
+        while i < len(self._sorted_texts) and self._sorted_texts[i][0].startswith(prefix):
+            ids.append(self._sorted_texts[i][1])
+            i += 1
+        return ids
+
+    def with_start(self, text):
+        # Question ids whose first 50 characters are those of text.
+        return self._by_start.get(text[:50], [])
@@ -0,0 +1,186 @@
+# Benchmarks the analysis path (store loading, QuestionAnalyzer, rating,
+# filtering, best_to_answer, batch reports, similarity search) on synthetic
+# corpora from synthetic_corpus.py. best_rated_seconds is batch rating end to
+# end, matrix build included; batch_score_per_second leaves the build out.
+#
+#     python benchmarks/bench_analysis.py [--sizes 1000,10000,100000] [--save FILE] [--compare FILE]
+#
+# Each size runs in a process of its own so that peak memory is per size.
+# Corpora are generated once into benchmarks/corpora/. --save writes the
+# results as JSON; --compare checks them against such a file and exits with
+# status 1 if anything got more than --tolerance worse. benchmarks/baseline.json
+# holds the results of the default sizes on a single core with 6GB of memory;
+# timings from another machine are only comparable to a baseline saved there.
+
+import sys, os, json, time, subprocess, resource, random
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+CORPUS_FOLDER = os.path.join(HERE, 'corpora')
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+def corpus(n):
+    from synthetic_corpus import write_corpus
+    folder = os.path.join(CORPUS_FOLDER, str(n))
+    if not os.path.exists(os.path.join(folder, 'profiles.db')):
+        print >>sys.stderr, "Generating %s synthetic profiles in %s"%(n, folder)
+        write_corpus(folder, n)
+    return folder
+
+def point_optimizer_at(folder):
+    import optimizer
+    from config import Config
+    from synthetic_corpus import REAL_USERNAME, SHADOW_USERNAME
+    optimizer.use_config(Config(folder, real_username=REAL_USERNAME, shadow_username=SHADOW_USERNAME))
+
+def synthetic_valuations(Q, seed=0):
+    import optimizer
+    rnd = random.Random(seed)
+    V = optimizer.Valuations(save_name='synthetic_benchmark')
+    for id, question in Q.shadow_questions.iteritems():
+        cat = rnd.choice(V.categories.values() + [None])
+        V.qcategory[id] = cat
+        for option in question.answer_options:
+            V.qrating[id][option.text] = rnd.randint(-10, 10) if cat is not None else 0
+    V.invalidate()
+    return V
+
+class _Timer(object):
+    def __init__(self, results, name):
+        self.results = results
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        self.results[self.name] = time.time() - self.start
+
+def measure(n):
+    folder = corpus(n)
+    point_optimizer_at(folder)
+    import optimizer
+    from question_stats import QuestionStats
+    from scoring import ProfileMatrix
+    stats_file = optimizer.config.question_stats_file
+    if os.path.exists(stats_file):
+        os.remove(stats_file)
+    results = {'profiles': n}
+    with _Timer(results, 'load_seconds'):
+        store = optimizer.open_profile_store()
+        profiles = list(store.iterprofiles(load=('header', 'questions')))
+    with _Timer(results, 'stats_build_seconds'):
+        QuestionStats().build(store)
+    del profiles
+    with _Timer(results, 'analyzer_build_seconds'):
+        Q = optimizer.QuestionAnalyzer()
+    V = synthetic_valuations(Q)
+    profiles = Q.profiles.values()
+    # Valuations.best_rated end to end, the matrix built on first use, from a
+    # fresh analyzer's profiles as find_best_rated gets them
+    with _Timer(results, 'best_rated_seconds'):
+        V.best_rated(Q)
+    start = time.time()
+    matrix = ProfileMatrix(profiles)
+    results['matrix_build_seconds'] = time.time() - start
+    start = time.time()
+    matrix.score(V)[0].top(20)
+    results['batch_score_per_second'] = len(profiles) / max(time.time() - start, 1e-9)
+    # the same ratings one profile at a time, unpacking their questions
+    start = time.time()
+    for profile in profiles:
+        V._compute_rate(profile)
+    results['rate_per_second'] = len(profiles) / max(time.time() - start, 1e-9)
+    V.invalidate()
+    profile_filter = optimizer.ProfileFilter.std_combo(V, 70, 10, 0.0)
+    start = time.time()
+    for profile in profiles:
+        profile_filter.passes(profile)
+    results['filter_per_second'] = len(profiles) / max(time.time() - start, 1e-9)
+    from similarity_index import SimilarityIndex
+    with _Timer(results, 'similarity_build_seconds'):
+        similar = SimilarityIndex()
+        similar.build(store)
+    usernames = [profile.username for profile in profiles[:100]]
+    similar.similar_to(usernames[0])
+    start = time.time()
+    for username in usernames:
+        similar.similar_to(username)
+    results['similarity_queries_per_second'] = len(usernames) / max(time.time() - start, 1e-9)
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        with _Timer(results, 'best_to_answer_seconds'):
+            Q.best_to_answer()
+        # a pre-date report on a few hundred candidates, read back from the store
+        advice = optimizer.NightOfAdvice()
+        advice.show = sorted(Q.shadow_questions)[:20]
+        advice.invalidate()
+        with _Timer(results, 'report_seconds'):
+            optimizer.batch_report(os.path.join(folder, 'report.html'), valuations=V, advice=advice,
+                                   users=[profile.username for profile in profiles[:300]])
+    finally:
+        sys.stdout = stdout
+    # ru_maxrss is in kilobytes on Linux
+    results['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return results
+
+def run(sizes):
+    results = []
+    for n in sizes:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--one', str(n)])
+        results.append(json.loads(output.strip().splitlines()[-1]))
+        print "%7s profiles: %s"%(n, ", ".join("%s=%.3f"%(k, v) for k, v in sorted(results[-1].iteritems())
+                                                 if k != 'profiles'))
+    return results
+
+# timings shorter than this are too noisy to compare
+MIN_SECONDS = 0.05
+
+def _worse(key, old, new, tolerance):
+    # throughputs should not drop, times and memory should not grow
+    if key.endswith('_per_second'):
+        return new < old / (1 + tolerance)
+    if key.endswith('_seconds') and max(old, new) < MIN_SECONDS:
+        return False
+    return new > old * (1 + tolerance)
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    by_size = dict((entry['profiles'], entry) for entry in baseline)
+    for entry in results:
+        old = by_size.get(entry['profiles'])
+        if old is None:
+            continue
+        for key, value in sorted(entry.iteritems()):
+            if key in old and key != 'profiles' and _worse(key, old[key], value, tolerance):
+                regressions.append((entry['profiles'], key, old[key], value))
+    for n, key, old, new in regressions:
+        print "REGRESSION %7s profiles: %s %.3f -> %.3f"%(n, key, old, new)
+    return regressions
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default=",".join(str(n) for n in DEFAULT_SIZES))
+    parser.add_argument('--save')
+    parser.add_argument('--compare')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--one', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.one is not None:
+        print json.dumps(measure(args.one))
+        return 0
+    results = run([int(n) for n in args.sizes.split(',')])
+    if args.save:
+        with open(args.save, 'w') as F:
+            json.dump(results, F, indent=1, sort_keys=True, separators=(',', ': '))
+            F.write("\n")
+    if args.compare:
+        with open(args.compare) as F:
+            if compare(results, json.load(F), args.tolerance):
+                return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,39 @@
+# Times greedy_cover on synthetic corpora of increasing size.
+#
+#     python benchmarks/bench_set_cover.py [n_profiles ...]
+
+import sys, os, random, time, bisect
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from set_cover import greedy_cover
+
+def synthetic_corpus(n_profiles, n_questions=5000, answered=(50, 400), n_candidates=300, seed=0):
+    # Question popularity is roughly Zipf-distributed, like on the site.
+    rnd = random.Random(seed)
+    weights = [1.0 / (i + 1) for i in range(n_questions)]
+    total = sum(weights)
+    cumulative = []
+    acc = 0.0
+    for w in weights:
+        acc += w / total
+        cumulative.append(acc)
+    candidates = set(rnd.sample(range(n_questions), n_candidates))
+    profiles_by_question = dict((id, set()) for id in candidates)
+    sizes = {}
+    for n in xrange(n_profiles):
+        username = 'user%d'%n
+        ids = set(bisect.bisect(cumulative, rnd.random()) for i in xrange(rnd.randint(*answered)))
+        sizes[username] = len(ids)
+        for id in ids & candidates:
+            profiles_by_question[id].add(username)
+    return profiles_by_question, sizes
+
+def main(sizes):
+    for n in sizes:
+        profiles_by_question, profile_sizes = synthetic_corpus(n)
+        start = time.time()
+        groups = greedy_cover(profiles_by_question, profile_sizes)
+        elapsed = time.time() - start
+        print "%7s profiles: %4s groups in %.3fs"%(n, len(groups), elapsed)
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [1000, 10000, 100000])
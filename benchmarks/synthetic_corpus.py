@@ -0,0 +1,137 @@
+# Writes a fake but realistically shaped corpus: a profile store full of
+# StaticProfiles plus StaticQuestionBackups for a real and a shadow account,
+# laid out like BASE_FOLDER. Nothing touches the network or logs in.
+#
+#     python benchmarks/synthetic_corpus.py FOLDER N_PROFILES [SEED]
+
+import sys, os, random, bisect
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cPickle import dump, HIGHEST_PROTOCOL
+
+from optimizer import (StaticProfile, StaticQuestion, StaticUserQuestion, StaticAnswerOption,
+                       StaticQuestionBackup, StaticEssays, StaticPhotoInfo, StaticLookingFor)
+from profile_store import ProfileStore
+from question_history import IMPORTANCES
+from essay_index import ESSAY_FIELDS
+
+REAL_USERNAME = 'synthetic_real'
+SHADOW_USERNAME = 'synthetic_shadow'
+WORDS = ('coffee hiking books music travel dogs cats science art cooking movies '
+         'running yoga politics philosophy games beer wine climbing jazz punk '
+         'garden ocean city night morning friends family code chess bikes').split()
+
+def _static(cls, **attrs):
+    # Builds a Static* object without the okcupyd object its constructor copies from.
+    obj = cls.__new__(cls)
+    obj.__dict__.update(attrs)
+    return obj
+
+class QuestionPool(object):
+    def __init__(self, rnd, n_questions=3000, n_shadow=600, n_real=450):
+        self.texts = {}
+        self.options = {}
+        for id in xrange(1, n_questions + 1):
+            self.texts[id] = u"Synthetic question %s: %s or %s?"%(id, rnd.choice(WORDS), rnd.choice(WORDS))
+            self.options[id] = [u"Answer %s-%s"%(id, k) for k in range(rnd.randint(2, 4))]
+        # popularity is roughly Zipf-distributed
+        ids = range(1, n_questions + 1)
+        rnd.shuffle(ids)
+        self.ids = ids
+        self.cumulative = []
+        acc = 0.0
+        total = sum(1.0 / (i + 1) for i in range(n_questions))
+        for i in range(n_questions):
+            acc += 1.0 / (i + 1) / total
+            self.cumulative.append(acc)
+        # the shadow account answered the popular questions, the real one most of those
+        self.shadow = {}
+        for id in ids[:n_shadow]:
+            options = self.options[id]
+            self.shadow[id] = (rnd.randrange(len(options)),
+                               set(rnd.sample(range(len(options)), rnd.randint(1, len(options)))),
+                               rnd.choice(IMPORTANCES))
+        self.real = dict((id, self.shadow[id]) for id in ids[:n_real])
+
+    def sample(self, rnd, n):
+        return set(self.ids[min(bisect.bisect(self.cumulative, rnd.random()), len(self.ids) - 1)]
+                   for i in xrange(n))
+
+def _essays(rnd):
+    return _static(StaticEssays, **dict((name, u" ".join(rnd.choice(WORDS) for i in range(rnd.randint(20, 120))))
+                                        for name in ESSAY_FIELDS))
+
+def synthetic_profile(rnd, pool, n):
+    questions = []
+    mismatches = 0
+    for id in sorted(pool.sample(rnd, rnd.randint(50, 400))):
+        options = pool.options[id]
+        theirs = rnd.randrange(len(options))
+        mine = pool.shadow.get(id)
+        if mine is None:
+            my_answer = my_matches = None
+            their_matches = rnd.random() < 0.8
+        else:
+            my_answer = options[mine[0]]
+            their_matches = theirs in mine[1]
+            my_matches = rnd.random() < 0.85
+            mismatches += (not their_matches) + (not my_matches)
+        questions.append(_static(StaticQuestion, answered=True, id=id, text=pool.texts[id],
+                                 their_answer=options[theirs], my_answer=my_answer,
+                                 their_answer_matches=their_matches, my_answer_matches=my_matches,
+                                 their_note=(u"because %s"%(rnd.choice(WORDS)) if rnd.random() < 0.03 else None),
+                                 my_note=None))
+    rated = sum(1 for q in questions if q.my_answer is not None) or 1
+    match = max(0, min(99, int(100 - 100.0 * mismatches / (2 * rated) + rnd.gauss(0, 5))))
+    photos = [_static(StaticPhotoInfo, id=n * 10 + k, thumb_nail_left=0, thumb_nail_top=0,
+                      thumb_nail_right=200, thumb_nail_bottom=200,
+                      jpg_uri="http://example.invalid/photos/%s/%s.jpg"%(n, k))
+              for k in range(rnd.randint(1, 6))]
+    return _static(StaticProfile,
+                   username=u"synthetic%06d"%(n),
+                   details={'bodytype': rnd.choice(['thin', 'average', 'fit', 'curvy']),
+                            'height': rnd.randint(150, 200),
+                            'smokes': rnd.choice(['no', 'sometimes']),
+                            'languages': rnd.sample(['english', 'spanish', 'french', 'german'], 2)},
+                   questions=questions,
+                   photos=photos,
+                   looking_for=_static(StaticLookingFor, gentation='everyone', single=True,
+                                       near_me=True, kinds=['new friends'], ages=(25, 40)),
+                   responds=rnd.choice(['very often', 'often', 'selectively']),
+                   essays=_essays(rnd),
+                   id=str(n), age=rnd.randint(18, 60),
+                   match_percentage=match, enemy_percentage=rnd.randint(0, 40),
+                   location=rnd.choice(['Boston, MA', 'Austin, TX', 'Portland, OR']),
+                   gender=rnd.choice(['Woman', 'Man']), orientation='Straight')
+
+def synthetic_backup(pool, answers):
+    backup = _static(StaticQuestionBackup)
+    for importance in IMPORTANCES:
+        setattr(backup, importance, [])
+    for id, (answer, matches, importance) in sorted(answers.iteritems()):
+        options = [_static(StaticAnswerOption, is_users=(k == answer), is_match=(k in matches),
+                           text=text, id=k)
+                   for k, text in enumerate(pool.options[id])]
+        getattr(backup, importance).append(
+            _static(StaticUserQuestion, answered=True, id=id, text=pool.texts[id],
+                    explanation=None, answer_options=options))
+    return backup
+
+def write_corpus(folder, n_profiles, seed=0):
+    # Writes folder/profiles.db and folder/qbackup/{synthetic_real,synthetic_shadow}.
+    rnd = random.Random(seed)
+    pool = QuestionPool(rnd)
+    backup_folder = os.path.join(folder, 'qbackup')
+    for path in (folder, backup_folder):
+        if not os.path.exists(path):
+            os.makedirs(path)
+    for username, answers in ((REAL_USERNAME, pool.real), (SHADOW_USERNAME, pool.shadow)):
+        with open(os.path.join(backup_folder, username), 'wb') as F:
+            dump(synthetic_backup(pool, answers), F, HIGHEST_PROTOCOL)
+    store = ProfileStore(os.path.join(folder, 'profiles.db'), index_interval=None)
+    for n in xrange(n_profiles):
+        store.put(synthetic_profile(rnd, pool, n))
+    store.close()
+    return pool
+
+if __name__ == '__main__':
+    write_corpus(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 0)
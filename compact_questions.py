@@ -0,0 +1,155 @@
+from array import array
+from cPickle import dumps, loads, HIGHEST_PROTOCOL
+
+# Compact storage for the questions of stored profiles.
+#
+# Question texts and answer texts are kept once per ProfileStore, in a
+# QuestionDictionary; a profile's questions are arrays of question ids,
+# answer indices and match flags, which come back as CompactQuestions that
+# look up their strings in the dictionary. Notes are rare and stay per profile.
+
+# tri-state flags (None/False/True), two bits each
+_ANSWERED, _THEIRS_MATCH, _MINE_MATCH = 0, 2, 4
+_FLAG_VALUES = (None, False, True)
+
+def _flag(value, shift):
+    return (0 if value is None else 2 if value else 1) << shift
+
+def _unflag(flags, shift):
+    return _FLAG_VALUES[(flags >> shift) & 3]
+
+class QuestionDictionary(object):
+    def __init__(self):
+        # keys are question ids, values are texts
+        self.texts = {}
+        # keys are question ids, values are lists of answer texts
+        self.answers = {}
+        self._index = {}
+        # entries added since the last take_new(), for the store to log
+        self._new = []
+
+    def add_text(self, id, text):
+        if id not in self.texts:
+            self.texts[id] = text
+            self._new.append((id, text, None))
+
+    def answer_index(self, id, answer):
+        if answer is None:
+            return -1
+        key = (id, answer)
+        index = self._index.get(key)
+        if index is None:
+            L = self.answers.setdefault(id, [])
+            index = self._index[key] = len(L)
+            L.append(answer)
+            self._new.append((id, None, answer))
+        return index
+
+    def answer(self, id, index):
+        if index < 0:
+            return None
+        return self.answers[id][index]
+
+    def take_new(self):
+        new, self._new = self._new, []
+        return new
+
+    def apply(self, entries):
+        # Replays entries as returned by take_new, in order.
+        for id, text, answer in entries:
+            if text is not None:
+                self.add_text(id, text)
+            else:
+                self.answer_index(id, answer)
+        self._new = []
+
+    def entries(self):
+        # Everything in the dictionary, in a form apply() accepts.
+        L = [(id, text, None) for id, text in self.texts.iteritems()]
+        for id, answers in self.answers.iteritems():
+            L.extend((id, None, answer) for answer in answers)
+        return L
+
+    def __getstate__(self):
+        return {'texts': self.texts, 'answers': self.answers}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.texts = state['texts']
+        self.answers = state['answers']
+        for id, answers in self.answers.iteritems():
+            for i, answer in enumerate(answers):
+                self._index[(id, answer)] = i
+
+class CompactQuestion(object):
+    # Reads like a StaticQuestion.
+    __slots__ = ('dictionary', 'id', 'their_index', 'my_index', 'flags',
+                 'their_note', 'my_note', 'username')
+
+    def __init__(self, dictionary, id, their_index, my_index, flags, their_note=None, my_note=None):
+        self.dictionary = dictionary
+        self.id = id
+        self.their_index = their_index
+        self.my_index = my_index
+        self.flags = flags
+        self.their_note = their_note
+        self.my_note = my_note
+
+    @property
+    def text(self):
+        return self.dictionary.texts[self.id]
+
+    @property
+    def their_answer(self):
+        return self.dictionary.answer(self.id, self.their_index)
+
+    @property
+    def my_answer(self):
+        return self.dictionary.answer(self.id, self.my_index)
+
+    @property
+    def answered(self):
+        return _unflag(self.flags, _ANSWERED)
+
+    @property
+    def their_answer_matches(self):
+        return _unflag(self.flags, _THEIRS_MATCH)
+
+    @property
+    def my_answer_matches(self):
+        return _unflag(self.flags, _MINE_MATCH)
+
+def pack_questions(questions, dictionary):
+    # questions are anything with StaticQuestion's attributes
+    ids, theirs, mine, flags = array('i'), array('h'), array('h'), array('B')
+    notes = {}
+    for i, question in enumerate(questions):
+        dictionary.add_text(question.id, question.text)
+        ids.append(question.id)
+        theirs.append(dictionary.answer_index(question.id, question.their_answer))
+        mine.append(dictionary.answer_index(question.id, question.my_answer))
+        flags.append(_flag(question.answered, _ANSWERED) |
+                     _flag(question.their_answer_matches, _THEIRS_MATCH) |
+                     _flag(question.my_answer_matches, _MINE_MATCH))
+        if question.their_note or question.my_note:
+            notes[i] = (question.their_note, question.my_note)
+    return dumps((ids.tostring(), theirs.tostring(), mine.tostring(), flags.tostring(), notes),
+                 HIGHEST_PROTOCOL)
+
+def packed_answers(data):
+    # The question ids and their answer indices (-1 for none) of packed
+    # questions, as the raw data of an array('i') and an array('h'), for
+    # encoding many profiles at once without unpacking their questions
+    ids, theirs, mine, flags, notes = loads(data)
+    return ids, theirs
+
+def unpack_questions(data, dictionary):
+    ids, theirs, mine, flags, notes = loads(data)
+    ids, theirs, mine, flags = (array('i', ids), array('h', theirs),
+                                array('h', mine), array('B', flags))
+    questions = []
+    for i in xrange(len(ids)):
+        their_note, my_note = notes.get(i, (None, None))
+        questions.append(CompactQuestion(dictionary, ids[i], theirs[i], mine[i], flags[i],
+                                         their_note, my_note))
+    return questions
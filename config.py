@@ -0,0 +1,159 @@
+import os
+from cPickle import load
+from ConfigParser import SafeConfigParser
+
+from question_history import QuestionHistory
+
+# Where optimizer keeps its files and which accounts it uses.
+#
+# Creating a Config touches nothing on disk: paths are just computed,
+# config.ini is read (and, if missing, created by asking for the details)
+# the first time a login setting is needed, folders are created when
+# something is written to them, and the saved question backups are only
+# unpickled when asked for. Any setting can be given to the constructor
+# instead, e.g. Config(folder, real_username='me', shadow_username='shadow')
+# for analysis of a copied data folder without a config.ini.
+
+SETTINGS = ('real_username', 'real_password', 'shadow_username', 'shadow_password',
+            'shadow_accounts', 'real_default', 'rate_limit', 'min_rate_limit')
+
+class Config(object):
+    def __init__(self, base_folder, **settings):
+        unknown = set(settings) - set(SETTINGS)
+        if unknown:
+            raise TypeError("unknown settings: %s"%(", ".join(sorted(unknown))))
+        self.base_folder = base_folder
+        self.config_file = os.path.join(base_folder, 'config.ini')
+        # Old layout, one pickle per user; see migrate_profiles()
+        self.profile_folder = os.path.join(base_folder, 'profiles')
+        self.profile_store_file = os.path.join(base_folder, 'profiles.db')
+        self.question_stats_file = os.path.join(base_folder, 'question_stats')
+        self.essay_index_file = os.path.join(base_folder, 'essay_index')
+        self.similarity_index_file = os.path.join(base_folder, 'similarity_index')
+        self.question_backup_folder = os.path.join(base_folder, 'qbackup')
+        self.valuation_folder = os.path.join(base_folder, 'valuations')
+        self.username_registry_file = os.path.join(base_folder, 'usernames')
+        # Old flat username lists, imported into the registry the first time it is opened
+        self.username_file = os.path.join(base_folder, 'users.txt')
+        self.deactivated_file = os.path.join(base_folder, 'deactivated_users.txt')
+        self.fetch_checkpoint_file = os.path.join(base_folder, 'fetch_checkpoint')
+        self.metrics_file = os.path.join(base_folder, 'metrics.json')
+        self.photo_folder = os.path.join(base_folder, 'photos')
+        # saved login cookies, one file per account
+        self.session_folder = os.path.join(base_folder, 'sessions')
+        self._settings = settings
+        self._backups = {}
+
+    def path(self, name):
+        # A file directly in the base folder
+        return os.path.join(self.base_folder, name)
+
+    def folder(self, path):
+        # path, created first if need be; for folders about to be written to
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
+
+    # ---- config.ini ----
+
+    def __getattr__(self, name):
+        if name not in SETTINGS:
+            raise AttributeError(name)
+        if name not in self._settings:
+            self._read_settings()
+        return self._settings[name]
+
+    def has_setting(self, name):
+        # Whether setting name can be had without asking for config.ini
+        return name in self._settings or os.path.exists(self.config_file)
+
+    def _read_settings(self):
+        if not os.path.exists(self.config_file):
+            self.create_config_file()
+        parser = SafeConfigParser()
+        parser.read(self.config_file)
+        settings = {}
+        settings['real_username'] = parser.get("real_login", "username")
+        settings['real_password'] = parser.get("real_login", "password")
+        settings['shadow_username'] = parser.get("shadow_login", "username")
+        settings['shadow_password'] = parser.get("shadow_login", "password")
+        # [shadow_login] followed by any extra [shadow_login_*] sections
+        settings['shadow_accounts'] = []
+        for section in ["shadow_login"] + sorted(s for s in parser.sections() if s.startswith("shadow_login_")):
+            username = parser.get(section, "username")
+            if username:
+                settings['shadow_accounts'].append((username, parser.get(section, "password")))
+        settings['real_default'] = bool(int(parser.get("settings", "real_default")))
+        settings['rate_limit'] = float(parser.get("settings", "rate_limit"))
+        # optional: how far below rate_limit the delay may drop while responses are healthy
+        settings['min_rate_limit'] = None
+        if parser.has_option("settings", "min_rate_limit"):
+            settings['min_rate_limit'] = float(parser.get("settings", "min_rate_limit"))
+        # settings given to the constructor win
+        settings.update(self._settings)
+        self._settings = settings
+
+    def create_config_file(self):
+        config_file = self.config_file
+        print "The following info will be stored, unencyrpted, in %s"%(config_file)
+        print "Your real user is your OKCupid account where you interact with others."
+        print "Your shadow user is an OKCupid account used just to retrieve profile information."
+        print "If you do not intend to create a shadow user, leave the corresponding fields blank."
+        print "More shadow users for concurrent fetching can be added later as [shadow_login_2], etc."
+        real_username = raw_input("Real username: ")
+        real_password = raw_input("Real password: ")
+        shadow_username = raw_input("Shadow username: ")
+        shadow_password = raw_input("Shadow password: ")
+        print "Adding a delay (e.g. 5 seconds) between requests may help prevent you from getting into trouble with OKCupid."
+        while True:
+            try:
+                rate_limit = float(raw_input("Rate limit (in seconds): "))
+            except ValueError:
+                print "Please enter an integer or floating point number"
+            else:
+                break
+        with open(config_file,'w') as F:
+            F.write("[real_login]\n")
+            F.write("username = %s\n"%(real_username))
+            F.write("password = %s\n\n"%(real_password))
+            F.write("[shadow_login]\n")
+            F.write("username = %s\n"%(shadow_username))
+            F.write("password = %s\n\n"%(shadow_password))
+            F.write("[settings]\n")
+            F.write("real_default = %s\n"%(1 if (len(shadow_username) == 0) else 0))
+            F.write("rate_limit = %s\n"%(rate_limit))
+
+    # ---- question backups ----
+
+    def backup_file(self, username):
+        return os.path.join(self.question_backup_folder, username)
+
+    def history_file(self, username):
+        # Every version of username's backup; see question_history.py
+        return os.path.join(self.question_backup_folder, username + '.history')
+
+    def saved_backup(self, username, version=None):
+        # The StaticQuestionBackup saved for username, unpickled once; None if there is none.
+        # With version, that version from the history instead (-1 the latest, -2 the one before).
+        if (username, version) not in self._backups:
+            backup = None
+            if version is not None:
+                backup = QuestionHistory(self.history_file(username)).snapshot(version)
+            elif username and os.path.exists(self.backup_file(username)):
+                with open(self.backup_file(username)) as F:
+                    backup = load(F)
+            self._backups[(username, version)] = backup
+        return self._backups[(username, version)]
+
+    def forget_backup(self, username):
+        # After a new backup of username was written
+        for key in [key for key in self._backups if key[0] == username]:
+            del self._backups[key]
+
+    @property
+    def real_backup(self):
+        return self.saved_backup(self.real_username)
+
+    @property
+    def shadow_backup(self):
+        return self.saved_backup(self.shadow_username)
@@ -0,0 +1,319 @@
+import os, re, shutil
+from array import array
+from cPickle import dump, load, HIGHEST_PROTOCOL
+from collections import defaultdict
+from math import log
+
+from profile_store import PUT, DELETE
+
+# Inverted index over the essays of the profiles in a ProfileStore, so that
+# searching them does not mean unpickling every profile.
+#
+# Each profile is a document, numbered in the order it was added; a profile
+# that is stored again gets a new number and its old one is dropped, as in
+# the store itself, so postings only ever grow at the end and are kept as
+# arrays. For every term, docs[i] is a document containing it and
+# positions[starts[i]:starts[i + 1]] where: field number << 16 | word number.
+# Dropped documents are skipped when searching and squeezed out by compact().
+#
+# Queries are words and "quoted phrases", a leading - excluding one:
+#     index.search('hiking "board games" -smoking')
+# ranks profiles containing any of the words or phrases by Okapi BM25, and
+# index.matching(...) gives the profiles containing all of them. Like
+# QuestionStats, a saved index follows the store record by record.
+
+ESSAY_FIELDS = ('self_summary', 'my_life', 'good_at', 'people_first_notice',
+                'favorites', 'six_things', 'think_about', 'friday_night',
+                'private_admission', 'message_me_if')
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_WORD = re.compile(r"\w+(?:'\w+)*", re.UNICODE)
+_CLAUSE = re.compile(r'(-?)"([^"]*)"|(-?)(\S+)', re.UNICODE)
+
+def tokenize(text):
+    if not text:
+        return []
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    return _WORD.findall(text.lower())
+
+def parse_query(query):
+    # [(words, excluded)], one per word or quoted phrase
+    clauses = []
+    for match in _CLAUSE.finditer(query):
+        if match.group(2) is not None:
+            excluded, text = match.group(1), match.group(2)
+        else:
+            excluded, text = match.group(3), match.group(4)
+        words = tuple(tokenize(text))
+        if words:
+            clauses.append((words, bool(excluded)))
+    return clauses
+
+def _field_numbers(fields):
+    if fields is None:
+        return None
+    for field in fields:
+        if field not in ESSAY_FIELDS:
+            raise ValueError("unknown essay field: %s"%(field))
+    return [ESSAY_FIELDS.index(field) for field in fields]
+
+def _contains(words, phrase):
+    n = len(phrase)
+    return any(tuple(words[i:i + n]) == phrase for i in range(len(words) - n + 1))
+
+def essays_match(essays, clauses, fields=None):
+    # What matching() decides, worked out from the essays themselves; for
+    # profiles that are not in the index (yet).
+    texts = [tokenize(getattr(essays, field, None)) for field in (fields or ESSAY_FIELDS)]
+    for words, excluded in clauses:
+        if any(_contains(text, words) for text in texts) == excluded:
+            return False
+    return True
+
+class EssayIndex(object):
+    def __init__(self):
+        # keys are terms, values are (docs, starts, positions) arrays
+        self.postings = {}
+        # per document number: username (None once dropped), 1 if live, number of words
+        self.usernames = []
+        self.live = bytearray()
+        self.lengths = array('i')
+        # keys are usernames, values are live document numbers
+        self.docs = {}
+        self.total_length = 0
+        # how far into the profile store this index reaches
+        self.generation = None
+        self.position = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, username):
+        return username in self.docs
+
+    def add(self, profile):
+        # Indexes profile's essays, replacing what was indexed for it before.
+        self.remove(profile.username)
+        essays = getattr(profile, 'essays', None)
+        doc = len(self.usernames)
+        terms = defaultdict(list)
+        length = 0
+        for number, field in enumerate(ESSAY_FIELDS):
+            words = tokenize(getattr(essays, field, None))[:1 << 16]
+            for i, word in enumerate(words):
+                terms[word].append(number << 16 | i)
+            length += len(words)
+        for term, positions in terms.iteritems():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = (array('i'), array('i'), array('i'))
+            docs, starts, all_positions = posting
+            docs.append(doc)
+            starts.append(len(all_positions))
+            all_positions.extend(positions)
+        self.usernames.append(profile.username)
+        self.live.append(1)
+        self.lengths.append(length)
+        self.docs[profile.username] = doc
+        self.total_length += length
+
+    def remove(self, username):
+        doc = self.docs.pop(username, None)
+        if doc is not None:
+            self.usernames[doc] = None
+            self.live[doc] = 0
+            self.total_length -= self.lengths[doc]
+
+    def record(self, store, profile=None, removed=None):
+        # Account for a write just made to store: profile was stored, or the
+        # profile of username removed was deleted; neither if the write left
+        # the essays as they were.
+        if profile is not None:
+            self.add(profile)
+        if removed is not None:
+            self.remove(removed)
+        self.position = store.end
+
+    # ---- searching ----
+
+    def _occurrences(self, np, words, fields, live):
+        # (live documents, occurrences in each) of words in a row, within fields if given
+        empty = np.zeros(0, dtype=np.intc)
+        postings = [self.postings.get(word) for word in words]
+        if None in postings:
+            return empty, empty
+        if len(words) == 1 and fields is None:
+            docs = np.frombuffer(postings[0][0], dtype=np.intc)
+            counts = np.diff(np.append(np.frombuffer(postings[0][1], dtype=np.intc), len(postings[0][2])))
+            keep = live[docs]
+            return docs[keep], counts[keep]
+        # occurrences as document << 32 | position, which sorts the way the
+        # postings are laid out: those of the rarest word first, then of each
+        # other word only in the documents still in the running, keeping the
+        # occurrences where that word is found the right distance away
+        order = sorted(range(len(words)), key=lambda k: len(postings[k][2]))
+        rarest = order[0]
+        keys = self._keys(np, postings[rarest])
+        keys = keys[live[keys >> 32]]
+        if fields is not None:
+            in_fields = np.zeros(len(ESSAY_FIELDS), dtype=bool)
+            in_fields[fields] = True
+            keys = keys[in_fields[(keys & 0xffffffff) >> 16]]
+        for k in order[1:]:
+            if not len(keys):
+                return empty, empty
+            word_keys = self._keys(np, postings[k], np.unique(keys >> 32))
+            wanted = keys + (k - rarest)
+            i = np.minimum(np.searchsorted(word_keys, wanted), max(len(word_keys) - 1, 0))
+            keys = keys[word_keys[i] == wanted] if len(word_keys) else keys[:0]
+        if not len(keys):
+            return empty, empty
+        doc_of = keys >> 32
+        first = np.flatnonzero(np.append(True, doc_of[1:] != doc_of[:-1]))
+        return doc_of[first].astype(np.intc), np.diff(np.append(first, len(keys)))
+
+    def _keys(self, np, posting, only=None):
+        # A term's occurrences as document << 32 | position, in the documents only if given
+        docs, starts, positions = posting
+        docs = np.frombuffer(docs, dtype=np.intc)
+        starts = np.frombuffer(starts, dtype=np.intc)
+        stops = np.append(starts[1:], len(positions))
+        if only is not None:
+            rows = np.minimum(np.searchsorted(docs, only), len(docs) - 1)
+            rows = rows[docs[rows] == only]
+            docs, starts, stops = docs[rows], starts[rows], stops[rows]
+        counts = stops - starts
+        # indices of every position in the chosen runs
+        runs = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        return ((np.repeat(docs.astype(np.int64), counts) << 32) |
+                np.frombuffer(positions, dtype=np.intc)[runs])
+
+    def _evaluate(self, query, fields, require_all):
+        # (documents matching query, their BM25 scores); both None without any
+        # word or phrase that is not excluded, in which case require_all
+        # matches every live document not excluded.
+        import numpy as np
+        clauses = parse_query(query)
+        fields = _field_numbers(fields)
+        n = len(self.usernames)
+        live = np.frombuffer(self.live, dtype=np.uint8).astype(bool) if n else np.zeros(0, dtype=bool)
+        allowed = live.copy()
+        scores = np.zeros(n)
+        hits = np.zeros(n, dtype=np.intc)
+        included = 0
+        N = len(self.docs)
+        average = float(self.total_length) / N if N and self.total_length else 1.0
+        lengths = np.frombuffer(self.lengths, dtype=np.intc) if n else np.zeros(0, dtype=np.intc)
+        for words, excluded in clauses:
+            docs, counts = self._occurrences(np, words, fields, live)
+            if excluded:
+                allowed[docs] = False
+                continue
+            included += 1
+            if not len(docs):
+                continue
+            idf = log(1 + (N - len(docs) + 0.5) / (len(docs) + 0.5))
+            tf = counts.astype(np.float64)
+            scores[docs] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * lengths[docs] / average))
+            hits[docs] += 1
+        if not included:
+            return (np.flatnonzero(allowed) if require_all else None), None
+        matched = allowed & ((hits == included) if require_all else (hits > 0))
+        docs = np.flatnonzero(matched)
+        return docs, scores[docs]
+
+    def search(self, query, k=20, fields=None, require_all=False):
+        # [(score, username)] for the k best matches (all with k None), best first.
+        # Documents need any of the query's words and phrases, or with
+        # require_all every one of them, and none of the excluded ones.
+        docs, scores = self._evaluate(query, fields, require_all)
+        if scores is None or not len(docs):
+            return []
+        import numpy as np
+        if k is not None and len(docs) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            docs, scores = docs[top], scores[top]
+        order = np.lexsort((docs, -scores))
+        return [(float(scores[i]), self.usernames[docs[i]]) for i in order]
+
+    def matching(self, query, fields=None):
+        # Usernames whose essays (the given fields of them) contain every word
+        # and phrase of query and none of the excluded ones.
+        docs, scores = self._evaluate(query, fields, True)
+        return set(self.usernames[doc] for doc in docs)
+
+    # ---- following a ProfileStore ----
+
+    def compact(self):
+        # Renumbers the live documents, dropping the postings of the others.
+        import numpy as np
+        live = np.frombuffer(self.live, dtype=np.uint8).astype(bool)
+        numbers = np.cumsum(live) - 1
+        postings = {}
+        for term, (docs, starts, positions) in self.postings.iteritems():
+            docs = np.frombuffer(docs, dtype=np.intc)
+            starts = np.frombuffer(starts, dtype=np.intc)
+            keep = live[docs]
+            if not keep.any():
+                continue
+            counts = np.diff(np.append(starts, len(positions)))
+            kept_positions = np.frombuffer(positions, dtype=np.intc)[np.repeat(keep, counts)]
+            counts = counts[keep]
+            new = (array('i'), array('i'), array('i'))
+            new[0].fromstring(numbers[docs[keep]].astype(np.intc).tostring())
+            new[1].fromstring((np.cumsum(counts) - counts).astype(np.intc).tostring())
+            new[2].fromstring(kept_positions.astype(np.intc).tostring())
+            postings[term] = new
+        self.postings = postings
+        kept = np.flatnonzero(live)
+        self.usernames = [self.usernames[doc] for doc in kept]
+        self.lengths = array('i', [self.lengths[doc] for doc in kept])
+        self.live = bytearray([1]) * len(kept)
+        self.docs = dict((username, doc) for doc, username in enumerate(self.usernames))
+
+    def build(self, store):
+        self.__init__()
+        for profile in store.iterprofiles(load=('header', 'essays')):
+            self.add(profile)
+        self.generation = store.generation
+        self.position = store.end
+
+    def catch_up(self, store):
+        # Apply every store record written since this index was saved.
+        if self.generation != store.generation or self.position > store.end:
+            self.build(store)
+            return
+        for offset, kind, username, prev, payload in store.records(self.position):
+            if kind == PUT:
+                self.add(store.decode(payload))
+            elif kind == DELETE:
+                self.remove(username)
+        self.position = store.end
+
+    def save(self, filename):
+        if len(self.usernames) > 2 * len(self.docs) + 1000:
+            self.compact()
+        tmpfile = filename + '.tmp'
+        with open(tmpfile, 'wb') as F:
+            dump(self, F, HIGHEST_PROTOCOL)
+        shutil.move(tmpfile, filename)
+
+    @classmethod
+    def load(cls, filename, store):
+        index = None
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'rb') as F:
+                    index = load(F)
+            except Exception:
+                index = None
+        if index is None:
+            index = cls()
+            index.build(store)
+        else:
+            index.catch_up(store)
+        return index
@@ -0,0 +1,94 @@
+import os, threading, traceback, zlib
+from Queue import Queue
+
+# Runs several requests at once (profile fetches, question responses), one
+# session per worker, and hands the results back to the calling thread in
+# completion order. Sessions on one account share its rate limiter, which
+# is thread safe; see rate_limit.py.
+
+class Checkpoint(object):
+    # Append-only record of which keys (usernames, question ids) a run has
+    # finished with, one "status key" line each, so an interrupted run can resume.
+    # plan, if given, is what the run set out to do (e.g. the sorted keys): a
+    # record left by a run with another plan is discarded, so it cannot make a
+    # later, different run skip anything.
+    def __init__(self, filename, plan=None):
+        self.filename = filename
+        self.plan = None if plan is None else "%08x"%(zlib.crc32(repr(plan)) & 0xffffffff)
+        self.done = {}
+        recorded_plan = None
+        if os.path.exists(filename):
+            with open(filename) as F:
+                for line in F:
+                    parts = line.split()
+                    if len(parts) == 3 and parts[:2] == ['#', 'plan']:
+                        recorded_plan = parts[2]
+                    elif len(parts) == 2:
+                        status, key = parts
+                        self.done[key] = status
+        if self.plan is not None and recorded_plan != self.plan:
+            self.done = {}
+            self._file = open(filename, 'w')
+            self._file.write("# plan %s\n"%(self.plan))
+        else:
+            self._file = open(filename, 'a')
+
+    def __contains__(self, key):
+        return str(key) in self.done
+
+    def mark(self, key, status):
+        self.done[str(key)] = status
+        self._file.write("%s %s\n"%(status, key))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self, finished=False):
+        self._file.close()
+        if finished:
+            os.remove(self.filename)
+
+_DONE = object()
+
+def fetch_all(sessions, keys, fetch):
+    # Calls fetch(session, key) for every key with one worker thread per
+    # session, and yields (key, result, error) as calls complete.
+    # error is None on success, otherwise the exception (result is then None).
+    todo = Queue()
+    for key in keys:
+        todo.put(key)
+    results = Queue()
+
+    def work(session):
+        while True:
+            key = todo.get()
+            if key is _DONE:
+                results.put(_DONE)
+                return
+            try:
+                results.put((key, fetch(session, key), None))
+            except Exception as e:
+                traceback.print_exc()
+                results.put((key, None, e))
+
+    threads = []
+    for session in sessions:
+        todo.put(_DONE)
+        thread = threading.Thread(target=work, args=(session,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    running = len(threads)
+    try:
+        while running:
+            # a timeout keeps the main thread responsive to KeyboardInterrupt
+            item = results.get(True, 1e9)
+            if item is _DONE:
+                running -= 1
+            else:
+                yield item
+    finally:
+        # stop handing out work if the caller gave up early
+        while not todo.empty():
+            todo.get()
+        for thread in threads:
+            todo.put(_DONE)
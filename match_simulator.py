@@ -0,0 +1,165 @@
+import numpy as np
+
+# Offline what-if estimates of how changing one of my questions (its importance,
+# which of their answers I accept, or my own answer) would move my match
+# percentage with every profile in a corpus, without trying it on the account.
+#
+# The model is OkCupid's published one: with n questions both sides answered,
+#   mine   = sum of my importance weights where their answer is acceptable to me
+#            / sum of my importance weights
+#   theirs = the same from their side
+#   match  = sqrt(mine * theirs) - 1/n
+# Scraped profiles record whether each side's answer was acceptable to the other
+# (their_answer_matches, my_answer_matches) but not their importances, so
+# their side is weighted equally. For a different answer of mine, whether they
+# would accept it is estimated: they do if it is their own answer, and otherwise
+# with the rate at which people answering differently from me accept my current
+# answer to that question.
+#
+# Every candidate change is evaluated at once: each one only touches the
+# (profile, question) entries of one question, so its effect is a vectorized
+# update of those profiles' sums, totalled per candidate with bincount.
+
+IMPORTANCE_WEIGHTS = {'mandatory': 250, 'very_important': 50, 'somewhat_important': 10,
+                      'little_important': 1, 'not_important': 0}
+
+class MatchSimulator(object):
+    def __init__(self, profiles, my_questions):
+        # profiles: anything with questions; my_questions: question id -> question
+        # with importance, answer, matches and answer_options (as in
+        # QuestionAnalyzer.shadow_questions)
+        self.my_questions = my_questions
+        self.usernames = []
+        profile_index, question_ids, answers, theirs_ok, mine_ok = [], [], [], [], []
+        for profile in profiles:
+            i = len(self.usernames)
+            self.usernames.append(profile.username)
+            for question in profile.questions:
+                if question.id not in my_questions or question.their_answer is None or question.my_answer is None:
+                    continue
+                profile_index.append(i)
+                question_ids.append(question.id)
+                answers.append(question.their_answer)
+                theirs_ok.append(bool(question.their_answer_matches))
+                mine_ok.append(bool(question.my_answer_matches))
+        self.profile = np.array(profile_index, dtype=np.int64)
+        self.qid = np.array(question_ids, dtype=np.int64)
+        self.their_answer = answers
+        self.theirs_ok = np.array(theirs_ok, dtype=np.float64)
+        self.mine_ok = np.array(mine_ok, dtype=np.float64)
+        self.weight = np.array([IMPORTANCE_WEIGHTS[my_questions[id].importance] for id in question_ids],
+                               dtype=np.float64)
+        n = len(self.usernames)
+        self.n = np.bincount(self.profile, minlength=n).astype(np.float64)
+        self.mine_num = np.bincount(self.profile, self.weight * self.theirs_ok, minlength=n)
+        self.mine_den = np.bincount(self.profile, self.weight, minlength=n)
+        self.theirs_num = np.bincount(self.profile, self.mine_ok, minlength=n)
+        self.baseline = self._match(self.n, self.mine_num, self.mine_den, self.theirs_num)
+        # entry indices of each question
+        self._by_question = {}
+        order = np.argsort(self.qid, kind='mergesort')
+        ids, starts = np.unique(self.qid[order], return_index=True)
+        for id, start, stop in zip(ids, starts, list(starts[1:]) + [len(order)]):
+            self._by_question[int(id)] = order[start:stop]
+
+    def _match(self, n, mine_num, mine_den, theirs_num):
+        # In percent; 0 where nothing is in common. With no weight on my side
+        # (everything irrelevant) my side counts as satisfied.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mine = np.where(mine_den > 0, mine_num / mine_den, 1.0)
+            theirs = np.where(n > 0, theirs_num / n, 0.0)
+            match = np.sqrt(mine * theirs) - np.where(n > 0, 1.0 / n, 0.0)
+        return np.where(n > 0, np.clip(match, 0, 1), 0.0) * 100
+
+    def _gains(self, entries, candidate, new_weight, new_theirs_ok, new_mine_ok, n_candidates):
+        # entries[k] is an entry index that candidate[k] changes to the given
+        # weight and acceptabilities. Returns each candidate's total change in
+        # match and the number of profiles it touches.
+        p = self.profile[entries]
+        mine_num = self.mine_num[p] + new_weight * new_theirs_ok - self.weight[entries] * self.theirs_ok[entries]
+        mine_den = self.mine_den[p] + new_weight - self.weight[entries]
+        theirs_num = self.theirs_num[p] + new_mine_ok - self.mine_ok[entries]
+        delta = self._match(self.n[p], mine_num, mine_den, theirs_num) - self.baseline[p]
+        return (np.bincount(candidate, delta, minlength=n_candidates),
+                np.bincount(candidate, minlength=n_candidates))
+
+    def importance_changes(self):
+        # [(question id, importance)] for every other importance of every question
+        candidates, entries, labels, weights = [], [], [], []
+        for id, rows in sorted(self._by_question.iteritems()):
+            for importance, weight in sorted(IMPORTANCE_WEIGHTS.iteritems()):
+                if importance == self.my_questions[id].importance:
+                    continue
+                entries.append(rows)
+                candidates.append(np.repeat(len(labels), len(rows)))
+                weights.append(np.repeat(float(weight), len(rows)))
+                labels.append((id, 'importance', importance))
+        if not labels:
+            return labels, np.zeros(0), np.zeros(0)
+        entries = np.concatenate(entries)
+        gains, affected = self._gains(entries, np.concatenate(candidates), np.concatenate(weights),
+                                      self.theirs_ok[entries], self.mine_ok[entries], len(labels))
+        return labels, gains, affected
+
+    def acceptance_changes(self):
+        # [(question id, answer)]: start or stop accepting that answer of theirs
+        candidates, entries, labels, accepted = [], [], [], []
+        for id, rows in sorted(self._by_question.iteritems()):
+            question = self.my_questions[id]
+            by_answer = {}
+            for row in rows:
+                by_answer.setdefault(self.their_answer[row], []).append(row)
+            for answer, answer_rows in sorted(by_answer.iteritems()):
+                accept = answer not in question.matches
+                entries.append(np.array(answer_rows, dtype=np.int64))
+                candidates.append(np.repeat(len(labels), len(answer_rows)))
+                accepted.append(np.repeat(float(accept), len(answer_rows)))
+                labels.append((id, 'accept' if accept else 'reject', answer))
+        if not labels:
+            return labels, np.zeros(0), np.zeros(0)
+        entries = np.concatenate(entries)
+        gains, affected = self._gains(entries, np.concatenate(candidates), self.weight[entries],
+                                      np.concatenate(accepted), self.mine_ok[entries], len(labels))
+        return labels, gains, affected
+
+    def answer_changes(self):
+        # [(question id, answer)]: answer that instead of my current answer
+        candidates, entries, labels, accepted = [], [], [], []
+        for id, rows in sorted(self._by_question.iteritems()):
+            question = self.my_questions[id]
+            answers = [self.their_answer[row] for row in rows]
+            different = [self.mine_ok[row] for row, answer in zip(rows, answers) if answer != question.answer]
+            rate = sum(different) / len(different) if different else 0.0
+            for option in question.answer_options:
+                if option.text == question.answer:
+                    continue
+                entries.append(rows)
+                candidates.append(np.repeat(len(labels), len(rows)))
+                accepted.append(np.array([1.0 if answer == option.text else rate for answer in answers]))
+                labels.append((id, 'answer', option.text))
+        if not labels:
+            return labels, np.zeros(0), np.zeros(0)
+        entries = np.concatenate(entries)
+        gains, affected = self._gains(entries, np.concatenate(candidates), self.weight[entries],
+                                      self.theirs_ok[entries], np.concatenate(accepted), len(labels))
+        return labels, gains, affected
+
+    def rank(self, k=None):
+        # Every candidate change as (mean change in match over the corpus, in
+        # percentage points, profiles touched, question id, kind, value), best first.
+        ranked = []
+        total = max(len(self.usernames), 1)
+        for labels, gains, affected in (self.importance_changes(), self.acceptance_changes(),
+                                        self.answer_changes()):
+            for (id, kind, value), gain, n in zip(labels, gains, affected):
+                ranked.append((gain / total, int(n), id, kind, value))
+        ranked.sort(key=lambda item: -item[0])
+        return ranked if k is None else ranked[:k]
+
+    def error(self, profiles):
+        # Mean absolute difference between the modelled and the observed match
+        # percentage, as a check on the model.
+        observed = dict((profile.username, profile.match_percentage) for profile in profiles)
+        diffs = [abs(self.baseline[i] - observed[username]) for i, username in enumerate(self.usernames)
+                 if observed.get(username) is not None]
+        return sum(diffs) / len(diffs) if diffs else None
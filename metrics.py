@@ -0,0 +1,149 @@
+import time, json, threading, cProfile, pstats, shutil
+from contextlib import contextmanager
+
+# Timings and counts from fetching and analysis, in one place so that a long
+# scrape or a slow analysis can be broken down afterwards:
+#
+#     from metrics import metrics
+#     with metrics.timer('analyzer build'): ...
+#     metrics.save('metrics.json')
+#
+# A timing is kept as its number of samples, total, maximum and, if given,
+# the number of items handled, from which a throughput is derived.
+# Everything is safe to record from worker threads; worker processes send
+# their state() back to be merged into the parent's registry.
+
+class Counters(object):
+    # Named counts that worker threads can bump safely.
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, n=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + n
+
+    def get(self, name):
+        return self._counts.get(name, 0)
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+class Metrics(Counters):
+    def __init__(self):
+        Counters.__init__(self)
+        # keys are names, values are [samples, total, max, items]
+        self._timings = {}
+        self._local = threading.local()
+
+    def record(self, name, value, items=None):
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = [0, 0.0, 0.0, 0]
+            timing[0] += 1
+            timing[1] += value
+            timing[2] = max(timing[2], value)
+            if items is not None:
+                timing[3] += items
+
+    @contextmanager
+    def timer(self, name, items=None):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start, items)
+
+    # ---- HTTP ----
+
+    def response_hook(self, response, *args, **kwargs):
+        # A requests response hook: latency and status of every request,
+        # and a count of requests made by the current thread.
+        self.record('http request seconds', response.elapsed.total_seconds())
+        self.add('http status %s'%(response.status_code))
+        self._local.requests = self.thread_requests() + 1
+
+    def thread_requests(self):
+        # How many requests the current thread has made so far
+        return getattr(self._local, 'requests', 0)
+
+    # ---- reporting ----
+
+    def as_dict(self):
+        with self._lock:
+            timings = dict((name, list(timing)) for name, timing in self._timings.iteritems())
+        result = {'counters': Counters.as_dict(self), 'timings': {}}
+        for name, (samples, total, longest, items) in timings.iteritems():
+            entry = {'samples': samples, 'total': total, 'mean': total / samples, 'max': longest}
+            if items:
+                entry['items'] = items
+                entry['per_second'] = items / total if total else None
+            result['timings'][name] = entry
+        return result
+
+    def save(self, filename):
+        tmpfile = filename + '.tmp'
+        with open(tmpfile, 'w') as F:
+            json.dump(self.as_dict(), F, indent=1, sort_keys=True)
+        shutil.move(tmpfile, filename)
+
+    def show(self):
+        data = self.as_dict()
+        for name, entry in sorted(data['timings'].iteritems()):
+            line = "%-40s %7s x %9.4f = %9.2f (max %.4f)"%(name, entry['samples'], entry['mean'],
+                                                          entry['total'], entry['max'])
+            if entry.get('per_second'):
+                line += ", %.0f/s"%(entry['per_second'])
+            print line
+        for name, n in sorted(data['counters'].iteritems()):
+            print "%-40s %7s"%(name, n)
+
+    def reset(self):
+        Counters.reset(self)
+        with self._lock:
+            self._timings.clear()
+
+    # ---- across processes ----
+
+    def state(self):
+        # Everything recorded so far, picklable, for merge() in another process
+        with self._lock:
+            return dict(self._counts), dict((name, list(timing)) for name, timing in self._timings.iteritems())
+
+    def merge(self, state):
+        # Adds in what another process recorded, as returned by its state()
+        counts, timings = state
+        with self._lock:
+            for name, n in counts.iteritems():
+                self._counts[name] = self._counts.get(name, 0) + n
+            for name, (samples, total, longest, items) in timings.iteritems():
+                timing = self._timings.get(name)
+                if timing is None:
+                    timing = self._timings[name] = [0, 0.0, 0.0, 0]
+                timing[0] += samples
+                timing[1] += total
+                timing[2] = max(timing[2], longest)
+                timing[3] += items
+
+metrics = Metrics()
+
+@contextmanager
+def profiled(filename=None, top=30, sort='cumulative'):
+    # Runs the body under cProfile, prints the top entries and, with a
+    # filename, keeps the raw stats for pstats or a viewer.
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        if filename is not None:
+            profile.dump_stats(filename)
+        if top:
+            pstats.Stats(profile).sort_stats(sort).print_stats(top)
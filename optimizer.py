@@ -1,103 +1,278 @@
-import sys, os, shutil, itertools, codecs
+import sys, os, shutil, itertools, weakref, time, heapq, multiprocessing, zlib, threading, types
 from cPickle import dump, load
-from ConfigParser import SafeConfigParser
 from collections import defaultdict
-from requests.exceptions import HTTPError, ConnectionError
-import okcupyd
-from okcupyd.profile import Profile
-from okcupyd.user import User
-from okcupyd.session import Session, RateLimiter
 
 import module_locator
-BASE_FOLDER = module_locator.module_path()
-PROFILE_FOLDER = os.path.join(BASE_FOLDER, 'profiles')
-if not os.path.exists(PROFILE_FOLDER):
-    os.mkdir(PROFILE_FOLDER)
-QUESTION_BACKUP_FOLDER = os.path.join(BASE_FOLDER, 'qbackup')
-if not os.path.exists(QUESTION_BACKUP_FOLDER):
-    os.mkdir(QUESTION_BACKUP_FOLDER)
-VALUATION_FOLDER = os.path.join(BASE_FOLDER, 'valuations')
-if not os.path.exists(VALUATION_FOLDER):
-    os.mkdir(VALUATION_FOLDER)
-USERNAME_FILE = os.path.join(BASE_FOLDER, 'users.txt')
-DEACTIVATED_FILE = os.path.join(BASE_FOLDER, 'deactivated_users.txt')
-
-def setup():
-    config_file = os.path.join(BASE_FOLDER, 'config.ini')
-    if not os.path.exists(config_file):
-        print "The following info will be stored, unencyrpted, in %s"%(config_file)
-        print "Your real user is your OKCupid account where you interact with others."
-        print "Your shadow user is an OKCupid account used just to retrieve profile information."
-        print "If you do not intend to create a shadow user, leave the corresponding fields blank."
-        real_username = raw_input("Real username: ")
-        real_password = raw_input("Real password: ")
-        shadow_username = raw_input("Shadow username: ")
-        shadow_password = raw_input("Shadow password: ")
-        print "Adding a delay (e.g. 5 seconds) between requests may help prevent you from getting into trouble with OKCupid."
-        while True:
-            try:
-                rate_limit = float(raw_input("Rate limit (in seconds): "))
-            except ValueError:
-                print "Please enter an integer or floating point number"
-            else:
-                break
-        with open(config_file,'w') as F:
-            F.write("[real_login]\n")
-            F.write("username = %s\n"%(real_username))
-            F.write("password = %s\n\n"%(real_password))
-            F.write("[shadow_login]\n")
-            F.write("username = %s\n"%(shadow_username))
-            F.write("password = %s\n\n"%(shadow_password))
-            F.write("[settings]\n")
-            F.write("real_default = %s\n"%(1 if (len(shadow_username) == 0) else 0))
-            F.write("rate_limit = %s\n"%(rate_limit))
-    global REAL_USERNAME, REAL_PASSWORD, SHADOW_USERNAME, SHADOW_PASSWORD
-    global REAL_DEFAULT, RATE_LIMIT
-    parser = SafeConfigParser()
-    parser.read(config_file)
-    REAL_USERNAME = parser.get("real_login", "username")
-    REAL_PASSWORD = parser.get("real_login", "password")
-    SHADOW_USERNAME = parser.get("shadow_login", "username")
-    SHADOW_PASSWORD = parser.get("shadow_login", "password")
-    REAL_DEFAULT = bool(int(parser.get("settings", "real_default")))
-    RATE_LIMIT = float(parser.get("settings", "rate_limit"))
-
-    global real_backup, shadow_backup
-    real_backup_file = os.path.join(QUESTION_BACKUP_FOLDER, REAL_USERNAME)
-    if os.path.exists(real_backup_file):
-        with open(real_backup_file) as F:
-            real_backup = load(F)
-    if SHADOW_USERNAME:
-        shadow_backup_file = os.path.join(QUESTION_BACKUP_FOLDER, SHADOW_USERNAME)
-        if os.path.exists(shadow_backup_file):
-            with open(shadow_backup_file) as F:
-                shadow_backup = load(F)
+from config import Config
+from profile_store import ProfileStore, StoredProfile, migrate_profile_folder
+from question_stats import QuestionStats
+from fetch_pool import Checkpoint, fetch_all
+from metrics import metrics, Counters
+from set_cover import greedy_cover
+from answer_index import AnswerIndex
+from photo_cache import PhotoCache
+from session_pool import SessionPool
+from report import Report
+from question_history import QuestionHistory
+from essay_index import EssayIndex, ESSAY_FIELDS, parse_query, essays_match
+from similarity_index import SimilarityIndex, profile_features, backup_features
+from username_registry import (UsernameRegistry, import_username_files, PENDING, FETCHED, LOW_MP,
+                               FILTERED, DEACTIVATED)
+# okcupyd and requests are only imported by the functions that go online, and
+# numpy by those that score, so that working on stored data starts quickly.
 
-def login(real_user=None):
-    if real_user is None: real_user = REAL_DEFAULT
-    global rate_limiter
+# Paths and login settings; see config.py. Nothing is read until it is needed.
+config = Config(module_locator.module_path())
+
+# Held while the profile store and the aggregates following it are opened,
+# written or read: with save_profiles_concurrently, record_profile runs on the
+# thread draining fetch_all while the workers' profile filters look things up.
+store_lock = threading.RLock()
+
+def use_config(new_config):
+    # Switches to another data folder or account, closing whatever was open.
+    global config, profile_store, question_stats, essay_index, similarity_index, username_registry
+    global photo_cache, session_pool, rate_limiters
+    for name in ('profile_store', 'username_registry', 'photo_cache', 'session_pool'):
+        if name in globals():
+            globals()[name].close()
+            del globals()[name]
+    for name in ('question_stats', 'essay_index', 'similarity_index', 'rate_limiters'):
+        globals().pop(name, None)
+    config = new_config
+
+# ---- the names optimizer had before config.py ----
+#
+# Scripts written against them keep working: other modules see optimizer
+# through _LegacyNames below, which reads BASE_FOLDER, REAL_USERNAME,
+# real_backup and the rest from config whenever they are asked for, so they
+# follow use_config() and are there without setup() having run. New code
+# should use config instead.
+
+LEGACY_NAMES = {'BASE_FOLDER': 'base_folder', 'PROFILE_FOLDER': 'profile_folder',
+                'QUESTION_BACKUP_FOLDER': 'question_backup_folder', 'VALUATION_FOLDER': 'valuation_folder',
+                'USERNAME_FILE': 'username_file', 'DEACTIVATED_FILE': 'deactivated_file',
+                'REAL_USERNAME': 'real_username', 'REAL_PASSWORD': 'real_password',
+                'SHADOW_USERNAME': 'shadow_username', 'SHADOW_PASSWORD': 'shadow_password',
+                'REAL_DEFAULT': 'real_default', 'RATE_LIMIT': 'rate_limit',
+                'SHADOW_ACCOUNTS': 'shadow_accounts',
+                'real_backup': 'real_backup', 'shadow_backup': 'shadow_backup'}
+LEGACY_FOLDERS = ('BASE_FOLDER', 'PROFILE_FOLDER', 'QUESTION_BACKUP_FOLDER', 'VALUATION_FOLDER',
+                  'USERNAME_FILE', 'DEACTIVATED_FILE')
+
+def legacy_names():
+    # The old names that can be read now without asking for config.ini: the
+    # folders always, the login settings once config.ini exists or they were
+    # given to Config, and a question backup if one was saved. As before,
+    # from optimizer import * gets these.
+    names = list(LEGACY_FOLDERS)
+    for name, setting in LEGACY_NAMES.iteritems():
+        if name in LEGACY_FOLDERS or name.endswith('_backup'):
+            continue
+        if config.has_setting(setting):
+            names.append(name)
+    for name, setting in (('real_backup', 'real_username'), ('shadow_backup', 'shadow_username')):
+        if config.has_setting(setting) and os.path.exists(config.backup_file(getattr(config, setting))):
+            names.append(name)
+    return names
+
+class _LegacyNames(types.ModuleType):
+    # Stands in for optimizer in sys.modules: everything is looked up in,
+    # and assigned to, the module itself, and the old names it no longer
+    # has are read from config.
+    def __init__(self, module):
+        types.ModuleType.__init__(self, module.__name__, module.__doc__)
+        self.__dict__['_module'] = module
+
+    def __getattr__(self, name):
+        module = self.__dict__['_module']
+        try:
+            return getattr(module, name)
+        except AttributeError:
+            if name not in LEGACY_NAMES:
+                raise
+        return getattr(module.config, LEGACY_NAMES[name])
+
+    def __setattr__(self, name, value):
+        setattr(self.__dict__['_module'], name, value)
+
+    def __delattr__(self, name):
+        delattr(self.__dict__['_module'], name)
+
+    @property
+    def __all__(self):
+        module = self.__dict__['_module']
+        names = [name for name in vars(module) if not name.startswith('_')]
+        return names + [name for name in legacy_names() if name not in vars(module)]
+
+def setup(new_config=None):
+    # Starts over with new_config, or the config.ini next to this file, and
+    # reads the login settings from it, asking for them if it is missing.
+    use_config(new_config or Config(module_locator.module_path()))
+    config.real_username
+
+def rate_limiter_for(username=None):
+    # One adaptive budget per account, shared by its sessions on every thread,
+    # and one (username None) for requests made without logging in. Pacing
+    # starts at config.rate_limit and never gets faster than config.min_rate_limit;
+    # see rate_limit.py.
+    global rate_limiters
     try:
-        test = rate_limiter.rate_limit
+        limiter = rate_limiters.get(username)
     except NameError:
-        rate_limiter = RateLimiter(RATE_LIMIT)
+        rate_limiters = {}
+        limiter = None
+    if limiter is None:
+        from rate_limit import AdaptiveRateLimiter
+        limiter = rate_limiters[username] = AdaptiveRateLimiter(config.rate_limit, config.min_rate_limit)
+    return limiter
+
+def login(real_user=None):
+    if real_user is None: real_user = config.real_default
     if real_user:
-        return User(Session.login(REAL_USERNAME, REAL_PASSWORD, rate_limit=rate_limiter))
+        return login_as(config.real_username, config.real_password)
     else:
-        return User(Session.login(SHADOW_USERNAME, SHADOW_PASSWORD, rate_limit=rate_limiter))
+        return login_as(config.shadow_username, config.shadow_password)
+
+def open_session_pool():
+    # Logged in sessions, reused within a run and restored across runs; see session_pool.py.
+    global session_pool
+    try:
+        test = session_pool.folder
+    except NameError:
+        # the requests sessions underneath report every response to metrics
+        session_pool = SessionPool(config.session_folder, rate_limiter_for,
+                                   hooks=[metrics.response_hook])
+    return session_pool
+
+def login_as(username, password, slot=0):
+    # Concurrent workers on one account each take their own slot.
+    from okcupyd.user import User
+    return User(open_session_pool().get(username, password, slot))
+
+def account_password(username):
+    # The password of username if it is one of the configured accounts, else None
+    if username == config.real_username:
+        return config.real_password
+    if username == config.shadow_username:
+        return config.shadow_password
+    return dict(config.shadow_accounts).get(username)
+
+def fetch_accounts():
+    # (username, password) pairs used to retrieve other people's profiles
+    if config.real_default or not config.shadow_accounts:
+        return [(config.real_username, config.real_password)]
+    return config.shadow_accounts
+
+def open_profile_store():
+    global profile_store
+    with store_lock:
+        try:
+            test = profile_store.filename
+        except NameError:
+            profile_store = ProfileStore(config.profile_store_file)
+        return profile_store
+
+def open_question_stats():
+    # Aggregates over the whole profile store, kept up to date by save_profile.
+    global question_stats
+    with store_lock:
+        try:
+            test = question_stats.position
+        except NameError:
+            question_stats = QuestionStats.load(config.question_stats_file, open_profile_store())
+        return question_stats
+
+def open_essay_index():
+    # Full-text index of the stored essays, kept up to date by save_profile.
+    global essay_index
+    with store_lock:
+        try:
+            test = essay_index.position
+        except NameError:
+            essay_index = EssayIndex.load(config.essay_index_file, open_profile_store())
+        return essay_index
+
+def open_similarity_index():
+    # MinHash signatures of the stored answers, kept up to date by save_profile.
+    global similarity_index
+    with store_lock:
+        try:
+            test = similarity_index.position
+        except NameError:
+            similarity_index = SimilarityIndex.load(config.similarity_index_file, open_profile_store())
+        return similarity_index
+
+def open_username_registry():
+    # Every harvested username with its fetch state; see username_registry.py.
+    global username_registry
+    try:
+        test = username_registry.filename
+    except NameError:
+        new = not os.path.exists(config.username_registry_file)
+        username_registry = UsernameRegistry(config.username_registry_file)
+        if new:
+            import_username_files(username_registry, config.username_file, config.deactivated_file,
+                                  fetched=open_profile_store().usernames())
+    return username_registry
+
+def open_photo_cache():
+    # Downloaded profile photos and their thumbnails; see photo_cache.py.
+    global photo_cache
+    try:
+        test = photo_cache.folder
+    except NameError:
+        photo_cache = PhotoCache(config.photo_folder)
+    return photo_cache
+
+def migrate_profiles(folder=None, remove=False):
+    # Moves profiles saved by older versions (one pickle per user) into the profile store.
+    if folder is None: folder = config.profile_folder
+    if not os.path.exists(folder):
+        print "Nothing to migrate: %s does not exist"%(folder)
+        return 0
+    with store_lock:
+        store = open_profile_store()
+        n = migrate_profile_folder(folder, store, remove=remove)
+        # the aggregates already open missed the migrated records; the others
+        # catch up with them when opened
+        for name in ('question_stats', 'essay_index', 'similarity_index'):
+            if name in globals():
+                globals()[name].catch_up(store)
+    save_fetch_state()
+    return n
 
 def save_to_file(obj, filename):
     # use tmp file in case interrupted.
-    tmpfile = os.path.join(BASE_FOLDER, '_tmp')
+    tmpfile = config.path('_tmp')
     with open(tmpfile, 'w') as F:
         dump(obj, F)
     shutil.move(tmpfile, filename)
 
+# questions downloaded so far, for progress messages: per profile in
+# save_profile, per backup, and over the whole run for the workers of
+# save_profiles_concurrently, which all count here and never reset it
+question_counter = 0
+question_counter_lock = threading.Lock()
+
+def count_question():
+    global question_counter
+    with question_counter_lock:
+        question_counter += 1
+        n = question_counter
+    metrics.add('questions fetched')
+    if n % 20 == 0:
+        print "... Question %s"%(n)
+
+def reset_question_counter():
+    # Before a download whose progress is counted from 0 again
+    global question_counter
+    with question_counter_lock:
+        question_counter = 0
+
 class StaticQuestion(object):
     def __init__(self, question):
-        global question_counter
-        question_counter += 1
-        if question_counter % 20 == 0:
-            print "... Question %s"%(question_counter)
+        count_question()
         for prp in ("answered", "id", "text", "their_answer", "my_answer", "their_answer_matches",
                     "my_answer_matches", "their_note", "my_note"):
             setattr(self, prp, getattr(question, prp))
@@ -109,10 +284,7 @@ class StaticAnswerOption(object):
 
 class StaticUserQuestion(object):
     def __init__(self, question):
-        global question_counter
-        question_counter += 1
-        if question_counter % 20 == 0:
-            print "... Question %s"%(question_counter)
+        count_question()
         for prp in ("answered", "id", "text", "explanation"):
             setattr(self, prp, getattr(question, prp))
         self.answer_options = [StaticAnswerOption(option) for option in question.answer_options]
@@ -124,7 +296,8 @@ class Valuations(object):
     # long and short term partners
     def __init__(self, categories=None, save_name='prefs'):
         self.save_name = save_name
-        if os.path.exists(os.path.join(VALUATION_FOLDER, save_name)):
+        self.invalidate()
+        if os.path.exists(os.path.join(config.valuation_folder, save_name)):
             self.load()
         else:
             if categories is None:
@@ -157,6 +330,19 @@ class Valuations(object):
             self.drating = defaultdict(dict)
             self.dopts = None
 
+    def invalidate(self):
+        # Forget memoized ratings; call after editing qcategory or qrating by hand.
+        self._rate_cache = weakref.WeakKeyDictionary()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_rate_cache', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.invalidate()
+
     def _get_cat(self):
         while True:
             cat = raw_input("Category? (n-skip, %s) > "%(", ".join("%s-%s"%(k,v) for k,v in self.categories.iteritems())))
@@ -192,6 +378,7 @@ class Valuations(object):
             for v in L:
                 rating = self._get_rating(str(v))
                 self.drating[det][str(v)] = rating
+        self.invalidate()
         self.save()
 
     def _rate_question(self, question):
@@ -207,6 +394,7 @@ class Valuations(object):
             for a in question.answer_options:
                 rating = self._get_rating(a.text)
                 self.qrating[question.id][a.text] = rating
+        self.invalidate()
 
     def rate_questions(self, QB, save_interval=5):
         counter = 0
@@ -235,6 +423,14 @@ class Valuations(object):
         print "Question not found!"
 
     def _rate(self, profile):
+        # Memoized per profile object, so filters and reports can all ask for it.
+        try:
+            return self._rate_cache[profile]
+        except KeyError:
+            result = self._rate_cache[profile] = self._compute_rate(profile)
+            return result
+
+    def _compute_rate(self, profile):
         ratings = defaultdict(int)
         answered = defaultdict(int)
         for question in profile.questions:
@@ -249,43 +445,55 @@ class Valuations(object):
 
     def rate(self, username, Q=None):
         if Q is None:
-            with open(os.path.join(PROFILE_FOLDER, username)) as F:
-                profile = load(F)
+            profile = open_profile_store().get(username)
         else:
             profile = Q.profiles[username]
+        for rating, question, answer in self.valued_answers(profile):
+            print question
+            print "%s : %s"%(rating, answer)
+        ratings, answered = self._rate(profile)
+        for cat in itertools.chain(self.categories.itervalues(),itertools.repeat("overall",1)):
+            print "%s : %s / %s"%(cat, ratings[cat], answered[cat])
+
+    def valued_answers(self, profile):
+        # [(rating, question text, their answer)] for profile's answers rated
+        # other than 0, lowest first
         valued_answers = []
         for question in profile.questions:
             if question.id in self.qrating and question.their_answer is not None:
                 rating = self.qrating[question.id][question.their_answer]
                 if rating:
                     valued_answers.append((rating, question.text, question.their_answer))
-        for rating, question, answer in sorted(valued_answers):
-            print question
-            print "%s : %s"%(rating, answer)
-        ratings, answered = self._rate(profile)
-        for cat in itertools.chain(self.categories.itervalues(),itertools.repeat("overall",1)):
-            print "%s : %s / %s"%(cat, ratings[cat], answered[cat])
+        return sorted(valued_answers)
 
     def find_best_rated(self, Q, category='overall'):
-        scored = []
-        for profile in Q.profiles.itervalues():
-            ratings, answered = self._rate(profile)
-            scored.append((ratings[category], answered[category], profile))
-        for rat, ans, prof in sorted(scored):
-            print prof.username, "%s / %s"%(rat, ans)
+        for rat, ans, username in Q.profile_matrix().score(self)[0].ranked(category):
+            print username, "%s / %s"%(rat, ans)
+
+    def best_rated(self, Q, k=20, category='overall'):
+        # The k best (rating, answered, username) in Q, best first.
+        return Q.profile_matrix().score(self)[0].top(k, category)
 
     def save(self, name=None):
         if name is None: name = self.save_name
-        save_to_file(self, os.path.join(VALUATION_FOLDER, name))
+        save_to_file(self, os.path.join(config.folder(config.valuation_folder), name))
 
     def load(self, name=None):
         if name is None: name = self.save_name
-        filename = os.path.join(VALUATION_FOLDER, name)
+        filename = os.path.join(config.valuation_folder, name)
         with open(filename) as F:
             V = load(F)
         # We copy these in case the saved object is an old version of this class.
         for val in ('categories', 'qcategory', 'qrating', 'dcategory', 'drating', 'dopts'):
             setattr(self, val, getattr(V, val))
+        self.invalidate()
+
+def best_rated_by_valuations(Q, save_names, k=20, category='overall'):
+    # Scores Q's profiles under several saved valuations (e.g. long and short term)
+    # in one pass. Returns a dict from save name to best_rated-style lists.
+    valuations = [Valuations(save_name=name) for name in save_names]
+    scores = Q.profile_matrix().score(*valuations)
+    return dict((name, S.top(k, category)) for name, S in zip(save_names, scores))
 
 class NightOfAdvice(object):
     # Stored separately from UserQuestions and QuestionBackups
@@ -293,7 +501,7 @@ class NightOfAdvice(object):
     # Basically a list of questions you might want to consult
     # before meeting up with someone.
     def __init__(self):
-        if os.path.exists(os.path.join(BASE_FOLDER, 'advice')):
+        if os.path.exists(config.path('advice')):
             self.load()
         else:
             self.show = []
@@ -314,49 +522,74 @@ class NightOfAdvice(object):
                 s = raw_input('Show? y/[n] ')
                 if s == 'y':
                     self.show.append(question.id)
+                    self.invalidate()
                 else:
                     self.hide.add(question.id)
         self.save()
 
     def view(self, username, Q = None):
         if Q is None:
-            with open(os.path.join(PROFILE_FOLDER, username)) as F:
-                profile = load(F)
+            profile = open_profile_store().get(username)
         else:
             profile = Q.profiles[username]
-        D = {}
-        for id in self.show:
-            D[id] = None
+        for text, answer in self.answers(profile):
+            print text
+            print "  %s"%(answer)
+
+    def answers(self, profile):
+        # [(question text, their answer)] for the shown questions profile
+        # answered, in the order they were chosen
+        try:
+            order = self._order
+        except AttributeError:
+            order = self._order = dict((id, i) for i, id in reversed(list(enumerate(self.show))))
+        found = []
         for question in profile.questions:
-            if question.id in D and question.their_answer is not None:
-                D[question.id] = (question.text, question.their_answer)
-        for id in self.show:
-            if D[id]:
-                print D[id][0]
-                print "  %s"%(D[id][1])
+            i = order.get(question.id)
+            if i is not None and question.their_answer is not None:
+                found.append((i, question.text, question.their_answer))
+        found.sort()
+        return [(text, answer) for n, text, answer in found]
+
+    def invalidate(self):
+        # Forget the question order; call after editing show by hand.
+        self.__dict__.pop('_order', None)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_order', None)
+        return state
 
     def save(self):
-        save_to_file(self, os.path.join(BASE_FOLDER, 'advice'))
+        save_to_file(self, config.path('advice'))
 
     def load(self):
-        filename = os.path.join(BASE_FOLDER, 'advice')
+        filename = config.path('advice')
         with open(filename) as F:
             A = load(F)
         self.show = A.show
         self.hide = A.hide
+        self.invalidate()
 
 class ProfileFilter(object):
     @classmethod
     def std_combo(cls, valuations, mp_cutoff, answered_cutoff, ra_cutoff):
         return cls(valuations).add_mp_filter(mp_cutoff).add_answered_filter(answered_cutoff).add_ra_filter(ra_cutoff)
 
+    # Filters run cheapest first; anything that needs a rating comes after
+    # checks on stored fields.
+    FIELD_COST = 0
+    RATING_COST = 10
+
     def __init__(self, valuations):
         self.valuations = valuations
+        # each group is a list of (cost, test), kept sorted by cost
         self.filter_groups = [[]]
 
-    def _and(self, func):
+    def _and(self, func, cost=RATING_COST):
         for gp in self.filter_groups:
-            gp.append(func)
+            gp.append((cost, func))
+            gp.sort(key=lambda item: item[0])
         return self
 
     def _or(self, pf):
@@ -366,7 +599,61 @@ class ProfileFilter(object):
         return self
 
     def add_mp_filter(self, mp_cutoff):
-        return self._and(lambda profile: profile.match_percentage >= mp_cutoff)
+        return self._and(lambda profile: profile.match_percentage >= mp_cutoff, self.FIELD_COST)
+
+    def add_age_filter(self, min_age=None, max_age=None):
+        return self._and(lambda profile: ((min_age is None or profile.age >= min_age) and
+                                          (max_age is None or profile.age <= max_age)), self.FIELD_COST)
+
+    def add_location_filter(self, text):
+        # Case-insensitive substring of the location, e.g. "Boston"
+        text = text.lower()
+        return self._and(lambda profile: text in profile.location.lower(), self.FIELD_COST)
+
+    def add_gender_filter(self, *genders):
+        genders = set(gender.lower() for gender in genders)
+        return self._and(lambda profile: profile.gender.lower() in genders, self.FIELD_COST)
+
+    def add_essay_filter(self, query, fields=None):
+        # Essays (or the given essay fields) containing every word and "quoted
+        # phrase" of query and none of the -excluded ones, e.g. 'hiking -smoking'.
+        # Stored profiles are looked up in the essay index, others read.
+        clauses = parse_query(query)
+        matching = {}
+        def test(profile):
+            if isinstance(profile, StoredProfile):
+                with store_lock:
+                    index = open_essay_index()
+                    if matching.get('position') != (index.generation, index.position):
+                        matching['usernames'] = index.matching(query, fields)
+                        matching['position'] = (index.generation, index.position)
+                return profile.username in matching['usernames']
+            return essays_match(profile.essays, clauses, fields)
+        return self._and(test, self.FIELD_COST)
+
+    def add_similarity_filter(self, username=None, k=100):
+        # The k stored profiles that answered most like username, or with
+        # username None most like you; see similar_profiles. Other profiles
+        # pass if they are as alike as the least alike of those. Needs the
+        # questions, so it runs with the rating checks.
+        found = {}
+        def test(profile):
+            with store_lock:
+                index = open_similarity_index()
+                if found.get('position') != (index.generation, index.position):
+                    features = similarity_features(username)
+                    results = index.similar(features, k, exclude=username)
+                    found['usernames'] = set(name for similarity, name in results)
+                    found['signature'] = index.signature(features)
+                    found['threshold'] = results[-1][0] if results else None
+                    found['position'] = (index.generation, index.position)
+            if isinstance(profile, StoredProfile):
+                return profile.username in found['usernames']
+            features = profile_features(profile)
+            if not features or found['threshold'] is None:
+                return False
+            return (index.signature(features) == found['signature']).mean() >= found['threshold']
+        return self._and(test)
 
     def add_rating_filter(self, min_rating, cat='overall'):
         return self._and(lambda profile: self.valuations._rate(profile)[0][cat] >= min_rating)
@@ -375,16 +662,60 @@ class ProfileFilter(object):
         return self._and(lambda profile: self.valuations._rate(profile)[1][cat] >= min_answered)
 
     def add_ra_filter(self, min_ratio, cat='overall'):
-        return self._and(lambda profile: self.valuations._rate(profile)[0][cat] >= min_ratio * self.valuations._rate(profile)[1][cat])
+        def test(profile):
+            ratings, answered = self.valuations._rate(profile)
+            return ratings[cat] >= min_ratio * answered[cat]
+        return self._and(test)
 
     def passes(self, profile):
-        return any(all(test(profile) for test in group) for group in self.filter_groups)
+        return any(all(test(profile) for cost, test in group) for group in self.filter_groups)
+
+    def header_passes(self, profile):
+        # Whether profile could still pass, judging only by the stored field
+        # checks; used by fetch_profile before downloading the questions.
+        return any(all(test(profile) for cost, test in group if cost == self.FIELD_COST)
+                   for group in self.filter_groups)
 
 class StaticQuestionBackup(object):
-    def __init__(self, me):
+    # With previous (an earlier backup of the same account), each importance's
+    # list is only read until OKCUPID_OVERLAP questions in a row turn up just as
+    # they were, in the same order: OkCupid lists the most recently answered
+    # first, so the rest is taken from previous, less the questions found
+    # higher up or under another importance since. Questions no longer answered
+    # at all are only noticed by a full backup.
+    OKCUPID_OVERLAP = 10
+
+    def __init__(self, me, previous=None):
+        self.incremental = previous is not None
+        fetched = {}
+        tails = {}
         for importance in ('mandatory', 'very_important', 'somewhat_important',
                            'little_important', 'not_important'):
-            setattr(self, importance, [StaticUserQuestion(q) for q in getattr(me.questions, importance)])
+            if previous is None:
+                setattr(self, importance, [StaticUserQuestion(q) for q in getattr(me.questions, importance)])
+                continue
+            old = getattr(previous, importance)
+            positions = dict((question.id, i) for i, question in enumerate(old))
+            head = []
+            run = last = 0
+            for q in getattr(me.questions, importance):
+                question = StaticUserQuestion(q)
+                head.append(question)
+                i = positions.get(question.id)
+                if (i is not None and question.explanation == old[i].explanation and
+                    question_state(question, importance) == question_state(old[i], importance)):
+                    run = run + 1 if run and i == last + 1 else 1
+                    last = i
+                else:
+                    run = 0
+                if run >= self.OKCUPID_OVERLAP:
+                    tails[importance] = old[last + 1:]
+                    break
+            for question in head:
+                fetched[question.id] = importance
+            setattr(self, importance, head)
+        for importance, tail in tails.iteritems():
+            getattr(self, importance).extend(question for question in tail if question.id not in fetched)
 
     @property
     def questions(self):
@@ -406,19 +737,24 @@ class StaticLookingFor(object):
 
 class StaticEssays(object):
     def __init__(self, essays):
-        for prp in ('self_summary', 'my_life', 'good_at', 'people_first_notice',
-                   'favorites', 'six_things', 'think_about', 'friday_night',
-                   'private_admission', 'message_me_if'):
+        for prp in ESSAY_FIELDS:
             setattr(self, prp, getattr(essays, prp))
 
+# What StaticProfile downloads, in order: the profile page (every field but
+# questions and photos), the paginated questions, the photo list.
+PROFILE_STAGES = ('header', 'questions', 'photos')
+
 class StaticProfile(object):
-    def __init__(self, profile):
+    def __init__(self, profile, stages=PROFILE_STAGES):
         self.username = profile.username
+        for stage in stages:
+            self.fetch(profile, stage)
+
+    def fetch(self, profile, stage):
+        getattr(self, '_fetch_' + stage)(profile)
+
+    def _fetch_header(self, profile):
         self.details = profile.details.as_dict
-        global question_counter
-        question_counter = 0
-        self.questions = [StaticQuestion(question) for question in profile.questions]
-        self.photos = [StaticPhotoInfo(info) for info in profile.photo_infos]
         self.looking_for = StaticLookingFor(profile.looking_for)
         try:
             self.responds = profile.responds
@@ -429,60 +765,214 @@ class StaticProfile(object):
                     'gender', 'orientation'):
             setattr(self, prp, getattr(profile, prp))
 
+    def _fetch_questions(self, profile):
+        self.questions = [StaticQuestion(question) for question in profile.questions]
+
+    def _fetch_photos(self, profile):
+        self.photos = [StaticPhotoInfo(info) for info in profile.photo_infos]
+
+# the ProfileFilter _analyze_shard applies; worker processes inherit it
+_shard_filter = None
+
+def _analyze_shard(bounds, keep_profiles=False):
+    # One slice of a QuestionAnalyzer build, as (start, stop) from ProfileStore.shards:
+    # the usernames passing _shard_filter, which of them answered each question,
+    # and their QuestionStats (None without a filter, where the saved ones are used).
+    # With keep_profiles the profiles themselves come last; otherwise None, so
+    # that worker processes only send back these small aggregates.
+    start, stop = bounds
+    profile_filter = _shard_filter
+    usernames = []
+    question_users = defaultdict(list)
+    stats = None if profile_filter is None else QuestionStats()
+    profiles = [] if keep_profiles else None
+    filter_seconds = filtered = 0
+    for profile in open_profile_store().iterprofiles(load=('header', 'questions'), start=start, stop=stop):
+        if profile_filter is not None:
+            started = time.time()
+            passes = profile_filter.passes(profile)
+            filter_seconds += time.time() - started
+            filtered += 1
+            if not passes:
+                continue
+        usernames.append(profile.username)
+        for question in profile.questions:
+            question_users[question.id].append(profile.username)
+        if stats is not None:
+            stats.add(profile)
+        if keep_profiles:
+            profiles.append(profile)
+    if filtered:
+        metrics.record('filter seconds', filter_seconds, filtered)
+    return usernames, dict(question_users), stats, profiles
+
+def _analyze_shard_in_worker(bounds):
+    # _analyze_shard in a worker process, with what it recorded in metrics,
+    # which would otherwise stay in the worker
+    metrics.reset()
+    return _analyze_shard(bounds), metrics.state()
+
+class _QuestionsByID(object):
+    # QuestionAnalyzer.questions: question id -> every loaded profile's question
+    # with that id, tagged with .username. Lists are put together on first use
+    # from question_users, so building the analyzer does not unpack every question.
+    def __init__(self, profiles, question_users):
+        self.profiles = profiles
+        self.question_users = question_users
+        self._lists = {}
+
+    def __getitem__(self, id):
+        try:
+            return self._lists[id]
+        except KeyError:
+            pass
+        questions = []
+        for username in self.question_users.get(id, ()):
+            for question in self.profiles[username].questions:
+                if question.id == id:
+                    question.username = username
+                    questions.append(question)
+                    break
+        self._lists[id] = questions
+        return questions
+
+    def get(self, id, default=None):
+        if id not in self.question_users:
+            return default
+        return self[id]
+
+    def __contains__(self, id):
+        return id in self.question_users
+
+    def __iter__(self):
+        return iter(self.question_users)
+
+    def __len__(self):
+        return len(self.question_users)
+
 class QuestionAnalyzer(object):
-    def __init__(self, profile_filter = None):
-        self.profiles = {}
+    def __init__(self, profile_filter = None, workers = 1, shadow_version = None, real_version = None):
+        # With workers > 1 the store is split into that many slices, filtered and
+        # aggregated in worker processes and merged back in store order, which
+        # gives the same result as a single process. Only the passing profiles'
+        # headers are then read here; their questions are unpacked when used.
+        # The accounts' answers are those of their saved question backups, or of
+        # the given versions of them (see show_question_history).
+        global _shard_filter
         self.profile_filter = profile_filter
-        for (dirpath, dirnames, filenames) in os.walk(PROFILE_FOLDER):
-            for username in filenames:
-                with open(os.path.join(dirpath, username)) as F:
-                    profile = load(F)
-                    if profile_filter is None or profile_filter.passes(profile):
-                        self.profiles[username] = profile
+        started = time.time()
+        store = open_profile_store()
+        _shard_filter = profile_filter
+        if workers > 1:
+            # workers are forked and read the file themselves
+            store._file.flush()
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = pool.map(_analyze_shard_in_worker, store.shards(workers))
+            finally:
+                pool.close()
+                pool.join()
+            shards = []
+            for shard, state in results:
+                metrics.merge(state)
+                shards.append(shard)
+        else:
+            shards = [_analyze_shard((None, None), keep_profiles=True)]
+        self.profiles = {}
+        # keys are question ids, values are the usernames that answered them, in store order
+        self.question_users = defaultdict(list)
+        filtered_stats = None if profile_filter is None else QuestionStats()
+        for usernames, question_users, stats, profiles in shards:
+            for id, users in question_users.iteritems():
+                self.question_users[id].extend(users)
+            if stats is not None:
+                filtered_stats.merge(stats)
+            if profiles is not None:
+                for profile in profiles:
+                    self.profiles[profile.username] = profile
+        if workers > 1:
+            passed = set(username for shard in shards for username in shard[0])
+            # essays and photos stay on disk until something reads them, and so do questions
+            for profile in store.iterprofiles(load=('header',)):
+                if profile.username in passed:
+                    self.profiles[profile.username] = profile
+        self.question_users = dict(self.question_users)
+        self.questions = _QuestionsByID(self.profiles, self.question_users)
+        metrics.record('analyzer profiles seconds', time.time() - started, len(self.profiles))
+        started = time.time()
         self.shadow_questions = {}
         self.real_questions = {}
-        shadow_file = os.path.join(QUESTION_BACKUP_FOLDER, SHADOW_USERNAME)
-        real_file = os.path.join(QUESTION_BACKUP_FOLDER, REAL_USERNAME)
-        for D, file in [(self.shadow_questions, shadow_file), (self.real_questions, real_file)]:
-            with open(file) as F:
-                qbackup = load(F)
-                for importance in ('mandatory', 'very_important', 'somewhat_important',
-                                   'little_important', 'not_important'):
-                    for question in getattr(qbackup, importance):
-                        question.importance = importance
-                        question.matches = []
-                        for option in question.answer_options:
-                            if option.is_users:
-                                question.answer = option.text
-                            if option.is_match:
-                                question.matches.append(option.text)
-                        D[question.id] = question
-        self.questions = defaultdict(list)
-        self.qstats = {}
-        # my_bad, their_bad, answered
-        self.answered = {}
-        self.unanswered = {}
-        self.mine_mismatches = defaultdict(list)
-        self.theirs_mismatches = defaultdict(list)
-        for profile in self.profiles.itervalues():
-            for question in profile.questions:
-                question.username = profile.username
-                self.questions[question.id].append(question)
-                if question.my_answer is not None:
-                    if question.id not in self.answered:
-                        self.answered[question.id] = question.text
-                    if question.id not in self.qstats:
-                        self.qstats[question.id] = [0,0,0]
-                    self.qstats[question.id][2] += 1
-                    if not question.my_answer_matches:
-                        self.mine_mismatches[question.id].append(profile.username)
-                        self.qstats[question.id][0] += 1
-                    if not question.their_answer_matches:
-                        self.theirs_mismatches[question.id].append(profile.username)
-                        self.qstats[question.id][1] += 1
-                elif (question.id not in self.unanswered
-                      and question.id not in self.shadow_questions):
-                    self.unanswered[question.id] = question.text
+        for D, qbackup in [(self.shadow_questions, config.saved_backup(config.shadow_username, shadow_version)),
+                           (self.real_questions, config.saved_backup(config.real_username, real_version))]:
+            if qbackup is None:
+                raise IOError("No saved question backup; see backup_user_questions()")
+            for importance in ('mandatory', 'very_important', 'somewhat_important',
+                               'little_important', 'not_important'):
+                for question in getattr(qbackup, importance):
+                    question.importance = importance
+                    question.matches = []
+                    for option in question.answer_options:
+                        if option.is_users:
+                            question.answer = option.text
+                        if option.is_match:
+                            question.matches.append(option.text)
+                    D[question.id] = question
+        metrics.record('analyzer backups seconds', time.time() - started)
+        if profile_filter is None:
+            # the saved aggregates cover exactly the unfiltered corpus; copied, as
+            # record_profile keeps changing them while this analyzer is in use
+            with metrics.timer('analyzer stats seconds'):
+                stats = QuestionStats()
+                stats.merge(open_question_stats())
+        else:
+            stats = filtered_stats
+        # qstats values are [my_bad, their_bad, answered]
+        self.qstats = stats.qstats
+        self.answered = stats.answered
+        self.unanswered = stats.unanswered(exclude=self.shadow_questions)
+        self.mine_mismatches = stats.mine_mismatches
+        self.theirs_mismatches = stats.theirs_mismatches
+
+    def profile_matrix(self):
+        # Encoded answers of every profile, for batch scoring
+        try:
+            return self._profile_matrix
+        except AttributeError:
+            from scoring import ProfileMatrix
+            with metrics.timer('profile matrix seconds', len(self.profiles)):
+                self._profile_matrix = ProfileMatrix(self.profiles.itervalues())
+            return self._profile_matrix
+
+    def answer_index(self):
+        # Answer distributions per question; see answer_index.py
+        try:
+            return self._answer_index
+        except AttributeError:
+            self._answer_index = AnswerIndex(self.profiles.itervalues(), self.shadow_questions)
+            return self._answer_index
+
+    def match_simulator(self):
+        # What-if match percentage estimates for the shadow account; see match_simulator.py
+        try:
+            return self._match_simulator
+        except AttributeError:
+            from match_simulator import MatchSimulator
+            self._match_simulator = MatchSimulator(self.profiles.itervalues(), self.shadow_questions)
+            return self._match_simulator
+
+    def simulate_changes(self, k=20):
+        # The k changes to my questions expected to raise my match percentage the most.
+        simulator = self.match_simulator()
+        print "Model error: %.1f points on average"%(simulator.error(self.profiles.itervalues()) or 0)
+        for gain, n, id, kind, value in simulator.rank(k):
+            print u"{:+.3f} {:<6}{:<11}{}\n          {}".format(gain, n, kind, self.shadow_questions[id].text, value)
+
+    def answer_distribution(self, id, min_mp=None):
+        # Their answers to question id, most common first, with how many gave
+        # each and how many of those find my answer unacceptable.
+        counts = self.answer_index().by_answer(id, min_mp)
+        for answer, (n, my_bad, their_bad) in sorted(counts.iteritems(), key=lambda item: -item[1][0]):
+            print u"{:<5}{:<5}{}".format(n, my_bad, answer)
 
     def show_answer_mismatches(self):
         for id, real_question in self.real_questions.iteritems():
@@ -547,7 +1037,7 @@ class QuestionAnalyzer(object):
     def help_reanswer(self, id):
         Q = self.answered[id]
         A = self.shadow_questions[id].answer
-        others = " ".join(list(set(question.their_answer for question in self.questions[id] if question.their_answer is not None and question.their_answer_matches)))
+        others = " ".join(self.answer_index().accepted_answers(id))
         imp = self.shadow_questions[id].importance
         return u" {}\n  {}\n  {}\n  {}".format(Q, A, others, imp)
 
@@ -565,20 +1055,10 @@ class QuestionAnalyzer(object):
             print self.answer_summary(id, show_mismatch_users)
 
     def qids_to_answer(self, f_cutoff=0.00001, n_cutoff=11):
-        qids = []
-        for id in self.qstats.iterkeys():
-            if id in self.real_questions:
-                continue
-            n = self.qstats[id][2]
-            if n >= n_cutoff:
-                a = self.qstats[id][0]
-                b = self.qstats[id][1]
-                f = float(a+b) / n
-                if f < f_cutoff:
-                    qids.append(id)
-        return qids
+        return self.reanswer_candidates(f_cutoff, n_cutoff)
 
-    def show_questions_to_answer(self, f_cutoff=0.06, n_cutoff=15, by_profile=True):
+    def reanswer_candidates(self, f_cutoff=0.06, n_cutoff=15):
+        # Ids of questions only the shadow account answered that rarely mismatch.
         reanswers = []
         for id in self.qstats.iterkeys():
             if id in self.real_questions:
@@ -589,117 +1069,527 @@ class QuestionAnalyzer(object):
                 b = self.qstats[id][1]
                 f = float(a+b) / n
                 if f < f_cutoff:
-                    reanswers.append((self.answered[id], id))
+                    reanswers.append(id)
+        return reanswers
+
+    def group_by_profile(self, qids):
+        # Groups qids by profiles that answered them, favouring profiles for which
+        # they make up a large part of all their questions, so they can be looked
+        # up a profile at a time. Returns [(username, fraction, [question ids])].
+        profiles_by_question = dict((id, set(self.question_users.get(id, ()))) for id in qids)
+        sizes = defaultdict(int)
+        for users in self.question_users.itervalues():
+            for username in users:
+                sizes[username] += 1
+        return greedy_cover(profiles_by_question, sizes)
+
+    def show_questions_to_answer(self, f_cutoff=0.06, n_cutoff=15, by_profile=True):
+        reanswers = [(self.answered[id], id) for id in self.reanswer_candidates(f_cutoff, n_cutoff)]
         if by_profile:
-            print_order = []
-            unclaimed = [id for Q, id in reanswers]
-            ids = defaultdict(list)
-            while len(unclaimed) > 0:
-                profiles = defaultdict(int)
-                for id in unclaimed:
-                    for question in self.questions[id]:
-                        profiles[question.username] += 1
-                        ids[question.username].append(id)
-                frac = []
-                bestf = 0
-                bestuser = ""
-                for username, n in profiles.iteritems():
-                    f = float(n) / len(self.profiles[username].questions)
-                    if f > bestf:
-                        bestf = f
-                        bestuser = username
-                print bestuser, bestf
-                usersqs = []
-                new_unclaimed = []
-                for id in unclaimed:
-                    if id in ids[bestuser]:
-                        usersqs.append((self.answered[id], id))
-                    else:
-                        new_unclaimed.append(id)
-                unclaimed = new_unclaimed
-                for Q, id in sorted(usersqs):
+            for username, f, ids in self.group_by_profile([id for Q, id in reanswers]):
+                print username, f
+                for Q in sorted(self.answered[id] for id in ids):
                     print Q
         for Q, id in sorted(reanswers):
             print self.help_reanswer(id)
 
+    def similar_profiles(self, username=None, k=20):
+        # The analyzer's profiles that answered most like username (or like you)
+        return similar_profiles(username, k, among=self.profiles)
+
     def check_status(self, qtext):
-        for id, question in self.answered.iteritems():
-            if question[:50] == qtext[:50]:
+        for id in self.answer_index().with_start(qtext):
+            if id in self.answered:
                 print self.answer_summary(id)
                 break
 
-def save_profile(session, username, resume=False, mp_cutoff=None):
+# How many profiles reached each of PROFILE_STAGES, and how many stopped after one
+fetch_stage_counts = Counters()
+
+def fetch_profile(profile, mp_cutoff=None, profile_filter=None):
+    # Downloads everything StaticProfile keeps, without touching the store.
+    # Stages are fetched one at a time and the rest skipped as soon as the
+    # profile is turned down: mp_cutoff and profile_filter's stored field
+    # checks after the header, the whole profile_filter after the questions.
+    # Returns (status, StaticProfile or None, match percentage or None), status
+    # being one of the username registry states FETCHED, LOW_MP, FILTERED or DEACTIVATED.
+    # Only a 404 means deactivated: other failures, left after the session's
+    # retries (see rate_limit.py), are raised for the caller to try again later.
+    from requests.exceptions import HTTPError
+    from rate_limit import is_gone
+    try:
+        staticprofile = StaticProfile(profile, stages=())
+        for stage in PROFILE_STAGES:
+            requests_before = metrics.thread_requests()
+            with metrics.timer('fetch %s seconds'%(stage)):
+                staticprofile.fetch(profile, stage)
+            metrics.record('fetch %s requests'%(stage), metrics.thread_requests() - requests_before)
+            fetch_stage_counts.add(stage)
+            status = None
+            if stage == 'header':
+                if mp_cutoff is not None and staticprofile.match_percentage < mp_cutoff:
+                    status = LOW_MP
+                elif profile_filter is not None and not profile_filter.header_passes(staticprofile):
+                    status = FILTERED
+            elif stage == 'questions':
+                if profile_filter is not None and not profile_filter.passes(staticprofile):
+                    status = FILTERED
+            if status is not None:
+                fetch_stage_counts.add('stopped after ' + stage)
+                return status, None, staticprofile.match_percentage
+        return FETCHED, staticprofile, staticprofile.match_percentage
+    except HTTPError as e:
+        if not is_gone(e):
+            raise
+        return DEACTIVATED, None, None
+
+def show_fetch_stages(reset=False):
+    # What the early exits in fetch_profile saved so far.
+    counts = fetch_stage_counts.as_dict()
+    for stage in PROFILE_STAGES:
+        print "%s: %s fetched, %s stopped here"%(stage, counts.get(stage, 0),
+                                                 counts.get('stopped after ' + stage, 0))
+    print "Question downloads skipped: %s"%(counts.get('stopped after header', 0))
+    print "Photo downloads skipped: %s"%(counts.get('stopped after header', 0) +
+                                         counts.get('stopped after questions', 0))
+    if reset:
+        fetch_stage_counts.reset()
+
+def record_profile(username, status, staticprofile, match_percentage=None):
+    # Writes the outcome of fetch_profile to the store and the username registry.
+    # A profile identical to the stored copy is not rewritten, and its question
+    # stats are only redone if its questions changed.
+    with store_lock:
+        store = open_profile_store()
+        stats = open_question_stats()
+        essays = open_essay_index()
+        similar = open_similarity_index()
+        if status == FETCHED:
+            with metrics.timer('store write seconds'):
+                changed, old = store.refresh(staticprofile)
+            if not changed:
+                print "%s is unchanged"%(username)
+            if 'questions' in changed:
+                stats.record(store, old, staticprofile)
+            else:
+                stats.record(store, None, None)
+            essays.record(store, staticprofile if 'essays' in changed else None)
+            similar.record(store, staticprofile if 'questions' in changed else None)
+        elif status == LOW_MP:
+            print "%s does not have a high enough match percentage -- not saving"%username
+        elif status == FILTERED:
+            print "%s does not pass the profile filter -- not saving"%username
+        elif status == DEACTIVATED:
+            print "%s has been deactivated"%(username)
+            if username in store:
+                stats.record(store, store.delete(username), None)
+                essays.record(store, removed=username)
+                similar.record(store, removed=username)
+        open_username_registry().record(username, status, match_percentage)
+
+def save_fetch_state():
+    # Index and aggregates written at the end of a fetch run
+    with store_lock:
+        with metrics.timer('store index save seconds'):
+            open_profile_store().flush()
+        with metrics.timer('question stats save seconds'):
+            open_question_stats().save(config.question_stats_file)
+        with metrics.timer('essay index save seconds'):
+            open_essay_index().save(config.essay_index_file)
+        with metrics.timer('similarity index save seconds'):
+            open_similarity_index().save(config.similarity_index_file)
+
+def save_profile(session, username, resume=False, mp_cutoff=None, profile_filter=None):
+    from okcupyd.profile import Profile
     global curprofile
     if not resume:
         curprofile = Profile(session, username)
-    try:
-        if mp_cutoff is not None and curprofile.match_percentage < mp_cutoff:
-            print "%s does not have a high enough match percentage -- not saving"%username
-            return curprofile
-        staticprofile = StaticProfile(curprofile)
-        with open(os.path.join(PROFILE_FOLDER, username), "w") as F:
-            dump(StaticProfile(curprofile), F)
-    except HTTPError:
-        print "%s has been deactivated"%(username)
-        with open(DEACTIVATED_FILE, "a") as F:
-            F.write(username + "\n")
+    reset_question_counter()
+    record_profile(username, *fetch_profile(curprofile, mp_cutoff, profile_filter))
     return curprofile
 
-def save_profiles(mp_cutoff = None, overwrite = False, username_file = USERNAME_FILE):
+def profiles_to_fetch(mp_cutoff = None, overwrite = False, username_file = None, recheck_deactivated = False):
+    # Plans a save_profiles run from the username registry: pending users,
+    # users that were below an mp cutoff they may now meet and, with overwrite,
+    # users already fetched. Deactivated users are not fetched again unless
+    # recheck_deactivated, e.g. for users marked so by throttled requests before
+    # fetch_profile told those apart. A username_file given here is merged into
+    # the registry first.
+    registry = open_username_registry()
+    if username_file is not None:
+        import_username_files(registry, username_file)
+    return registry.to_fetch(overwrite, mp_cutoff, recheck_deactivated)
+
+def save_profiles(mp_cutoff = None, overwrite = False, username_file = None, workers = 1, users = None,
+                  profile_filter = None):
+    # With workers > 1, profiles are fetched concurrently, spread over the
+    # accounts from fetch_accounts(); see save_profiles_concurrently.
+    # users, if given, is fetched instead of what profiles_to_fetch plans.
+    # Profiles turned down by profile_filter are not stored; see fetch_profile.
+    if workers > 1:
+        return save_profiles_concurrently(workers, mp_cutoff, overwrite, username_file, users,
+                                          profile_filter)
+    from requests.exceptions import RequestException
+    if users is None:
+        users = profiles_to_fetch(mp_cutoff, overwrite, username_file)
     shadow = login()
-    with open(username_file) as user_file:
-        users = user_file.readlines()
-        for user in users:
-            user = user.strip()
-            if (not overwrite) and os.path.exists(os.path.join(PROFILE_FOLDER, user)):
-                continue
-            resume = False
-            try:
-                if curprofile.username == user:
-                    resume = True
-            except NameError:
-                pass
-            print "Saving", user
-            save_profile(shadow._session, user, resume=resume, mp_cutoff=mp_cutoff)
-
-def write_username_file(profile_fetchable, username_file=USERNAME_FILE):
-    if os.path.exists(username_file):
-        print "WARNING: this action will overwrite the existing username file."
-        proceed = raw_input("Do you want to proceed? y/[n] ")
-        if proceed != "y":
-            return
-    with open(username_file,'w') as F:
+    failed = []
+    for user in users:
+        resume = False
         try:
-            for i, profile in enumerate(profile_fetchable):
-                F.write(profile.username + "\n")
-                if i % 20 == 19:
-                    print "%s usernames written"%(i+1)
-        except HTTPError:
+            if curprofile.username == user:
+                resume = True
+        except NameError:
             pass
+        print "Saving", user
+        try:
+            save_profile(shadow._session, user, resume=resume, mp_cutoff=mp_cutoff,
+                         profile_filter=profile_filter)
+        except RequestException as e:
+            print "Could not fetch %s (%s) -- will retry on the next run"%(user, e)
+            failed.append(user)
+    if failed:
+        print "%s profiles could not be fetched: %s"%(len(failed), ", ".join(sorted(failed)))
+    save_fetch_state()
 
-def transfer_questions(target_user, qbackup, select=None, avoid=None):
+def save_profiles_concurrently(workers, mp_cutoff = None, overwrite = False, username_file = None, users = None,
+                               profile_filter = None):
+    # Every finished username goes into config.fetch_checkpoint_file, so an interrupted
+    # run picks up where it stopped when run again the same way: with the same users,
+    # or planned from the registry with the same options. A run that gets to the end
+    # removes it, whatever failed. Profiles are stored in the order they complete.
+    if users is None:
+        plan = ('planned', overwrite, mp_cutoff, username_file)
+        users = profiles_to_fetch(mp_cutoff, overwrite, username_file)
+    else:
+        plan = sorted(unicode(user) for user in users)
+    checkpoint = Checkpoint(config.fetch_checkpoint_file, plan)
+    users = [user for user in users if user not in checkpoint]
+    accounts = fetch_accounts()
+    sessions = [login_as(*accounts[i % len(accounts)], slot=i // len(accounts))._session
+                for i in range(workers)]
+    print "Fetching %s profiles with %s workers on %s accounts"%(len(users), workers, min(workers, len(accounts)))
+    failed = []
     n = 0
-    for importance in ('mandatory', 'very_important', 'somewhat_important',
+    finished = False
+    try:
+        from okcupyd.profile import Profile
+        def fetch(session, user):
+            return fetch_profile(Profile(session, user), mp_cutoff, profile_filter)
+        for user, result, error in fetch_all(sessions, users, fetch):
+            if error is not None:
+                print "Could not fetch %s (%s) -- will retry on the next run"%(user, error)
+                failed.append(user)
+                continue
+            # stored from this thread only, as results come in; see store_lock
+            record_profile(user, *result)
+            checkpoint.mark(user, result[0])
+            n += 1
+            if n % 20 == 0:
+                print "%s / %s profiles done"%(n, len(users))
+        finished = True
+    finally:
+        save_fetch_state()
+        checkpoint.close(finished)
+    if failed:
+        print "%s profiles could not be fetched: %s"%(len(failed), ", ".join(sorted(failed)))
+
+def refresh_plan(max_age_days = 30, budget = 200, valuations = None, category = 'overall'):
+    # Which stored profiles to fetch again, most urgent first, at most budget of them.
+    # A profile is due once age * (1 + value) reaches max_age_days, its age being
+    # the days since its last fetch and its value its rank, from 0 to 1, by match
+    # percentage, or by rating under valuations if given: the most valuable
+    # profiles come due in half the time. Profiles with no recorded fetch time
+    # (imported from users.txt) come first.
+    registry = open_username_registry()
+    candidates = [registry[u] for u in registry.by_state[FETCHED] | registry.by_state[LOW_MP]]
+    if valuations is not None:
+        from scoring import ProfileMatrix
+        store = open_profile_store()
+        matrix = ProfileMatrix(list(store.iterprofiles(load=('header', 'questions'))))
+        ranked = [username for rating, answered, username in matrix.score(valuations)[0].ranked(category)]
+    else:
+        ranked = [entry.username for entry in
+                  sorted(candidates, key=lambda entry: entry.match_percentage)]
+    value = dict((username, float(i) / max(len(ranked) - 1, 1)) for i, username in enumerate(ranked))
+    now = time.time()
+    due = []
+    for entry in candidates:
+        if not entry.fetched_at:
+            due.append((float('inf'), entry.username))
+            continue
+        priority = (now - entry.fetched_at) / 86400.0 * (1 + value.get(entry.username, 0))
+        if priority >= max_age_days:
+            due.append((priority, entry.username))
+    return [username for urgency, username in heapq.nlargest(budget, due)]
+
+def refresh_profiles(max_age_days = 30, budget = 200, valuations = None, category = 'overall',
+                     mp_cutoff = None, workers = 1, profile_filter = None):
+    # Keeps the store current without re-downloading all of it: fetches at
+    # most budget profiles, chosen by refresh_plan.
+    users = refresh_plan(max_age_days, budget, valuations, category)
+    print "Refreshing %s profiles"%(len(users))
+    save_profiles(mp_cutoff, workers=workers, users=users, profile_filter=profile_filter)
+
+def prefetch_photos(workers = 4, users = None, thumbnails = True, retry_missing = False):
+    # Downloads the photos of every stored profile (or of users) into the photo
+    # cache, workers at a time under the shared rate limit. Photos already
+    # cached are skipped, so an interrupted run can simply be started again;
+    # photos that were gone last time are only tried again with retry_missing.
+    import requests
+    from rate_limit import mount_retrying_adapter
+    store = open_profile_store()
+    if users is None:
+        profiles = store.iterprofiles(load=('photos',))
+    else:
+        profiles = (store.get(user, load=('photos',)) for user in users if user in store)
+    photos = [photo for profile in profiles for photo in (getattr(profile, 'photos', None) or ())]
+    # the photos are on a CDN: no login needed, so they get a budget of their own
+    limiter = rate_limiter_for(None)
+    sessions = []
+    for i in range(workers):
+        session = requests.Session()
+        mount_retrying_adapter(session, limiter)
+        session.hooks['response'].append(metrics.response_hook)
+        sessions.append(session)
+    cache = open_photo_cache()
+    with metrics.timer('photo prefetch seconds', len(photos)):
+        downloaded, missing, failed = cache.prefetch(photos, sessions, limiter, thumbnails, retry_missing)
+    print "%s photos downloaded, %s gone, %s failed; %s in the cache"%(downloaded, missing, failed, len(cache))
+
+def similarity_features(username=None):
+    # What similar_profiles compares with: username's stored answers, or with
+    # username None your own, from the real account's saved question backup
+    # (the shadow account's if there is none).
+    if username is not None:
+        return profile_features(open_profile_store().get(username, load=('header', 'questions')))
+    qbackup = config.real_backup or config.shadow_backup
+    if qbackup is None:
+        raise IOError("No saved question backup; see backup_user_questions()")
+    return backup_features(qbackup)
+
+def similar_profiles(username=None, k=20, among=None):
+    # The stored profiles that answered most like username (or like you), best
+    # first, among the given usernames if any; see similarity_index.py.
+    with metrics.timer('similarity search seconds'):
+        results = open_similarity_index().similar(similarity_features(username), k, username, among)
+    store = open_profile_store()
+    for similarity, name in results:
+        print u"{:5.2f} {:<4}{}".format(similarity, store.get(name).match_percentage, name)
+    return [name for similarity, name in results]
+
+def search_essays(query, k=20, fields=None, require_all=False):
+    # The stored profiles whose essays best match query, best first; see essay_index.py.
+    store = open_profile_store()
+    with metrics.timer('essay search seconds'):
+        results = open_essay_index().search(query, k, fields, require_all)
+    for score, username in results:
+        profile = store.get(username)
+        print u"{:6.2f} {:<4}{}".format(score, profile.match_percentage, username)
+    return [username for score, username in results]
+
+def batch_report(filename, users=None, profile_filter=None, valuations=None, advice=None,
+                 format=None, category='overall'):
+    # Writes a pre-date report on many stored profiles -- users, those passing
+    # profile_filter, or the users passing it -- to filename as text, JSON or
+    # HTML (by its extension unless format is given): ratings under valuations
+    # (profile_filter's by default), answers to advice's questions and the
+    # mismatches either way; see report.py. The profiles are read in a single
+    # pass in file order; returns how many were reported on.
+    if valuations is None and profile_filter is not None:
+        valuations = profile_filter.valuations
+    store = open_profile_store()
+    # importance as the analyzer has it, from the shadow account's answers
+    report = Report(valuations, advice, config.shadow_backup, category)
+    started = time.time()
+    if users is None:
+        profiles = store.iterprofiles(load=('header', 'questions'))
+    else:
+        missing = [user for user in users if user not in store]
+        if missing:
+            print "Not stored, left out: %s"%(", ".join(missing))
+        wanted = sorted(set(user for user in users if user in store), key=store.offsets.get)
+        profiles = (store.get(user, load=('header', 'questions')) for user in wanted)
+    for profile in profiles:
+        if profile_filter is None or profile_filter.passes(profile):
+            report.add(profile)
+    report.write(filename, format)
+    metrics.record('report seconds', time.time() - started, len(report))
+    print "Reported on %s profiles in %s"%(len(report), filename)
+    return len(report)
+
+def show_metrics(filename=None):
+    # Prints the timings and counts gathered so far and saves them as JSON.
+    # For a cProfile breakdown too, wrap a call in `with profiled('out.prof'):`
+    # after `from metrics import profiled`.
+    if filename is None: filename = config.metrics_file
+    metrics.show()
+    metrics.save(filename)
+    print "Saved to %s"%(filename)
+
+def add_usernames(profile_fetchable):
+    # Merges a harvest (e.g. from a search) into the username registry as
+    # pending users; usernames already known keep their state.
+    from requests.exceptions import RequestException
+    registry = open_username_registry()
+    seen = new = 0
+    try:
+        for i, profile in enumerate(profile_fetchable):
+            new += registry.add([profile.username])
+            seen += 1
+            if i % 20 == 19:
+                print "%s usernames seen, %s new"%(i+1, new)
+    except RequestException as e:
+        # what was seen so far is kept; the harvest can be run again
+        print "Harvest stopped early (%s)"%(e)
+    print "%s usernames seen, %s new; %s pending in total"%(seen, new, registry.counts()[PENDING])
+    return new
+
+def write_username_file(profile_fetchable, username_file=None):
+    # The old name of add_usernames; usernames now go into the registry, and
+    # username_file is ignored.
+    return add_usernames(profile_fetchable)
+
+def question_state(question, importance):
+    # What transfer_questions reproduces: (importance, answer, sorted acceptable answers)
+    answer = None
+    matches = []
+    for option in question.answer_options:
+        if option.is_users:
+            answer = option.text
+        if option.is_match:
+            matches.append(option.text)
+    return importance, answer, sorted(matches)
+
+def questions_to_transfer(qbackup, target_backup=None, select=None, avoid=None):
+    # [(question, importance)] from qbackup that target_backup does not already
+    # answer the same way (all of them if target_backup is None).
+    target = {}
+    if target_backup is not None:
+        for importance in ('mandatory', 'very_important', 'somewhat_important',
                            'little_important', 'not_important'):
+            for question in getattr(target_backup, importance):
+                target[question.id] = question_state(question, importance)
+    L = []
+    for importance in ('mandatory', 'very_important', 'somewhat_important',
+                       'little_important', 'not_important'):
         for question in getattr(qbackup, importance):
             if (select is None or question.id in select) and (avoid is None or question.id not in avoid):
-                n += 1
-                target_user.questions.respond_from_user_question(question, importance)
-                if n % 10 == 0:
-                    print "%s questions transferred"%n
+                if target.get(question.id) != question_state(question, importance):
+                    L.append((question, importance))
+    return L
 
-def backup_user_questions(real=None):
-    if real is None: real = REAL_DEFAULT
-    user = login(real)
-    global question_counter
-    question_counter = 0
-    print "Backing up questions for %s"%(REAL_USERNAME if real else SHADOW_USERNAME)
-    with open(os.path.join(QUESTION_BACKUP_FOLDER, user.username), "w") as F:
-        dump(StaticQuestionBackup(user), F)
+def load_question_backup(user, version=None):
+    # The saved backup for user, or a freshly fetched one if there is none;
+    # with version, that version from the backup history.
+    qbackup = config.saved_backup(user.username, version)
+    if qbackup is not None:
+        return qbackup
+    reset_question_counter()
+    print "No saved question backup for %s, fetching one"%(user.username)
+    return StaticQuestionBackup(user)
+
+def _journal_key(question, importance):
+    # A question is only skipped as sent if it was sent as it is now
+    return "%s:%08x"%(question.id, zlib.crc32(repr(question_state(question, importance))) & 0xffffffff)
+
+def transfer_questions(target_user, qbackup, select=None, avoid=None, diff=True, target_backup=None, workers=2,
+                       target_version=None, saved_target=False):
+    # With diff, only questions the target does not already answer the same way
+    # are sent; the target's state comes from target_backup, or a backup of it
+    # brought up to date first (see backup_user_questions), or with saved_target
+    # its saved backup as it is, or that version of it. qbackup may be a
+    # version number of the target's own backup history, to go back to it;
+    # questions answered since are left alone. Responses are sent by a few
+    # workers sharing the rate limit, each on a session of its own, and every one
+    # that succeeds goes into a journal, so rerunning an interrupted or partly
+    # failed transfer skips what was already sent. The journal only counts for
+    # the same questions to transfer: once the diff changes, it is started over.
+    # A target that is not one of the configured accounts gets one worker, as
+    # other sessions on it would need its password.
+    if isinstance(qbackup, int):
+        qbackup = config.saved_backup(target_user.username, qbackup)
+    if diff and target_backup is None:
+        if saved_target or target_version is not None:
+            target_backup = load_question_backup(target_user, target_version)
+        else:
+            target_backup = update_question_backup(target_user)
+    todo = questions_to_transfer(qbackup, target_backup if diff else None, select, avoid)
+    pending = dict((_journal_key(question, importance), (question, importance)) for question, importance in todo)
+    journal = Checkpoint(config.path('transfer_journal_%s'%(target_user.username)), sorted(pending))
+    for key in list(pending):
+        if key in journal:
+            del pending[key]
+    print "%s questions to transfer (%s were already sent)"%(len(pending), len(todo) - len(pending))
+    users = [target_user]
+    password = account_password(target_user.username) if workers > 1 else None
+    if password is not None:
+        users.extend(login_as(target_user.username, password, slot=i) for i in range(1, workers))
+    def respond(user, key):
+        question, importance = pending[key]
+        return user.questions.respond_from_user_question(question, importance)
+    n = 0
+    failed = []
+    try:
+        for key, result, error in fetch_all(users, sorted(pending), respond):
+            if error is not None:
+                failed.append(pending[key][0])
+                continue
+            journal.mark(key, 'sent')
+            n += 1
+            if n % 10 == 0:
+                print "%s questions transferred"%n
+    finally:
+        journal.close(finished=(not failed and n == len(pending)))
+    if failed:
+        print "%s questions failed; run the transfer again to retry them:"%(len(failed))
+        for question in sorted(failed, key=lambda question: question.id):
+            print "  %s: %s"%(question.id, question.text)
+
+def backup_user_questions(real=None, full=False, full_every=10):
+    # Saves the account's questions and adds the changes to its backup history.
+    # Only what changed since the last backup is fetched, unless full is given
+    # or the last full_every backups were all incremental.
+    if real is None: real = config.real_default
+    update_question_backup(login(real), full, full_every)
+
+def update_question_backup(user, full=False, full_every=10):
+    # backup_user_questions for a logged in user; returns the new backup
+    reset_question_counter()
+    history = QuestionHistory(config.history_file(user.username))
+    previous = config.saved_backup(user.username)
+    if full or previous is None or not len(history) or history.since_full() >= full_every:
+        previous = None
+    print "Backing up %squestions for %s"%("" if previous is None else "changed ", user.username)
+    config.folder(config.question_backup_folder)
+    with metrics.timer('question backup seconds'):
+        qbackup = StaticQuestionBackup(user, previous)
+    version = history.record(qbackup, full=previous is None)
+    save_to_file(qbackup, config.backup_file(user.username))
+    config.forget_backup(user.username)
+    if version is None:
+        print "No changes since version %s"%(len(history))
+    else:
+        print "Saved version %s"%(version)
+    return qbackup
+
+def show_question_history(real=None):
+    # The versions of the account's question backup, for saved_backup(username, version)
+    if real is None: real = config.real_default
+    username = config.real_username if real else config.shadow_username
+    for version, when, full, changed in QuestionHistory(config.history_file(username)).versions():
+        print "%4s  %s  %-11s %s questions changed"%(version, time.strftime('%Y-%m-%d %H:%M', time.localtime(when)),
+                                                     "full" if full else "incremental", changed)
 
 def backup_essays(real=True):
     user = login(real)
-    with open(os.path.join(BASE_FOLDER, 'essay_backup'), "w") as F:
+    with open(config.path('essay_backup'), "w") as F:
         dump(StaticEssays(user.profile.essays), F)
 
-setup()
+if __name__ == '__main__':
+    # python -i optimizer.py: the old names as globals of the session, as setup() bound them
+    setup()
+    for name in legacy_names():
+        globals()[name] = getattr(config, LEGACY_NAMES[name])
+else:
+    sys.modules[__name__] = _LegacyNames(sys.modules[__name__])
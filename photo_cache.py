@@ -0,0 +1,212 @@
+import os, shutil, hashlib
+
+from fetch_pool import fetch_all
+from metrics import metrics
+
+# Local copies of profile photos (StaticPhotoInfo), downloaded once.
+#
+# Images are stored under the SHA-1 of their bytes, so a photo that turns up
+# under several ids or profiles is kept once:
+#
+#     objects/ab/ab01...ef.jpg          the image as downloaded
+#     thumbs/ab/ab01...ef-L-T-R-B.jpg   cropped to a thumb_nail box
+#     index                             tab separated "photo id  digest" lines
+#
+# The index is appended to as each photo is stored, the last line for an id
+# winning, with a digest of '-' for a photo that is gone (404); a bulk
+# prefetch that is interrupted picks up where it stopped. Thumbnails need
+# PIL (Pillow); downloads do not.
+
+MISSING = '-'
+
+def _photo_id(photo):
+    return str(getattr(photo, 'id', photo))
+
+def _crop_box(photo):
+    box = tuple(getattr(photo, name, None) for name in
+                ('thumb_nail_left', 'thumb_nail_top', 'thumb_nail_right', 'thumb_nail_bottom'))
+    if None in box:
+        return None
+    box = tuple(int(x) for x in box)
+    if box[2] <= box[0] or box[3] <= box[1]:
+        return None
+    return box
+
+def _image_module():
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImportError("thumbnails need PIL; pip install Pillow")
+    return Image
+
+class PhotoCache(object):
+    def __init__(self, folder):
+        self.folder = folder
+        self.index_file = os.path.join(folder, 'index')
+        # keys are photo ids, values are digests (or MISSING)
+        self.digests = {}
+        # digests of the images on disk
+        self.stored = set()
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as F:
+                for line in F:
+                    parts = line.rstrip('\n').split('\t')
+                    if len(parts) == 2:
+                        self.digests[parts[0]] = parts[1]
+        for digest in set(self.digests.itervalues()):
+            if digest != MISSING and os.path.exists(self._object_file(digest)):
+                self.stored.add(digest)
+        self._file = None
+
+    def _object_file(self, digest):
+        return os.path.join(self.folder, 'objects', digest[:2], digest + '.jpg')
+
+    def _write(self, filename, data):
+        folder = os.path.dirname(filename)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        tmpfile = filename + '.tmp'
+        with open(tmpfile, 'wb') as F:
+            F.write(data)
+        shutil.move(tmpfile, filename)
+
+    def _log(self, id, digest):
+        if self._file is None:
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+            self._file = open(self.index_file, 'a')
+        self.digests[id] = digest
+        self._file.write("%s\t%s\n"%(id, digest))
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # ---- lookups ----
+
+    def __contains__(self, photo):
+        # Whether photo (or a photo id) has been dealt with: stored or known to be gone.
+        digest = self.digests.get(_photo_id(photo))
+        return digest == MISSING or digest in self.stored
+
+    def __len__(self):
+        return len(self.digests)
+
+    def digest(self, photo):
+        digest = self.digests.get(_photo_id(photo))
+        return digest if digest in self.stored else None
+
+    def path(self, photo):
+        # The downloaded image, or None
+        digest = self.digest(photo)
+        return None if digest is None else self._object_file(digest)
+
+    def thumbnail(self, photo, size=None):
+        # The image cropped to photo's thumb_nail box (the whole image if it has
+        # none) and, with size as (width, height), shrunk to fit in it; made on
+        # first use. None if the image has not been downloaded.
+        digest = self.digest(photo)
+        if digest is None:
+            return None
+        box = _crop_box(photo)
+        name = digest + ('-%s-%s-%s-%s'%box if box else '') + ('-%sx%s'%size if size else '') + '.jpg'
+        filename = os.path.join(self.folder, 'thumbs', digest[:2], name)
+        if not os.path.exists(filename):
+            Image = _image_module()
+            image = Image.open(self._object_file(digest))
+            if box is not None:
+                width, height = image.size
+                image = image.crop((min(box[0], width), min(box[1], height),
+                                    min(box[2], width), min(box[3], height)))
+            if size:
+                image.thumbnail(size, Image.ANTIALIAS)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            folder = os.path.dirname(filename)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            tmpfile = filename + '.tmp'
+            image.save(tmpfile, 'JPEG', quality=90)
+            shutil.move(tmpfile, filename)
+            metrics.add('thumbnails made')
+        return filename
+
+    # ---- storing ----
+
+    def store(self, photo, data):
+        # Keeps data as photo's image; returns its digest.
+        digest = hashlib.sha1(data).hexdigest()
+        if digest in self.stored:
+            metrics.add('photos deduplicated')
+        else:
+            self._write(self._object_file(digest), data)
+            self.stored.add(digest)
+        self._log(_photo_id(photo), digest)
+        return digest
+
+    def mark_missing(self, photo):
+        self._log(_photo_id(photo), MISSING)
+
+    def to_fetch(self, photos, retry_missing=False):
+        # photos not yet in the cache, one per id, in the order given
+        seen = set()
+        todo = []
+        for photo in photos:
+            id = _photo_id(photo)
+            if id in seen or not getattr(photo, 'jpg_uri', None):
+                continue
+            seen.add(id)
+            digest = self.digests.get(id)
+            if digest in self.stored or (digest == MISSING and not retry_missing):
+                continue
+            todo.append(photo)
+        return todo
+
+    def prefetch(self, photos, sessions, rate_limiter=None, thumbnails=False, retry_missing=False,
+                 timeout=30):
+        # Downloads every photo not yet cached, one worker thread per session
+        # (anything with a requests-style get(url, timeout=...)), waiting on
+        # rate_limiter before each request if given. With thumbnails, the
+        # cropped thumbnail of each is made as it arrives.
+        # Returns (downloaded, missing, failed) counts.
+        if thumbnails:
+            _image_module()
+        todo = self.to_fetch(photos, retry_missing)
+        by_id = dict((_photo_id(photo), photo) for photo in todo)
+
+        def download(session, id):
+            if rate_limiter is not None:
+                rate_limiter.wait()
+            with metrics.timer('photo download seconds'):
+                response = session.get(by_id[id].jpg_uri, timeout=timeout)
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            return response.content
+
+        downloaded = missing = failed = 0
+        for id, data, error in fetch_all(sessions, [_photo_id(photo) for photo in todo], download):
+            photo = by_id[id]
+            if error is not None:
+                print "Could not download photo %s (%s) -- will retry on the next run"%(id, error)
+                failed += 1
+            elif data is None:
+                self.mark_missing(photo)
+                missing += 1
+                metrics.add('photos missing')
+            else:
+                self.store(photo, data)
+                downloaded += 1
+                metrics.add('photos downloaded')
+                metrics.add('photo bytes', len(data))
+                if thumbnails:
+                    try:
+                        self.thumbnail(photo)
+                    except IOError as e:
+                        print "Could not make a thumbnail of photo %s (%s)"%(id, e)
+            done = downloaded + missing + failed
+            if done % 100 == 0:
+                print "%s / %s photos done"%(done, len(todo))
+        return downloaded, missing, failed
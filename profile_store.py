@@ -0,0 +1,468 @@
+import os, struct, shutil
+from array import array
+from cPickle import dumps, loads, dump, load, HIGHEST_PROTOCOL
+from collections import defaultdict
+
+from compact_questions import QuestionDictionary, pack_questions, unpack_questions, packed_answers
+
+# A single append-only file holding every StaticProfile.
+#
+# File layout (all integers big-endian):
+#   header : MAGIC, VERSION
+#   record : kind, len(username), len(payload), offset of the record it supersedes,
+#            username (utf-8), payload
+#   payload: one length per section in SECTIONS, then each section as a binary pickle
+# A PUT record stores a profile, a DELETE record (empty payload) removes one.
+# A TEXTS record (empty username) adds question and answer texts to the store's
+# QuestionDictionary; it is written just before the first PUT that uses them,
+# and the questions section only refers to texts by index.
+# Superseded records stay in the file until compact() is called.
+#
+# The header section holds every StaticProfile field except the heavy ones,
+# which get a section each. Profiles come back as StoredProfiles, which only
+# unpickle a heavy section when it is first used; sections that were not
+# asked for are not even read from disk until then.
+#
+# The username and question id indices are checkpointed to filename + '.idx'
+# together with the file size they cover; on open, any records written after
+# the checkpoint are replayed, so an interrupted scrape never loses its index.
+# The generation counts compactions, which move records: anything that
+# remembers offsets into the file should check it first.
+
+MAGIC = 'OKPS'
+VERSION = 1
+PUT, DELETE, TEXTS = 1, 2, 3
+SECTIONS = ('header', 'questions', 'essays', 'photos')
+_HEADER = struct.Struct('>4sH')
+_RECORD = struct.Struct('>BHIQ')
+_SECTION_TABLE = struct.Struct('>' + 'I' * len(SECTIONS))
+
+class StoreFormatError(Exception):
+    pass
+
+class StoredProfile(object):
+    # A profile read back from a ProfileStore. Header fields are plain attributes;
+    # a heavy section is either raw pickle data or a (store, offset, length)
+    # reference until it is first accessed.
+    def __init__(self, header, sections, dictionary):
+        self.__dict__.update(header)
+        self._sections = sections
+        self._dictionary = dictionary
+
+    def __getattr__(self, name):
+        sections = self.__dict__.get('_sections')
+        if sections is None or name not in sections:
+            raise AttributeError(name)
+        source = sections.pop(name)
+        if not isinstance(source, str):
+            store, offset, length = source
+            source = store._read(offset, length)
+        if name == 'questions':
+            value = unpack_questions(source, self._dictionary)
+            # kept for answer_arrays, which would otherwise have to go through
+            # the unpacked questions one by one
+            self._answers = (value,) + packed_answers(source)
+        else:
+            value = loads(source)
+        setattr(self, name, value)
+        return value
+
+    def answer_arrays(self):
+        # (question ids, their answer indices, the QuestionDictionary they
+        # index into) as from compact_questions.packed_answers, or None if
+        # the questions were replaced since they were read
+        source = self.__dict__['_sections'].get('questions')
+        if source is None:
+            answers = self.__dict__.get('_answers')
+            if answers is None or answers[0] is not self.__dict__.get('questions'):
+                return None
+            return answers[1:] + (self._dictionary,)
+        if not isinstance(source, str):
+            store, offset, length = source
+            source = store._read(offset, length)
+        return packed_answers(source) + (self._dictionary,)
+
+    def header(self):
+        return dict((k, v) for k, v in self.__dict__.iteritems()
+                    if k not in ('_sections', '_dictionary', '_answers') and k not in SECTIONS)
+
+def encode_profile(profile, dictionary):
+    # New texts are added to dictionary; see QuestionDictionary.take_new.
+    if isinstance(profile, StoredProfile):
+        header = profile.header()
+    else:
+        header = dict((k, v) for k, v in profile.__dict__.iteritems() if k not in SECTIONS)
+    blobs = [dumps(header, HIGHEST_PROTOCOL), pack_questions(profile.questions, dictionary)]
+    blobs.extend(dumps(getattr(profile, name, None), HIGHEST_PROTOCOL) for name in SECTIONS[2:])
+    return _SECTION_TABLE.pack(*[len(blob) for blob in blobs]) + ''.join(blobs)
+
+def split_payload(payload):
+    # {section name: raw section data}
+    lengths = _SECTION_TABLE.unpack_from(payload)
+    position = _SECTION_TABLE.size
+    sections = {}
+    for name, length in zip(SECTIONS, lengths):
+        sections[name] = payload[position:position + length]
+        position += length
+    return sections
+
+def decode_profile(payload, dictionary):
+    sections = split_payload(payload)
+    return StoredProfile(loads(sections.pop('header')), sections, dictionary)
+
+class ProfileStore(object):
+    def __init__(self, filename, index_interval=500):
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+        # the index is rewritten every index_interval writes (None to only do it on flush)
+        self.index_interval = index_interval
+        self._unindexed = 0
+        if not os.path.exists(filename):
+            with open(filename, 'wb') as F:
+                F.write(_HEADER.pack(MAGIC, VERSION))
+        self._file = open(filename, 'r+b')
+        magic, version = _HEADER.unpack(self._file.read(_HEADER.size))
+        if magic != MAGIC:
+            raise StoreFormatError("%s is not a profile store"%(filename))
+        if version != VERSION:
+            raise StoreFormatError("%s has format version %s, expected %s"%(filename, version, VERSION))
+        self._load_index()
+
+    # ---- index ----
+
+    def _reset_index(self):
+        self.generation = 0
+        self.end = _HEADER.size
+        # keys are usernames, values are offsets of the live record
+        self.offsets = {}
+        # usernames are numbered so the question index can hold compact arrays
+        self.names = []
+        self.numbers = {}
+        # keys are question ids, values are arrays of user numbers
+        self.qindex = defaultdict(lambda: array('l'))
+        # keys are question ids, values are sets of the user numbers in
+        # qindex[id] that no longer answer it: removing them from the array
+        # would take a scan of it per question, so they are left out when it
+        # is read, and purged once they make up a quarter of it
+        self._stale = {}
+        self.dictionary = QuestionDictionary()
+
+    def _load_index(self):
+        self._reset_index()
+        if os.path.exists(self.index_filename):
+            try:
+                with open(self.index_filename, 'rb') as F:
+                    saved = load(F)
+            except Exception:
+                saved = None
+            if saved is not None and saved['version'] == VERSION and saved['end'] <= self._size():
+                self.generation = saved['generation']
+                self.end = saved['end']
+                self.offsets = saved['offsets']
+                self.names = saved['names']
+                self.numbers = dict((name, n) for n, name in enumerate(self.names))
+                for id, L in saved['qindex'].iteritems():
+                    self.qindex[id] = array('l', L)
+                self._stale = dict((id, set(L)) for id, L in saved.get('stale', {}).iteritems())
+                self.dictionary = saved['dictionary']
+        # catch up with anything written since the checkpoint
+        start = self.end
+        for offset, kind, username, prev, payload in self.records(start):
+            self._apply(offset, kind, username, prev, payload)
+        if self.end != start:
+            self.flush()
+
+    def _apply(self, offset, kind, username, prev, payload):
+        if prev:
+            self._unindex(username, self.read_at(prev))
+        if kind == PUT:
+            self.offsets[username] = offset
+            self._index(username, self.decode(payload))
+        elif kind == TEXTS:
+            self.dictionary.apply(loads(payload))
+        else:
+            self.offsets.pop(username, None)
+        self.end = offset + _RECORD.size + len(username.encode('utf-8')) + len(payload)
+
+    def _number(self, username):
+        if username not in self.numbers:
+            self.numbers[username] = len(self.names)
+            self.names.append(username)
+        return self.numbers[username]
+
+    def _index(self, username, profile):
+        n = self._number(username)
+        for question in profile.questions:
+            stale = self._stale.get(question.id)
+            if stale is not None and n in stale:
+                # answered again: the old entry stands
+                stale.remove(n)
+                if not stale:
+                    del self._stale[question.id]
+            else:
+                self.qindex[question.id].append(n)
+
+    def _unindex(self, username, profile):
+        n = self.numbers.get(username)
+        if n is None or profile is None:
+            return
+        for question in profile.questions:
+            L = self.qindex.get(question.id)
+            if L is None:
+                continue
+            stale = self._stale.setdefault(question.id, set())
+            stale.add(n)
+            if 4 * len(stale) >= len(L):
+                self._purge(question.id)
+
+    def _purge(self, id):
+        stale = self._stale.pop(id)
+        L = array('l', [n for n in self.qindex[id] if n not in stale])
+        if L:
+            self.qindex[id] = L
+        else:
+            del self.qindex[id]
+
+    def flush(self):
+        self._file.flush()
+        tmpfile = self.index_filename + '.tmp'
+        with open(tmpfile, 'wb') as F:
+            dump({'version': VERSION, 'generation': self.generation,
+                  'end': self.end, 'offsets': self.offsets,
+                  'names': self.names, 'qindex': dict((id, L.tostring()) for id, L in self.qindex.iteritems()),
+                  'stale': dict((id, list(S)) for id, S in self._stale.iteritems()),
+                  'dictionary': self.dictionary}, F, HIGHEST_PROTOCOL)
+        shutil.move(tmpfile, self.index_filename)
+        self._unindexed = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    # ---- reading ----
+
+    def _size(self):
+        self._file.seek(0, os.SEEK_END)
+        return self._file.tell()
+
+    def records(self, start=None, buffer_size=1 << 20):
+        # Yields (offset, kind, username, prev, payload) for every record from start on,
+        # superseded ones included, in one sequential read.
+        if start is None: start = _HEADER.size
+        self._file.flush()
+        with open(self.filename, 'rb', buffer_size) as F:
+            F.seek(start)
+            offset = start
+            while True:
+                head = F.read(_RECORD.size)
+                if not head:
+                    return
+                if len(head) < _RECORD.size:
+                    self._truncate(offset)
+                    return
+                kind, ulen, plen, prev = _RECORD.unpack(head)
+                body = F.read(ulen + plen)
+                if len(body) < ulen + plen:
+                    self._truncate(offset)
+                    return
+                yield offset, kind, body[:ulen].decode('utf-8'), prev, body[ulen:]
+                offset += _RECORD.size + ulen + plen
+
+    def _truncate(self, offset):
+        # A record was cut short by an interrupted write; drop it.
+        print "Discarding incomplete record at the end of %s"%(self.filename)
+        self._file.truncate(offset)
+        self._file.flush()
+
+    def decode(self, payload):
+        # The profile in a PUT record's payload, as yielded by records().
+        return decode_profile(payload, self.dictionary)
+
+    def _read(self, offset, length):
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def payload_at(self, offset):
+        # The raw payload of the record at offset.
+        self._file.seek(offset)
+        kind, ulen, plen, prev = _RECORD.unpack(self._file.read(_RECORD.size))
+        self._file.seek(ulen, os.SEEK_CUR)
+        return self._file.read(plen)
+
+    def read_at(self, offset):
+        # The whole record is read; sections are unpickled on use.
+        self._file.seek(offset)
+        kind, ulen, plen, prev = _RECORD.unpack(self._file.read(_RECORD.size))
+        self._file.seek(ulen, os.SEEK_CUR)
+        if kind != PUT:
+            return None
+        return self.decode(self._file.read(plen))
+
+    def _load(self, F, offset, load):
+        # Reads the profile whose payload starts at F's position, keeping the
+        # sections in load and leaving references to the others.
+        lengths = _SECTION_TABLE.unpack(F.read(_SECTION_TABLE.size))
+        position = offset + _SECTION_TABLE.size
+        sections = {}
+        for name, length in zip(SECTIONS, lengths):
+            if name == 'header' or name in load:
+                sections[name] = F.read(length)
+            else:
+                sections[name] = (self, position, length)
+                F.seek(position + length)
+            position += length
+        return StoredProfile(loads(sections.pop('header')), sections, self.dictionary)
+
+    def get(self, username, load=('header',)):
+        offset = self.offsets[username]
+        self._file.seek(offset)
+        kind, ulen, plen, prev = _RECORD.unpack(self._file.read(_RECORD.size))
+        start = offset + _RECORD.size + ulen
+        self._file.seek(start)
+        return self._load(self._file, start, load)
+
+    def __contains__(self, username):
+        return username in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def usernames(self):
+        return self.offsets.keys()
+
+    def usernames_with_question(self, qid):
+        stale = self._stale.get(qid, ())
+        return [self.names[n] for n in self.qindex.get(qid, ()) if n not in stale]
+
+    def iterprofiles(self, load=SECTIONS, buffer_size=1 << 20, start=None, stop=None):
+        # Live profiles in file order, in a single pass over the file. Sections
+        # not in load are skipped over and only read if they are used later.
+        # start and stop, as given by shards(), restrict this to part of the file.
+        self._file.flush()
+        if start is None: start = _HEADER.size
+        if stop is None: stop = self.end
+        with open(self.filename, 'rb', buffer_size) as F:
+            offset = start
+            F.seek(offset)
+            while offset < stop:
+                kind, ulen, plen, prev = _RECORD.unpack(F.read(_RECORD.size))
+                username = F.read(ulen).decode('utf-8')
+                start = offset + _RECORD.size + ulen
+                live = kind == PUT and self.offsets.get(username) == offset
+                offset = start + plen
+                if live:
+                    yield self._load(F, start, load)
+                else:
+                    F.seek(offset)
+
+    def shards(self, n):
+        # Splits the live profiles into at most n runs of consecutive records,
+        # about equal in number, as (start, stop) offsets for iterprofiles.
+        # Together they cover every live profile once, in file order.
+        offsets = sorted(self.offsets.itervalues())
+        if not offsets:
+            return []
+        n = max(1, min(n, len(offsets)))
+        starts = [offsets[len(offsets) * i // n] for i in range(n)]
+        starts[0] = _HEADER.size
+        return zip(starts, starts[1:] + [self.end])
+
+    # ---- writing ----
+
+    def _write(self, F, kind, username, prev, payload):
+        name = username.encode('utf-8')
+        F.write(_RECORD.pack(kind, len(name), len(payload), prev))
+        F.write(name)
+        F.write(payload)
+
+    def _write_texts(self, F, entries):
+        if entries:
+            self._write(F, TEXTS, u'', 0, dumps(entries, HIGHEST_PROTOCOL))
+
+    def _append(self, kind, username, payload):
+        prev = self.offsets.get(username, 0)
+        name = username.encode('utf-8')
+        self._file.seek(0, os.SEEK_END)
+        self._write_texts(self._file, self.dictionary.take_new())
+        offset = self._file.tell()
+        self._write(self._file, kind, username, prev, payload)
+        self._file.flush()
+        old = self.read_at(prev) if prev else None
+        self._unindex(username, old)
+        if kind == PUT:
+            self.offsets[username] = offset
+        else:
+            del self.offsets[username]
+        self.end = offset + _RECORD.size + len(name) + len(payload)
+        self._unindexed += 1
+        if self.index_interval is not None and self._unindexed >= self.index_interval:
+            self.flush()
+        return old
+
+    def _put(self, profile, payload):
+        old = self._append(PUT, profile.username, payload)
+        self._index(profile.username, profile)
+        return old
+
+    def put(self, profile):
+        # Returns the profile this one replaces, or None.
+        return self._put(profile, encode_profile(profile, self.dictionary))
+
+    def refresh(self, profile):
+        # Like put, but a profile identical to the stored one is not written
+        # again. Returns (names of the sections that changed, replaced profile):
+        # ((), None) when nothing changed, (SECTIONS, None) for a new profile.
+        payload = encode_profile(profile, self.dictionary)
+        offset = self.offsets.get(profile.username)
+        if offset is None:
+            return SECTIONS, self._put(profile, payload)
+        old, new = split_payload(self.payload_at(offset)), split_payload(payload)
+        changed = tuple(name for name in SECTIONS if old[name] != new[name])
+        if not changed:
+            return changed, None
+        return changed, self._put(profile, payload)
+
+    def delete(self, username):
+        # Returns the removed profile, or None if there was none.
+        if username not in self.offsets:
+            return None
+        return self._append(DELETE, username, '')
+
+    def compact(self):
+        # Rewrite the file with only the live records. StoredProfiles read
+        # before this point must not load any more sections afterwards.
+        tmpfile = self.filename + '.tmp'
+        with open(tmpfile, 'wb') as F:
+            F.write(_HEADER.pack(MAGIC, VERSION))
+            self._write_texts(F, self.dictionary.entries())
+            offsets = {}
+            for offset, kind, username, prev, payload in self.records():
+                if kind == PUT and self.offsets.get(username) == offset:
+                    offsets[username] = F.tell()
+                    self._write(F, PUT, username, 0, payload)
+            end = F.tell()
+        self._file.close()
+        shutil.move(tmpfile, self.filename)
+        self._file = open(self.filename, 'r+b')
+        self.offsets = offsets
+        self.end = end
+        self.generation += 1
+        self.flush()
+
+def migrate_profile_folder(folder, store, remove=False):
+    # One-shot import of a directory of per-user pickles (the old PROFILE_FOLDER layout).
+    n = 0
+    for (dirpath, dirnames, filenames) in os.walk(folder):
+        for username in filenames:
+            filename = os.path.join(dirpath, username)
+            with open(filename, 'rb') as F:
+                profile = load(F)
+            store.put(profile)
+            n += 1
+            if n % 100 == 0:
+                print "%s profiles migrated"%(n)
+    store.flush()
+    print "%s profiles migrated"%(n)
+    if remove:
+        shutil.rmtree(folder)
+    return n
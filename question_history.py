@@ -0,0 +1,191 @@
+import os, time
+from array import array
+from cPickle import dump, load, HIGHEST_PROTOCOL
+
+# Every version of an account's question backup, kept as a log of changes.
+#
+# Each backup_user_questions() run that finds something different appends
+# one record to qbackup/<username>.history:
+#
+#     (version, time, full, definitions, states, orders)
+#
+# definitions maps the id of each question new to the history (or whose
+# wording changed) to (text, ((option id, option text), ...)); states maps
+# the id of each question whose answer changed to
+# (importance, answer option ids, acceptable option ids, explanation), or to
+# None once it is no longer answered; orders maps each importance whose list
+# changed to its question ids, in the order OkCupid gives them. full says
+# whether the backup was fetched whole or incrementally.
+#
+# The first record therefore holds everything and the later ones only what
+# changed, so that version n is rebuilt by replaying records 1..n.
+# snapshot(n) gives it as a QuestionSnapshot, which reads like a
+# StaticQuestionBackup; versions can also be counted from the end, -1 being
+# the latest. A record cut short by a crash is dropped the next time the
+# history is written.
+
+IMPORTANCES = ('mandatory', 'very_important', 'somewhat_important',
+               'little_important', 'not_important')
+
+def definition(question):
+    return (question.text, tuple((option.id, option.text) for option in question.answer_options))
+
+def state(question, importance):
+    return (importance,
+            tuple(option.id for option in question.answer_options if option.is_users),
+            tuple(option.id for option in question.answer_options if option.is_match),
+            question.explanation)
+
+class SnapshotOption(object):
+    # Reads like a StaticAnswerOption.
+    def __init__(self, id, text, is_users, is_match):
+        self.id = id
+        self.text = text
+        self.is_users = is_users
+        self.is_match = is_match
+
+class SnapshotQuestion(object):
+    # Reads like a StaticUserQuestion.
+    def __init__(self, id, definition, state):
+        text, options = definition
+        importance, mine, matches = state[:3]
+        self.answered = True
+        self.id = id
+        self.text = text
+        self.explanation = state[3]
+        self.answer_options = [SnapshotOption(option_id, option_text, option_id in mine, option_id in matches)
+                               for option_id, option_text in options]
+
+class QuestionSnapshot(object):
+    # Reads like a StaticQuestionBackup.
+    def __init__(self, version, time, definitions, states, orders):
+        self.version = version
+        self.time = time
+        for importance in IMPORTANCES:
+            setattr(self, importance, [SnapshotQuestion(id, definitions[id], states[id])
+                                       for id in orders.get(importance, ())])
+
+    @property
+    def questions(self):
+        for importance in IMPORTANCES:
+            for question in getattr(self, importance):
+                yield question
+
+class QuestionHistory(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.records = []
+        # where the last complete record ends
+        self.end = 0
+        if os.path.exists(filename):
+            with open(filename, 'rb') as F:
+                while True:
+                    try:
+                        record = load(F)
+                    except EOFError:
+                        break
+                    except Exception:
+                        # cut short; overwritten by the next record
+                        break
+                    self.records.append(record)
+                    self.end = F.tell()
+        # the latest version, replayed
+        self.definitions = {}
+        self.states = {}
+        self.orders = {}
+        for record in self.records:
+            self._apply(record, self.definitions, self.states, self.orders)
+
+    def __len__(self):
+        return len(self.records)
+
+    @staticmethod
+    def _apply(record, definitions, states, orders):
+        version, when, full, new_definitions, new_states, new_orders = record
+        definitions.update(new_definitions)
+        for id, value in new_states.iteritems():
+            if value is None:
+                states.pop(id, None)
+            else:
+                states[id] = value
+        orders.update(new_orders)
+
+    def versions(self):
+        # [(version, time, full, number of questions changed)], oldest first
+        return [(record[0], record[1], record[2], len(record[4])) for record in self.records]
+
+    def since_full(self):
+        # How many incremental versions were recorded after the latest full one
+        # (all of them if there is none).
+        n = 0
+        for record in reversed(self.records):
+            if record[2]:
+                return n
+            n += 1
+        return n
+
+    def _number(self, version):
+        if not self.records:
+            raise KeyError("no question backup versions in %s"%(self.filename))
+        n = len(self.records)
+        if version is None:
+            version = n
+        elif version < 0:
+            version += n + 1
+        if not 1 <= version <= n:
+            raise KeyError("no question backup version %s in %s (1 to %s)"%(version, self.filename, n))
+        return version
+
+    def snapshot(self, version=None):
+        # The backup as it was at version (the latest if None)
+        version = self._number(version)
+        if version == len(self.records):
+            definitions, states, orders = self.definitions, self.states, self.orders
+        else:
+            definitions, states, orders = {}, {}, {}
+            for record in self.records[:version]:
+                self._apply(record, definitions, states, orders)
+        return QuestionSnapshot(version, self.records[version - 1][1], definitions, states, orders)
+
+    def record(self, qbackup, full=True):
+        # Appends how qbackup (a StaticQuestionBackup) differs from the latest
+        # version. Returns the new version number, or None if nothing changed.
+        definitions = {}
+        states = {}
+        orders = {}
+        seen = set()
+        for importance in IMPORTANCES:
+            ids = array('i')
+            for question in getattr(qbackup, importance):
+                id = question.id
+                if id in seen:
+                    continue
+                seen.add(id)
+                ids.append(id)
+                value = definition(question)
+                if self.definitions.get(id) != value:
+                    definitions[id] = value
+                value = state(question, importance)
+                if self.states.get(id) != value:
+                    states[id] = value
+            if self.orders.get(importance, array('i')) != ids:
+                orders[importance] = ids
+        for id in self.states:
+            if id not in seen:
+                states[id] = None
+        if not (definitions or states or orders) and self.records:
+            return None
+        record = (len(self.records) + 1, time.time(), full, definitions, states, orders)
+        folder = os.path.dirname(self.filename)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(self.filename, 'ab') as F:
+            F.seek(self.end)
+            F.truncate()
+            dump(record, F, HIGHEST_PROTOCOL)
+            F.flush()
+            os.fsync(F.fileno())
+            self.end = F.tell()
+        self.records.append(record)
+        self._apply(record, self.definitions, self.states, self.orders)
+        return record[0]
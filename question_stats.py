@@ -0,0 +1,149 @@
+import os, shutil
+from cPickle import dump, load, HIGHEST_PROTOCOL
+from collections import defaultdict
+
+from profile_store import PUT
+
+# Per-question aggregates over a set of profiles, as used by QuestionAnalyzer.
+# Each profile's contribution can be added and subtracted again, so a saved
+# copy can follow the profile store record by record instead of being rebuilt.
+
+class QuestionStats(object):
+    def __init__(self):
+        # keys are question ids, values are [my_bad, their_bad, answered]
+        self.qstats = {}
+        # keys are question ids answered by the viewing account, values are texts
+        self.answered = {}
+        # keys are question ids the viewing account has not answered,
+        # values are [text, number of profiles]
+        self.unanswered_counts = {}
+        self.mine_mismatches = defaultdict(list)
+        self.theirs_mismatches = defaultdict(list)
+        # how far into the profile store these stats reach
+        self.generation = None
+        self.position = 0
+
+    def add(self, profile):
+        for question in profile.questions:
+            id = question.id
+            if question.my_answer is not None:
+                if id not in self.answered:
+                    self.answered[id] = question.text
+                if id not in self.qstats:
+                    self.qstats[id] = [0,0,0]
+                self.qstats[id][2] += 1
+                if not question.my_answer_matches:
+                    self.mine_mismatches[id].append(profile.username)
+                    self.qstats[id][0] += 1
+                if not question.their_answer_matches:
+                    self.theirs_mismatches[id].append(profile.username)
+                    self.qstats[id][1] += 1
+            else:
+                if id not in self.unanswered_counts:
+                    self.unanswered_counts[id] = [question.text, 0]
+                self.unanswered_counts[id][1] += 1
+
+    def remove(self, profile):
+        if profile is None:
+            return
+        for question in profile.questions:
+            id = question.id
+            if question.my_answer is not None:
+                stats = self.qstats.get(id)
+                if stats is None:
+                    continue
+                stats[2] -= 1
+                if not question.my_answer_matches:
+                    self._discard(self.mine_mismatches, id, profile.username)
+                    stats[0] -= 1
+                if not question.their_answer_matches:
+                    self._discard(self.theirs_mismatches, id, profile.username)
+                    stats[1] -= 1
+                if stats[2] <= 0:
+                    del self.qstats[id]
+                    del self.answered[id]
+            elif id in self.unanswered_counts:
+                self.unanswered_counts[id][1] -= 1
+                if self.unanswered_counts[id][1] <= 0:
+                    del self.unanswered_counts[id]
+
+    def _discard(self, D, id, username):
+        L = D.get(id)
+        if L is not None and username in L:
+            L.remove(username)
+            if not L:
+                del D[id]
+
+    def replace(self, old, new):
+        self.remove(old)
+        if new is not None:
+            self.add(new)
+
+    def merge(self, other):
+        # Adds in stats over profiles that come after this one's, e.g. from
+        # another slice of the store; mismatch lists keep that order.
+        for id, stats in other.qstats.iteritems():
+            mine = self.qstats.setdefault(id, [0,0,0])
+            for i in range(3):
+                mine[i] += stats[i]
+        for id, text in other.answered.iteritems():
+            self.answered.setdefault(id, text)
+        for id, (text, n) in other.unanswered_counts.iteritems():
+            self.unanswered_counts.setdefault(id, [text, 0])[1] += n
+        for D, other_D in ((self.mine_mismatches, other.mine_mismatches),
+                           (self.theirs_mismatches, other.theirs_mismatches)):
+            for id, usernames in other_D.iteritems():
+                D[id].extend(usernames)
+
+    def record(self, store, old, new):
+        # Account for a write just made to store; old is what it returned.
+        self.replace(old, new)
+        self.position = store.end
+
+    def unanswered(self, exclude=()):
+        # question ids -> texts for questions the viewing account has not answered
+        return dict((id, text) for id, (text, n) in self.unanswered_counts.iteritems()
+                    if id not in exclude)
+
+    # ---- following a ProfileStore ----
+
+    def build(self, store):
+        self.__init__()
+        for profile in store.iterprofiles(load=('header', 'questions')):
+            self.add(profile)
+        self.generation = store.generation
+        self.position = store.end
+
+    def catch_up(self, store):
+        # Apply every store record written since these stats were saved.
+        if self.generation != store.generation or self.position > store.end:
+            self.build(store)
+            return
+        for offset, kind, username, prev, payload in store.records(self.position):
+            if prev:
+                self.remove(store.read_at(prev))
+            if kind == PUT:
+                self.add(store.decode(payload))
+        self.position = store.end
+
+    def save(self, filename):
+        tmpfile = filename + '.tmp'
+        with open(tmpfile, 'wb') as F:
+            dump(self, F, HIGHEST_PROTOCOL)
+        shutil.move(tmpfile, filename)
+
+    @classmethod
+    def load(cls, filename, store):
+        stats = None
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'rb') as F:
+                    stats = load(F)
+            except Exception:
+                stats = None
+        if stats is None:
+            stats = cls()
+            stats.build(store)
+        else:
+            stats.catch_up(store)
+        return stats
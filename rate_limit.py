@@ -0,0 +1,126 @@
+import time, random, threading
+
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout, HTTPError
+
+from metrics import metrics
+
+# Request pacing that follows how OkCupid responds, and retries of requests
+# that failed for reasons that pass.
+#
+# AdaptiveRateLimiter is a token bucket: requests are spaced interval
+# seconds apart on average, with up to burst of them back to back. Each
+# healthy response shortens the interval a little, down to min_interval;
+# a throttled one (429, 5xx, a dropped connection) doubles it, up to
+# max_interval, and pauses every request for a jittered delay that doubles
+# with each further throttled response in a row (or as long as Retry-After
+# asks). The limiter is safe to
+# share between threads; okcupyd sessions call its wait() before requests.
+#
+# RetryingAdapter, mounted on a requests session, reports every response
+# to a limiter and sends throttled requests again, at most retries times,
+# so that what reaches okcupyd's raise_for_status is either a success, a
+# permanent error such as 404, or a failure that outlasted the retries.
+
+THROTTLED_STATUSES = (429, 500, 502, 503, 504)
+GONE_STATUSES = (404, 410)
+
+class AdaptiveRateLimiter(object):
+    def __init__(self, interval, min_interval=None, max_interval=60.0, burst=1,
+                 speedup=0.98, backoff=1.0, max_backoff=300.0):
+        # interval is where pacing starts; min_interval defaults to it, so
+        # requests never come faster than that. backoff is the first pause
+        # after a throttled response, doubling with each one in a row.
+        self.rate_limit = interval
+        self.interval = float(interval or 0)
+        self.min_interval = self.interval if min_interval is None else float(min_interval)
+        self.max_interval = max(float(max_interval), self.interval)
+        self.burst = burst
+        self.speedup = speedup
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # consecutive throttled responses
+        self.failures = 0
+        # no request starts before this
+        self.resume_at = 0.0
+        # the theoretical arrival time of the next request
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        # Blocks until the next request may go. Requests reserve their turn
+        # under the lock and sleep outside it, so waiting threads go in order.
+        with self._lock:
+            now = time.time()
+            start = max(now, self.resume_at, self._next - (self.burst - 1) * self.interval)
+            self._next = max(self._next, start) + self.interval
+        if start > now:
+            with metrics.timer('rate limit wait seconds'):
+                time.sleep(start - now)
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.interval = max(self.min_interval, self.interval * self.speedup)
+
+    def throttled(self, retry_after=None):
+        with self._lock:
+            self.failures += 1
+            if self.failures == 1:
+                # once per run of failures; the pauses grow while it lasts
+                self.interval = min(self.max_interval, max(self.interval, 0.1) * 2)
+            pause = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+            pause = random.uniform(pause / 2, pause)
+            if retry_after is not None:
+                pause = max(pause, retry_after)
+            self.resume_at = max(self.resume_at, time.time() + pause)
+        metrics.add('throttled responses')
+
+def retry_after(response):
+    # Retry-After in seconds, if given as such
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+def is_gone(error):
+    # Whether a request failed because what it asked for does not exist,
+    # e.g. a deactivated profile, as opposed to a failure worth retrying.
+    response = getattr(error, 'response', None)
+    return (isinstance(error, HTTPError) and response is not None and
+            response.status_code in GONE_STATUSES)
+
+class RetryingAdapter(HTTPAdapter):
+    def __init__(self, limiter, retries=4, **kwargs):
+        HTTPAdapter.__init__(self, **kwargs)
+        self.limiter = limiter
+        self.retries = retries
+
+    def send(self, request, **kwargs):
+        # The caller waited on the limiter for the first attempt; retries wait here.
+        attempt = 0
+        while True:
+            try:
+                response = HTTPAdapter.send(self, request, **kwargs)
+            except (ConnectionError, Timeout):
+                self.limiter.throttled()
+                if attempt >= self.retries:
+                    raise
+            else:
+                if response.status_code not in THROTTLED_STATUSES:
+                    self.limiter.success()
+                    return response
+                self.limiter.throttled(retry_after(response))
+                if attempt >= self.retries:
+                    return response
+                response.close()
+            attempt += 1
+            metrics.add('http retries')
+            self.limiter.wait()
+
+def mount_retrying_adapter(session, limiter, retries=4):
+    # session: a requests session, or an okcupyd one wrapping it
+    adapter = RetryingAdapter(limiter, retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return adapter
@@ -0,0 +1,176 @@
+import os, shutil, codecs, json, cgi
+
+# Pre-date reports on many profiles at once: for each, the rating breakdown
+# under a Valuations, the answers to the NightOfAdvice questions and the
+# questions on which the two of you rule each other out.
+#
+# A Report is filled one profile at a time, as the profiles stream past, and
+# keeps only what it will write: plain lists and dicts, one per profile,
+#
+#     {'username': ..., 'match_percentage': ..., 'age': ..., 'location': ...,
+#      'ratings': [[category, rating, answered], ...],
+#      'valued_answers': [[rating, question, their answer], ...],
+#      'advice': [[question, their answer], ...],
+#      'theirs': [[importance, question, their answer], ...],
+#      'mine': [[importance, question, my answer], ...]}
+#
+# which is also the JSON format. 'theirs' are the answers the viewing account
+# would not accept and 'mine' its answers they would not, most important (to
+# the viewing account) first. Everything looked up per question is worked
+# out once, when the Report is made.
+
+IMPORTANCES = ('mandatory', 'very_important', 'somewhat_important',
+               'little_important', 'not_important')
+
+FORMATS = ('text', 'json', 'html')
+
+def report_format(filename, format=None):
+    # format, or the one filename's extension calls for: .json, .html, else text
+    if format is None:
+        extension = os.path.splitext(filename)[1].lower()
+        format = {'.json': 'json', '.html': 'html', '.htm': 'html'}.get(extension, 'text')
+    if format not in FORMATS:
+        raise ValueError("unknown report format: %s"%(format))
+    return format
+
+def _text(value):
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+class Report(object):
+    def __init__(self, valuations=None, advice=None, qbackup=None, category='overall'):
+        # qbackup is the viewing account's StaticQuestionBackup, which says how
+        # important each question is; mismatches are listed unranked without it.
+        # Profiles are written best rated in category first, or without
+        # valuations highest match percentage first.
+        self.valuations = valuations
+        self.advice = advice
+        self.category = category
+        # keys are question ids, values are importance names
+        self.importance = {}
+        if qbackup is not None:
+            for importance in IMPORTANCES:
+                for question in getattr(qbackup, importance):
+                    self.importance[question.id] = importance
+        self._rank = dict((importance, i) for i, importance in enumerate(IMPORTANCES))
+        self.categories = []
+        if valuations is not None:
+            self.categories = sorted(valuations.categories.itervalues()) + ['overall']
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, profile):
+        self.entries.append(self.entry(profile))
+
+    def entry(self, profile):
+        entry = {}
+        for name in ('username', 'match_percentage', 'age', 'gender', 'location'):
+            entry[name] = _text(getattr(profile, name, None))
+        if self.valuations is not None:
+            ratings, answered = self.valuations._rate(profile)
+            entry['ratings'] = [[cat, ratings[cat], answered[cat]] for cat in self.categories]
+            entry['valued_answers'] = [[rating, _text(text), _text(answer)] for rating, text, answer
+                                       in self.valuations.valued_answers(profile)]
+        if self.advice is not None:
+            entry['advice'] = [[_text(text), _text(answer)] for text, answer in self.advice.answers(profile)]
+        theirs = []
+        mine = []
+        for question in profile.questions:
+            if question.my_answer is None:
+                continue
+            if not question.their_answer_matches:
+                theirs.append(self._mismatch(question, question.their_answer))
+            if not question.my_answer_matches:
+                mine.append(self._mismatch(question, question.my_answer))
+        entry['theirs'] = self._ranked(theirs)
+        entry['mine'] = self._ranked(mine)
+        return entry
+
+    def _mismatch(self, question, answer):
+        return [self.importance.get(question.id), _text(question.text), _text(answer)]
+
+    def _ranked(self, mismatches):
+        mismatches.sort(key=lambda item: self._rank.get(item[0], len(IMPORTANCES)))
+        return mismatches
+
+    def _sorted(self):
+        if self.valuations is not None:
+            column = self.categories.index(self.category)
+            key = lambda entry: (-entry['ratings'][column][1], entry['username'])
+        else:
+            key = lambda entry: (-(entry['match_percentage'] or 0), entry['username'])
+        return sorted(self.entries, key=key)
+
+    # ---- writing ----
+
+    def write(self, filename, format=None):
+        format = report_format(filename, format)
+        entries = self._sorted()
+        tmpfile = filename + '.tmp'
+        if format == 'json':
+            with open(tmpfile, 'wb') as F:
+                json.dump({'categories': self.categories, 'profiles': entries}, F, indent=1)
+        else:
+            with codecs.open(tmpfile, 'w', 'utf-8') as F:
+                if format == 'html':
+                    self._write_html(F, entries)
+                else:
+                    self._write_text(F, entries)
+        shutil.move(tmpfile, filename)
+
+    def _summary(self, entry):
+        details = ["%s%%"%(entry['match_percentage'])]
+        details.extend(unicode(entry[name]) for name in ('age', 'gender', 'location') if entry[name])
+        return u", ".join(details)
+
+    def _write_text(self, F, entries):
+        for entry in entries:
+            F.write(u"==== %s (%s) ====\n"%(entry['username'], self._summary(entry)))
+            if 'ratings' in entry:
+                F.write(u"  ".join(u"%s : %s / %s"%tuple(row) for row in entry['ratings']) + u"\n")
+                for rating, text, answer in entry['valued_answers']:
+                    F.write(u"%s\n  %s : %s\n"%(text, rating, answer))
+            if entry.get('advice'):
+                F.write(u"-- Advice\n")
+                for text, answer in entry['advice']:
+                    F.write(u"%s\n  %s\n"%(text, answer))
+            for key, title in (('theirs', "Answers you would not accept"),
+                               ('mine', "Your answers they would not accept")):
+                if entry[key]:
+                    F.write(u"-- %s (%s)\n"%(title, len(entry[key])))
+                    for importance, text, answer in entry[key]:
+                        F.write(u"%s\n  %s [%s]\n"%(text, answer, importance or '?'))
+            F.write(u"\n")
+
+    def _write_html(self, F, entries):
+        e = lambda value: cgi.escape(unicode(value), True)
+        F.write(u"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Profile report</title>\n"
+                u"<style>body{font-family:sans-serif} td,th{padding:0 .6em;text-align:left;"
+                u"vertical-align:top} h2{margin-top:2em}</style></head><body>\n")
+        for entry in entries:
+            F.write(u"<h2 id=\"%s\">%s</h2>\n<p>%s</p>\n"%(e(entry['username']), e(entry['username']),
+                                                          e(self._summary(entry))))
+            if 'ratings' in entry:
+                F.write(u"<table><tr>%s</tr><tr>%s</tr></table>\n"%(
+                    u"".join(u"<th>%s</th>"%(e(cat)) for cat, rating, answered in entry['ratings']),
+                    u"".join(u"<td>%s / %s</td>"%(rating, answered)
+                             for cat, rating, answered in entry['ratings'])))
+                self._html_table(F, e, "Valued answers", entry['valued_answers'])
+            if entry.get('advice'):
+                self._html_table(F, e, "Advice", entry['advice'])
+            self._html_table(F, e, "Answers you would not accept",
+                             [[text, answer, importance or '?'] for importance, text, answer in entry['theirs']])
+            self._html_table(F, e, "Your answers they would not accept",
+                             [[text, answer, importance or '?'] for importance, text, answer in entry['mine']])
+        F.write(u"</body></html>\n")
+
+    def _html_table(self, F, e, title, rows):
+        if not rows:
+            return
+        F.write(u"<h3>%s (%s)</h3>\n<table>\n"%(e(title), len(rows)))
+        for row in rows:
+            F.write(u"<tr>%s</tr>\n"%(u"".join(u"<td>%s</td>"%(e(value)) for value in row)))
+        F.write(u"</table>\n")
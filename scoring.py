@@ -0,0 +1,164 @@
+import heapq
+import numpy as np
+
+from metrics import metrics
+
+# Batch version of Valuations._rate.
+#
+# ProfileMatrix encodes a set of profiles once, as a sparse profile x question
+# matrix whose entries are answer codes: each distinct (question id, answer text)
+# pair seen in the corpus gets one code. Stored profiles are encoded straight
+# from the arrays their questions are packed in (see compact_questions.py),
+# without going through a question object per answer. A Valuations compiles to a
+# weight table with one row per code and one column per category (rating and
+# answered count), so rating every profile under one or several valuations
+# is, per column, a weighted bincount of the entries by profile, with no
+# Python loop per profile. Entries whose codes no valuation weighs are
+# dropped first.
+
+class ProfileMatrix(object):
+    def __init__(self, profiles):
+        self.usernames = []
+        # keys are (question id, answer text), values are codes
+        self.codes = {}
+        codes, rows = [], []
+        # Profiles from a ProfileStore are encoded from their packed answer
+        # arrays all at once, the others question by question.
+        packed = []
+        dictionary = None
+        for i, profile in enumerate(profiles):
+            self.usernames.append(profile.username)
+            arrays = getattr(profile, 'answer_arrays', None)
+            arrays = arrays and arrays()
+            if arrays is not None and (dictionary is None or arrays[2] is dictionary):
+                dictionary = arrays[2]
+                packed.append((i, arrays[:2]))
+                continue
+            for question in profile.questions:
+                if question.their_answer is None:
+                    continue
+                key = (question.id, question.their_answer)
+                code = self.codes.get(key)
+                if code is None:
+                    code = self.codes[key] = len(self.codes)
+                codes.append(code)
+                rows.append(i)
+        entries = [np.array(codes, dtype=np.int32)]
+        entry_rows = [np.array(rows, dtype=np.int32)]
+        if packed:
+            codes, rows = self._encode_packed(packed, dictionary)
+            entries.append(codes)
+            entry_rows.append(rows)
+        self.entries = np.concatenate(entries)
+        # the profile of each entry
+        self.rows = np.concatenate(entry_rows)
+        self.index = dict((username, i) for i, username in enumerate(self.usernames))
+
+    def _encode_packed(self, packed, dictionary):
+        # [(profile number, (ids, theirs) from answer_arrays())] -> (codes, rows) of their
+        # answered questions. Every (question id, answer index) pair in the
+        # dictionary has a number; the pairs that turn up are given codes.
+        ids = np.frombuffer(''.join(ids for i, (ids, theirs) in packed), dtype=np.intc)
+        theirs = np.frombuffer(''.join(theirs for i, (ids, theirs) in packed), dtype=np.short)
+        rows = np.repeat(np.array([i for i, data in packed], dtype=np.int32),
+                         [len(theirs_data) // theirs.itemsize for i, (ids_data, theirs_data) in packed])
+        answered = theirs >= 0
+        ids, theirs, rows = ids[answered], theirs[answered], rows[answered]
+        qids = np.array(sorted(dictionary.answers), dtype=np.intc)
+        sizes = np.array([len(dictionary.answers[id]) for id in qids], dtype=np.int64)
+        bases = np.cumsum(sizes) - sizes
+        numbers = bases[np.searchsorted(qids, ids)] + theirs
+        present = np.unique(numbers)
+        which = np.searchsorted(bases, present, 'right') - 1
+        remap = np.zeros(sizes.sum(), dtype=np.int32)
+        for number, q, index in zip(present, which, present - bases[which]):
+            id = qids[q]
+            key = (id, dictionary.answers[id][index])
+            code = self.codes.get(key)
+            if code is None:
+                code = self.codes[key] = len(self.codes)
+            remap[number] = code
+        return remap[numbers], rows
+
+    def __len__(self):
+        return len(self.usernames)
+
+    def _weights(self, valuations):
+        # Columns are (category, 'rating'|'answered') pairs for every category
+        # used by valuations, plus 'overall'.
+        categories = sorted(set(valuations.categories.itervalues()) |
+                            set(cat for cat in valuations.qcategory.itervalues() if cat is not None))
+        column = dict((cat, i) for i, cat in enumerate(categories))
+        n = len(categories)
+        W = np.zeros((len(self.codes), 2 * (n + 1)), dtype=np.int64)
+        for (id, answer), code in self.codes.iteritems():
+            cat = valuations.qcategory.get(id)
+            if cat is None:
+                continue
+            rating = valuations.qrating[id].get(answer, 0) if id in valuations.qrating else 0
+            W[code, column[cat]] = rating
+            W[code, n + 1 + column[cat]] = 1
+        W[:, n] = W[:, :n].sum(axis=1)
+        W[:, 2 * n + 1] = W[:, n + 1:2 * n + 1].sum(axis=1)
+        return categories + ['overall'], W
+
+    def score(self, *valuations_list):
+        # Returns one Scores per valuations, all computed in the same pass.
+        with metrics.timer('score seconds', len(self) * len(valuations_list)):
+            return self._score(valuations_list)
+
+    def _score(self, valuations_list):
+        layouts = [self._weights(valuations) for valuations in valuations_list]
+        W = np.hstack([w for categories, w in layouts]) if layouts else np.zeros((len(self.codes), 0), np.int64)
+        weighed = W.any(axis=1)[self.entries]
+        entries = self.entries[weighed]
+        # bincount wants native ints, and would convert them for every column
+        rows = self.rows[weighed].astype(np.intp)
+        totals = np.zeros((len(self), W.shape[1]), dtype=np.int64)
+        # float sums of ints are exact well past any rating total
+        for j, column in enumerate(W.T.astype(np.float64)):
+            if column.any():
+                totals[:, j] = np.bincount(rows, weights=column[entries], minlength=len(self))
+        results = []
+        offset = 0
+        for categories, w in layouts:
+            n = len(categories)
+            block = totals[:, offset:offset + 2 * n]
+            results.append(Scores(self, categories, block[:, :n], block[:, n:]))
+            offset += 2 * n
+        return results
+
+class Scores(object):
+    # ratings[category] and answered[category] are arrays over matrix.usernames.
+    def __init__(self, matrix, categories, ratings, answered):
+        self.matrix = matrix
+        self.ratings = dict((cat, ratings[:, i]) for i, cat in enumerate(categories))
+        self.answered = dict((cat, answered[:, i]) for i, cat in enumerate(categories))
+
+    def _column(self, D, cat):
+        if cat in D:
+            return D[cat]
+        return np.zeros(len(self.matrix), dtype=np.int64)
+
+    def rating(self, username, cat='overall'):
+        return int(self._column(self.ratings, cat)[self.matrix.index[username]])
+
+    def n_answered(self, username, cat='overall'):
+        return int(self._column(self.answered, cat)[self.matrix.index[username]])
+
+    def top(self, k=20, category='overall', keep=None):
+        # The k best (rating, answered, username), best first. keep, if given,
+        # is a predicate on usernames.
+        ratings = self._column(self.ratings, category)
+        answered = self._column(self.answered, category)
+        candidates = ((ratings[i], answered[i], username)
+                      for i, username in enumerate(self.matrix.usernames)
+                      if keep is None or keep(username))
+        return [(int(r), int(a), u) for r, a, u in heapq.nlargest(k, candidates)]
+
+    def ranked(self, category='overall'):
+        # Every (rating, answered, username), worst first.
+        ratings = self._column(self.ratings, category)
+        answered = self._column(self.answered, category)
+        order = np.lexsort((answered, ratings))
+        return [(int(ratings[i]), int(answered[i]), self.matrix.usernames[i]) for i in order]
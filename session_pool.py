@@ -0,0 +1,162 @@
+import os, shutil, threading
+from cPickle import dump, load, HIGHEST_PROTOCOL
+from collections import defaultdict
+from urlparse import urlparse
+
+from metrics import metrics
+
+# Logged in okcupyd sessions, kept instead of logging in for every batch job.
+#
+# Sessions are kept per account and slot (one per concurrent worker), so
+# their requests sessions keep their connections open between calls. What a
+# login leaves behind (cookies, headers, the access token) is saved to
+# folder/<username> and restored by later runs, which then make no login
+# request at all. A restored session is trusted until a request fails for
+# want of a login: the pool logs in again, once for all of that account's
+# slots, and sends the request again.
+#
+# Each account's sessions share the rate limiter limiter_for(username)
+# gives, and retry throttled requests through it; see rate_limit.py.
+
+# okcupyd Session attributes set by do_login, besides cookies and headers
+SAVED_ATTRIBUTES = ('log_in_name', 'access_token')
+
+def auth_failed(response):
+    # OkCupid turns away requests that need a login with 401 or 403 from its
+    # API, or by redirecting to the login page.
+    if response.status_code in (401, 403):
+        return True
+    if response.is_redirect:
+        return urlparse(response.headers.get('location', '')).path.rstrip('/') == '/login'
+    return False
+
+class SessionPool(object):
+    def __init__(self, folder, limiter_for, hooks=()):
+        # hooks are requests response hooks added to every session
+        self.folder = folder
+        self.limiter_for = limiter_for
+        self.hooks = list(hooks)
+        # keys are (username, slot), values are okcupyd Sessions
+        self.sessions = {}
+        self.passwords = {}
+        # keys are usernames, values are how many times the pool logged in
+        # as them; a session from before the latest login picks up its state
+        self.logins = defaultdict(int)
+        self._generations = {}
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def state_file(self, username):
+        return os.path.join(self.folder, username)
+
+    def get(self, username, password, slot=0):
+        # A logged in session for username: the pooled one, one restored from
+        # disk, or failing those a new login.
+        with self._lock:
+            session = self.sessions.get((username, slot))
+            if session is None:
+                self.passwords[username] = password
+                session = self._new_session(username)
+                if self._restore(session, username):
+                    metrics.add('sessions restored')
+                else:
+                    self._login(session, username)
+                self._generations[id(session)] = self.logins[username]
+                session.hooks['response'].extend(self.hooks)
+                session.hooks['response'].append(self._auth_hook(username, session))
+                self.sessions[(username, slot)] = session
+            return session
+
+    def _new_session(self, username):
+        import requests
+        from okcupyd.session import Session
+        from rate_limit import mount_retrying_adapter
+        limiter = self.limiter_for(username)
+        requests_session = requests.Session()
+        mount_retrying_adapter(requests_session, limiter)
+        session = Session(requests_session)
+        # set directly: Session only keeps its own RateLimiter class as given
+        session.rate_limiter = limiter
+        return session
+
+    def _login(self, session, username):
+        session.do_login(username, self.passwords[username])
+        self.logins[username] += 1
+        metrics.add('logins')
+        self.save(session, username)
+
+    def _restore(self, session, username):
+        filename = self.state_file(username)
+        if not os.path.exists(filename):
+            return False
+        try:
+            with open(filename, 'rb') as F:
+                state = load(F)
+        except Exception:
+            return False
+        cookies = state['cookies']
+        cookies.clear_expired_cookies()
+        if not len(cookies):
+            return False
+        session.cookies.update(cookies)
+        session.headers.update(state['headers'])
+        for name in SAVED_ATTRIBUTES:
+            setattr(session, name, state.get(name))
+        return True
+
+    def save(self, session, username):
+        # What the login left behind, readable only by the owner
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        state = {'cookies': session.cookies, 'headers': dict(session.headers)}
+        for name in SAVED_ATTRIBUTES:
+            state[name] = getattr(session, name, None)
+        filename = self.state_file(username)
+        tmpfile = filename + '.tmp'
+        with open(tmpfile, 'wb') as F:
+            os.chmod(tmpfile, 0600)
+            dump(state, F, HIGHEST_PROTOCOL)
+        shutil.move(tmpfile, filename)
+
+    def _reauthenticate(self, session, username):
+        with self._lock:
+            if self._generations.get(id(session)) == self.logins[username]:
+                self._login(session, username)
+            elif not self._restore(session, username):
+                # another slot logged in since, but its state is gone
+                self._login(session, username)
+            self._generations[id(session)] = self.logins[username]
+
+    def _auth_hook(self, username, session):
+        def hook(response, *args, **kwargs):
+            # Replaces a response that needed a login by that of the same
+            # request sent again after logging in; a second failure stands.
+            local = self._local
+            if getattr(local, 'busy', False) or not auth_failed(response):
+                return None
+            local.busy = True
+            try:
+                metrics.add('reauthentications')
+                self._reauthenticate(session, username)
+                retry = response.request.copy()
+                retry.headers.pop('Cookie', None)
+                retry.prepare_cookies(session.cookies)
+                session.rate_limiter.wait()
+                return session._requests_session.send(retry, **kwargs)
+            finally:
+                local.busy = False
+        return hook
+
+    def forget(self, username):
+        # Drops username's sessions and saved state, e.g. after a password change.
+        with self._lock:
+            for key in [key for key in self.sessions if key[0] == username]:
+                self.sessions.pop(key).close()
+            if os.path.exists(self.state_file(username)):
+                os.remove(self.state_file(username))
+
+    def close(self):
+        with self._lock:
+            for session in self.sessions.itervalues():
+                session.close()
+            self.sessions.clear()
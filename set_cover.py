@@ -0,0 +1,44 @@
+import heapq
+
+# Greedy cover of a set of questions by profiles, as used by
+# QuestionAnalyzer.show_questions_to_answer(by_profile=True).
+#
+# Each step picks the profile whose answered questions cover the largest
+# fraction of its own total among the still unclaimed ones. A profile's score
+# can only go down as questions are claimed, so scores are kept in a heap and
+# only recomputed when a profile reaches the top (lazy greedy): the best
+# profile is found without rescanning every profile at every step.
+
+def invert(index):
+    # {key: iterable of values} -> {value: set of keys}
+    inverted = {}
+    for key, values in index.iteritems():
+        for value in values:
+            inverted.setdefault(value, set()).add(key)
+    return inverted
+
+def greedy_cover(profiles_by_question, sizes):
+    # profiles_by_question: {question id: iterable of usernames}
+    # sizes: {username: number of questions that profile answered}
+    # Returns [(username, fraction, [question ids claimed])] in pick order.
+    # Questions no profile answered are left out.
+    questions_by_profile = invert(profiles_by_question)
+    unclaimed = set(id for id, users in profiles_by_question.iteritems() if users)
+    heap = [(-float(len(ids)) / sizes[username], username)
+            for username, ids in questions_by_profile.iteritems()]
+    heapq.heapify(heap)
+    groups = []
+    while unclaimed and heap:
+        negf, username = heapq.heappop(heap)
+        ids = questions_by_profile[username] & unclaimed
+        questions_by_profile[username] = ids
+        if not ids:
+            continue
+        f = float(len(ids)) / sizes[username]
+        if heap and f < -heap[0][0]:
+            # stale score: requeue and look at the new top
+            heapq.heappush(heap, (-f, username))
+            continue
+        unclaimed -= ids
+        groups.append((username, f, sorted(ids)))
+    return groups
@@ -0,0 +1,313 @@
+import os, shutil, zlib
+from array import array
+from cPickle import dump, load, HIGHEST_PROTOCOL
+
+from profile_store import PUT, DELETE
+
+# Which stored profiles answered their questions most alike, without
+# comparing every pair of them.
+#
+# A profile's answers are the set of (question id, answer) pairs it gave,
+# and two profiles are as alike as the Jaccard similarity of those sets.
+# Each set is cut down to a MinHash signature of num_perm numbers, any one
+# of which two profiles share with a probability equal to that similarity.
+# The signature is split into bands of rows numbers, and profiles sharing
+# all the numbers of any band are the candidates for a query (locality
+# sensitive hashing). Profiles answer few of the same questions, so even
+# the most alike share only a small part of their answers: with the default
+# 64 bands of 2, a profile 20% alike turns up with probability 0.93 and one
+# 5% alike with probability 0.15. That still makes a tenth of the corpus
+# candidates for a typical query, so only the candidates sharing two bands
+# or more are compared with the query (a profile 20% alike shares two with
+# probability 0.73, one 5% alike with probability 0.01), and only if fewer
+# than asked for are left are the others compared as well. Candidates are
+# ranked by the share of the signature they agree on; should fewer than
+# asked for turn up all the same, only those are returned.
+#
+# Documents are numbered as in EssayIndex: a profile stored again gets a
+# new number and its old one is dropped; compact() squeezes them out.
+# Signatures (the low 16 bits of each number, which is plenty to tell
+# whether two agree) and band keys are kept in flat arrays, one row per
+# document. For lookups the band keys are sorted, all bands in one array;
+# documents added since are looked up by comparing their keys directly, and
+# the keys are sorted again once those come to an eighth of the documents.
+
+NUM_PERM = 128
+ROWS = 2
+# a Mersenne prime, the modulus of the hash functions
+PRIME = (1 << 31) - 1
+# the stored signature of a profile without answers, which is like nothing
+EMPTY = 0xffff
+# how many bands a candidate shares with the query to be compared first
+CLOSE_BANDS = 2
+# how many documents may be added before the bands are sorted again, at least
+UNSORTED = 256
+
+def answer_features(pairs):
+    # The features of (question id, answer) pairs, as 32 bit hashes
+    features = set()
+    for id, answer in pairs:
+        if answer is None:
+            continue
+        if isinstance(answer, unicode):
+            answer = answer.encode('utf-8')
+        features.add(zlib.crc32("%d:%s"%(id, answer)) & 0xffffffff)
+    return features
+
+def profile_features(profile):
+    return answer_features((question.id, question.their_answer) for question in profile.questions)
+
+def backup_features(qbackup):
+    # The features of an account's own answers, from its question backup
+    pairs = []
+    for question in qbackup.questions:
+        for option in question.answer_options:
+            if option.is_users:
+                pairs.append((question.id, option.text))
+    return answer_features(pairs)
+
+class SimilarityIndex(object):
+    def __init__(self, num_perm=NUM_PERM, rows=ROWS, seed=1):
+        if num_perm % rows:
+            raise ValueError("num_perm must be a multiple of rows")
+        import numpy as np
+        self.num_perm = num_perm
+        self.rows = rows
+        self.bands = num_perm // rows
+        random = np.random.RandomState(seed)
+        # the hash functions (a * x + b) % PRIME, and per band the weights
+        # that fold its rows into one key
+        self.a = array('I', random.randint(1, PRIME, num_perm).astype(np.uint32).tostring())
+        self.b = array('I', random.randint(0, PRIME, num_perm).astype(np.uint32).tostring())
+        self.weights = array('I', (random.randint(0, 1 << 31, num_perm) * 2 + 1).astype(np.uint32).tostring())
+        self._reset()
+
+    def _reset(self):
+        # per document number: username (None once dropped), 1 if live, signature, band keys
+        self.usernames = []
+        self.live = bytearray()
+        self.signatures = array('H')
+        self.keys = array('I')
+        # keys are usernames, values are live document numbers
+        self.docs = {}
+        # how far into the profile store this index reaches
+        self.generation = None
+        self.position = 0
+        self._sorted = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_sorted'] = None
+        return state
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, username):
+        return username in self.docs
+
+    def signature(self, features):
+        # The MinHash signature of a set of features, as a numpy array of
+        # num_perm 31 bit numbers; all PRIME for an empty set.
+        import numpy as np
+        if not features:
+            return np.repeat(np.uint32(PRIME), self.num_perm)
+        x = np.fromiter(features, dtype=np.uint64, count=len(features))
+        a = np.frombuffer(self.a, dtype=np.uint32).astype(np.uint64)
+        b = np.frombuffer(self.b, dtype=np.uint32).astype(np.uint64)
+        return ((a[:, None] * x[None, :] + b[:, None]) % PRIME).min(axis=1).astype(np.uint32)
+
+    def stored(self, signature):
+        # signature as kept for comparisons
+        import numpy as np
+        if signature[0] == PRIME:
+            return np.repeat(np.uint16(EMPTY), self.num_perm)
+        return (signature & 0xffff).astype(np.uint16)
+
+    def band_keys(self, signature):
+        import numpy as np
+        weights = np.frombuffer(self.weights, dtype=np.uint32).astype(np.uint64)
+        folded = (signature.astype(np.uint64) * weights).reshape(self.bands, self.rows).sum(axis=1)
+        return ((folded + np.arange(self.bands, dtype=np.uint64) * 0x9e3779b9) & 0xffffffff).astype(np.uint32)
+
+    def add(self, profile):
+        # Indexes profile's answers, replacing what was indexed for it before.
+        self.remove(profile.username)
+        signature = self.signature(profile_features(profile))
+        self.usernames.append(profile.username)
+        self.live.append(1)
+        self.signatures.fromstring(self.stored(signature).tostring())
+        self.keys.fromstring(self.band_keys(signature).tostring())
+        self.docs[profile.username] = len(self.usernames) - 1
+
+    def remove(self, username):
+        doc = self.docs.pop(username, None)
+        if doc is not None:
+            self.usernames[doc] = None
+            self.live[doc] = 0
+
+    def record(self, store, profile=None, removed=None):
+        # Account for a write just made to store: profile was stored, or the
+        # profile of username removed was deleted; neither if the write left
+        # the answers as they were.
+        if profile is not None:
+            self.add(profile)
+        if removed is not None:
+            self.remove(removed)
+        self.position = store.end
+
+    # ---- searching ----
+
+    def _arrays(self, np):
+        # (signatures, live, order, sorted keys, unsorted keys): sorted keys
+        # are band << 32 | key for the first documents, in order, and order
+        # the document of each; unsorted keys are the rows of those added since
+        n = len(self.usernames)
+        if not n:
+            return (np.zeros((0, self.num_perm), dtype=np.uint16), np.zeros(0, dtype=bool),
+                    np.zeros(0, dtype=np.intc), np.zeros(0, dtype=np.uint64),
+                    np.zeros((0, self.bands), dtype=np.uint32))
+        signatures = np.frombuffer(self.signatures, dtype=np.uint16).reshape(n, self.num_perm)
+        live = np.frombuffer(self.live, dtype=np.uint8).astype(bool)
+        keys = np.frombuffer(self.keys, dtype=np.uint32).reshape(n, self.bands)
+        if self._sorted is None or not 0 <= n - self._sorted[0] <= max(UNSORTED, self._sorted[0] // 8):
+            banded = self._banded(np, keys).T.ravel()
+            order = np.argsort(banded, kind='mergesort')
+            self._sorted = (n, (order % n).astype(np.intc), banded[order])
+        sorted_n, order, sorted_keys = self._sorted
+        return signatures, live, order, sorted_keys, keys[sorted_n:]
+
+    def _banded(self, np, keys):
+        return keys.astype(np.uint64) | (np.arange(self.bands, dtype=np.uint64) << np.uint64(32))
+
+    def candidates(self, signature):
+        # The live documents sharing a band with signature
+        return self._candidates(self.band_keys(signature))[0]
+
+    def _candidates(self, keys):
+        # (the live documents sharing a band with keys, how many bands each shares)
+        import numpy as np
+        signatures, live, order, sorted_keys, unsorted = self._arrays(np)
+        banded = self._banded(np, np.asarray(keys))
+        lo = sorted_keys.searchsorted(banded, 'left')
+        hi = sorted_keys.searchsorted(banded, 'right')
+        found = [order[l:h] for l, h in zip(lo, hi) if h > l]
+        if len(unsorted):
+            shared = (unsorted == keys).sum(axis=1)
+            found.append(np.repeat(np.arange(len(signatures) - len(unsorted), len(signatures),
+                                             dtype=np.intc), shared))
+        if not found:
+            return np.zeros(0, dtype=np.intc), np.zeros(0, dtype=np.intp)
+        docs, shared = np.unique(np.concatenate(found), return_counts=True)
+        return docs[live[docs]], shared[live[docs]]
+
+    def similar(self, features, k=20, exclude=None, among=None):
+        # [(similarity, username)] for the k profiles most like a set of
+        # features (all candidates with k None), best first, leaving out the
+        # username exclude and keeping only usernames in among if given.
+        # Similarities are estimates of the Jaccard similarity.
+        if not features:
+            return []
+        signature = self.signature(features)
+        return self._ranked(self._candidates(self.band_keys(signature)), self.stored(signature),
+                            k, exclude, among)
+
+    def similar_to(self, username, k=20, among=None):
+        # The same for the profiles answered most like username's, which must be indexed
+        import numpy as np
+        doc = self.docs[username]
+        signature = self._arrays(np)[0][doc]
+        if signature[0] == EMPTY and (signature == EMPTY).all():
+            return []
+        # the band keys are kept, the full signature is not
+        keys = np.frombuffer(self.keys, dtype=np.uint32)[doc * self.bands:(doc + 1) * self.bands]
+        return self._ranked(self._candidates(keys), signature, k, username, among)
+
+    def _ranked(self, candidates, stored, k, exclude, among):
+        import numpy as np
+        signatures = self._arrays(np)[0]
+        docs, shared = candidates
+        keep = np.ones(len(docs), dtype=bool)
+        if exclude in self.docs:
+            keep &= docs != self.docs[exclude]
+        if among is not None:
+            keep &= np.array([self.usernames[doc] in among for doc in docs], dtype=bool)
+        docs, shared = docs[keep], shared[keep]
+        tiers = [docs]
+        close = shared >= CLOSE_BANDS
+        if k is not None and close.sum() >= k:
+            tiers.insert(0, docs[close])
+        for docs in tiers:
+            compared = signatures[docs]
+            keep = (compared != EMPTY).any(axis=1)
+            docs, compared = docs[keep], compared[keep]
+            if k is None or len(docs) >= k:
+                break
+        if not len(docs):
+            return []
+        scores = (compared == stored).mean(axis=1)
+        if k is not None and len(docs) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            docs, scores = docs[top], scores[top]
+        order = np.lexsort((docs, -scores))
+        return [(float(scores[i]), self.usernames[docs[i]]) for i in order]
+
+    # ---- following a ProfileStore ----
+
+    def compact(self):
+        # Renumbers the live documents, dropping the others' rows.
+        kept = [doc for doc in xrange(len(self.usernames)) if self.live[doc]]
+        signatures = array('H')
+        keys = array('I')
+        for doc in kept:
+            signatures.extend(self.signatures[doc * self.num_perm:(doc + 1) * self.num_perm])
+            keys.extend(self.keys[doc * self.bands:(doc + 1) * self.bands])
+        self.signatures = signatures
+        self.keys = keys
+        self.usernames = [self.usernames[doc] for doc in kept]
+        self.live = bytearray([1]) * len(kept)
+        self.docs = dict((username, doc) for doc, username in enumerate(self.usernames))
+        self._sorted = None
+
+    def build(self, store):
+        self._reset()
+        for profile in store.iterprofiles(load=('header', 'questions')):
+            self.add(profile)
+        self.generation = store.generation
+        self.position = store.end
+
+    def catch_up(self, store):
+        # Apply every store record written since this index was saved.
+        if self.generation != store.generation or self.position > store.end:
+            self.build(store)
+            return
+        for offset, kind, username, prev, payload in store.records(self.position):
+            if kind == PUT:
+                self.add(store.decode(payload))
+            elif kind == DELETE:
+                self.remove(username)
+        self.position = store.end
+
+    def save(self, filename):
+        if len(self.usernames) > 2 * len(self.docs) + 1000:
+            self.compact()
+        tmpfile = filename + '.tmp'
+        with open(tmpfile, 'wb') as F:
+            dump(self, F, HIGHEST_PROTOCOL)
+        shutil.move(tmpfile, filename)
+
+    @classmethod
+    def load(cls, filename, store):
+        index = None
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'rb') as F:
+                    index = load(F)
+            except Exception:
+                index = None
+        if index is None:
+            index = cls()
+            index.build(store)
+        else:
+            index.catch_up(store)
+        return index
@@ -0,0 +1,57 @@
+import sys, os, shutil, tempfile, random, unittest
+from StringIO import StringIO
+sys.path[:0] = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')]
+
+import optimizer
+from config import Config
+from synthetic_corpus import write_corpus, synthetic_profile, REAL_USERNAME, SHADOW_USERNAME
+
+# A synthetic corpus in a temporary data folder, for tests of what follows
+# the profile store. The aggregates are built from the store and saved in
+# setUp, as at the end of a fetch run.
+
+class SyntheticStoreTest(unittest.TestCase):
+    n_profiles = 30
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.pool = write_corpus(self.folder, self.n_profiles)
+        optimizer.use_config(self.config())
+        optimizer.open_question_stats()
+        optimizer.open_essay_index()
+        optimizer.open_similarity_index()
+        optimizer.save_fetch_state()
+
+    def tearDown(self):
+        optimizer.use_config(None)
+        shutil.rmtree(self.folder)
+
+    def config(self):
+        return Config(self.folder, real_username=REAL_USERNAME, shadow_username=SHADOW_USERNAME)
+
+    def reopen(self):
+        # As a later session would: the aggregates are loaded from their saved copies
+        optimizer.open_profile_store().flush()
+        optimizer.use_config(self.config())
+
+    def quietly(self, func, *args, **kwargs):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.stdout = stdout
+
+    def change_store(self):
+        # new profiles, profiles stored again with other answers and essays,
+        # an unchanged one stored again, and deleted ones
+        rnd = random.Random(7)
+        store = optimizer.open_profile_store()
+        profiles = [synthetic_profile(rnd, self.pool, n) for n in range(30, 40) + range(5)]
+        profiles.append(store.get(u'synthetic000010', load=('header', 'questions', 'essays', 'photos')))
+        for profile in profiles:
+            self.quietly(optimizer.record_profile, profile.username, optimizer.FETCHED, profile,
+                         profile.match_percentage)
+        for n in range(5, 10) + [32]:
+            self.quietly(optimizer.record_profile, u'synthetic%06d'%(n), optimizer.DEACTIVATED, None)
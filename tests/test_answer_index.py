@@ -0,0 +1,55 @@
+import sys, os, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from answer_index import AnswerIndex
+
+class Question(object):
+    # Reads like a StaticQuestion.
+    def __init__(self, their_answer, my_answer=None, their_answer_matches=None, my_answer_matches=None):
+        self.id = 7
+        self.text = u"Cats or dogs?"
+        self.their_answer = their_answer
+        self.my_answer = my_answer
+        self.their_answer_matches = their_answer_matches
+        self.my_answer_matches = my_answer_matches
+
+class Profile(object):
+    def __init__(self, match_percentage, *questions):
+        self.match_percentage = match_percentage
+        self.questions = questions
+
+class AnswerIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = AnswerIndex([
+            Profile(90, Question(u"Cats", u"Dogs", True, False)),
+            Profile(80, Question(u"Cats", u"Dogs", True, True)),
+            Profile(70, Question(u"Birds", u"Dogs", False, True)),
+            Profile(60, Question(u"Fish", u"Dogs", False, False)),
+            Profile(50, Question(u"Fish", u"Dogs", True, True)),
+            # before I answered: nothing is known to match
+            Profile(40, Question(u"Snakes")),
+            Profile(30, Question(None)),
+        ])
+
+    def test_by_answer(self):
+        self.assertEqual(self.index.by_answer(7), {u"Cats": [2, 1, 0], u"Birds": [1, 0, 1], u"Fish": [2, 1, 1],
+                                                   u"Snakes": [1, 0, 0], None: [1, 0, 0]})
+        self.assertEqual(self.index.totals(7, min_mp=65), [3, 1, 1])
+        self.assertEqual(self.index.histogram(7), {u"Cats": 2, u"Birds": 1, u"Fish": 2, u"Snakes": 1})
+        self.assertEqual(self.index.most_common_answer(7), u"Cats")
+
+    def test_accepted_answers(self):
+        # only answers marked as matching, as help_reanswer always listed
+        self.assertEqual(self.index.accepted_answers(7), [u"Cats", u"Fish"])
+        self.assertEqual(self.index.accepted_answers(7, min_mp=55), [u"Cats"])
+
+    def test_acceptance(self):
+        self.assertEqual(self.index.acceptance(7, min_mp=75), 0.5)
+
+    def test_prefix(self):
+        self.assertEqual(self.index.with_prefix(u"cats"), [7])
+        self.assertEqual(self.index.with_start(u"Cats or dogs?"), [7])
+        self.assertEqual(self.index.with_prefix(u"dogs"), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from synthetic_store import SyntheticStoreTest, optimizer
+from essay_index import EssayIndex
+
+# EssayIndex follows the profile store as profiles are stored, replaced and
+# deleted, and a saved copy catches up when opened; either way it must find
+# what a rebuild would.
+
+QUERIES = ('coffee', 'hiking books', '"board games"', 'music -dogs', 'jazz punk ocean')
+
+class EssayIndexTest(SyntheticStoreTest):
+    def search(self, index, query):
+        return sorted((-round(score, 9), username) for score, username in index.search(query, k=None))
+
+    def assertEssaysEqual(self, index):
+        rebuilt = EssayIndex()
+        rebuilt.build(optimizer.open_profile_store())
+        self.assertEqual(set(index.docs), set(rebuilt.docs))
+        self.assertEqual(index.total_length, rebuilt.total_length)
+        for query in QUERIES:
+            self.assertEqual(self.search(index, query), self.search(rebuilt, query))
+            self.assertEqual(index.matching(query), rebuilt.matching(query))
+
+    def test_recorded(self):
+        self.change_store()
+        self.assertEssaysEqual(optimizer.open_essay_index())
+
+    def test_caught_up(self):
+        self.change_store()
+        # the saved copy predates the changes
+        self.reopen()
+        self.assertEssaysEqual(optimizer.open_essay_index())
+
+    def test_compacted(self):
+        self.change_store()
+        index = optimizer.open_essay_index()
+        index.compact()
+        self.assertEssaysEqual(index)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import sys, os, shutil, tempfile, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fetch_pool import Checkpoint, fetch_all
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def interrupted(self, plan, keys):
+        checkpoint = Checkpoint(self.filename, plan)
+        for key in keys:
+            checkpoint.mark(key, 'fetched')
+        checkpoint.close()
+
+    def test_resumed(self):
+        self.interrupted([u'a', u'b', u'c'], [u'a', u'b'])
+        checkpoint = Checkpoint(self.filename, [u'a', u'b', u'c'])
+        self.assertEqual([key for key in [u'a', u'b', u'c'] if key not in checkpoint], [u'c'])
+        checkpoint.mark(u'c', 'fetched')
+        checkpoint.close(finished=True)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_other_plan(self):
+        # a later run with other keys, or the same keys planned another way, starts over
+        self.interrupted([u'a', u'b', u'c'], [u'a', u'b'])
+        checkpoint = Checkpoint(self.filename, [u'a', u'b'])
+        self.assertNotIn(u'a', checkpoint)
+        checkpoint.mark(u'a', 'fetched')
+        checkpoint.close()
+        self.assertNotIn(u'b', Checkpoint(self.filename, [u'a', u'b']))
+        self.assertNotIn(u'a', Checkpoint(self.filename, ('planned', True, None, None)))
+
+    def test_no_plan(self):
+        self.interrupted(None, [u'a'])
+        self.assertIn(u'a', Checkpoint(self.filename))
+
+class FetchAllTest(unittest.TestCase):
+    def test_results(self):
+        def fetch(session, key):
+            if key == 3:
+                raise ValueError(key)
+            return session, key * 2
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+        try:
+            results = list(fetch_all(['s1', 's2'], range(6), fetch))
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(sorted(key for key, result, error in results), range(6))
+        for key, result, error in results:
+            if key == 3:
+                self.assertIsNone(result)
+                self.assertIsInstance(error, ValueError)
+            else:
+                self.assertIsNone(error)
+                self.assertIn(result[0], ('s1', 's2'))
+                self.assertEqual(result[1], key * 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import sys, os, random, unittest
+sys.path[:0] = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')]
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+import optimizer
+from username_registry import FETCHED, LOW_MP, FILTERED, DEACTIVATED
+from synthetic_corpus import QuestionPool, synthetic_profile
+
+class Details(object):
+    def __init__(self, details):
+        self.as_dict = details
+
+class Ages(object):
+    def __init__(self, ages):
+        self.min, self.max = ages
+
+class LookingFor(object):
+    def __init__(self, looking_for):
+        for prp in ("gentation", "single", "near_me", "kinds"):
+            setattr(self, prp, getattr(looking_for, prp))
+        self.ages = Ages(looking_for.ages)
+
+class Profile(object):
+    # Reads like an okcupyd Profile, noting which pages were asked for.
+    def __init__(self, staticprofile, fail=None):
+        self.staticprofile = staticprofile
+        self.fail = fail
+        self.read = []
+        for prp in ('username', 'id', 'age', 'match_percentage', 'enemy_percentage', 'location',
+                    'gender', 'orientation', 'responds', 'essays'):
+            setattr(self, prp, getattr(staticprofile, prp))
+        self.details = Details(staticprofile.details)
+        self.looking_for = LookingFor(staticprofile.looking_for)
+
+    def _page(self, name):
+        self.read.append(name)
+        if self.fail is not None:
+            response = requests.Response()
+            response.status_code = self.fail
+            raise requests.exceptions.HTTPError(response=response)
+        return getattr(self.staticprofile, name)
+
+    @property
+    def questions(self):
+        return self._page('questions')
+
+    @property
+    def photo_infos(self):
+        return self._page('photos')
+
+@unittest.skipIf(requests is None, "requests is not installed")
+class FetchProfileTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(5)
+        pool = QuestionPool(rnd, n_questions=300, n_shadow=60, n_real=40)
+        self.staticprofile = synthetic_profile(rnd, pool, 1)
+        self.mp = self.staticprofile.match_percentage
+        self.answered = len(self.staticprofile.questions)
+
+    def fetch(self, mp_cutoff=None, profile_filter=None, fail=None):
+        profile = Profile(self.staticprofile, fail)
+        return optimizer.fetch_profile(profile, mp_cutoff, profile_filter), profile.read
+
+    def filter(self):
+        return optimizer.ProfileFilter(None)
+
+    def test_fetched(self):
+        (status, staticprofile, mp), read = self.fetch(self.mp, self.filter().add_mp_filter(self.mp))
+        self.assertEqual((status, mp, read), (FETCHED, self.mp, ['questions', 'photos']))
+        self.assertEqual(len(staticprofile.questions), self.answered)
+        self.assertEqual(len(staticprofile.photos), len(self.staticprofile.photos))
+
+    def test_low_mp(self):
+        # turned down on the profile page: no questions or photos downloaded
+        (status, staticprofile, mp), read = self.fetch(self.mp + 1)
+        self.assertEqual((status, staticprofile, mp, read), (LOW_MP, None, self.mp, []))
+
+    def test_header_filter(self):
+        profile_filter = self.filter().add_age_filter(min_age=self.staticprofile.age + 1)
+        (status, staticprofile, mp), read = self.fetch(profile_filter=profile_filter)
+        self.assertEqual((status, staticprofile, read), (FILTERED, None, []))
+
+    def test_question_filter(self):
+        # a check that needs the questions waits for them, but spares the photos
+        profile_filter = self.filter()._and(lambda profile: len(profile.questions) > self.answered)
+        (status, staticprofile, mp), read = self.fetch(profile_filter=profile_filter)
+        self.assertEqual((status, staticprofile, read), (FILTERED, None, ['questions']))
+        # either of two groups will do; the header only rules out both
+        profile_filter = self.filter().add_mp_filter(self.mp + 1)._or(self.filter()._and(lambda profile: True))
+        self.assertEqual(self.fetch(profile_filter=profile_filter)[0][0], FETCHED)
+
+    def test_gone(self):
+        (status, staticprofile, mp), read = self.fetch(fail=404)
+        self.assertEqual((status, staticprofile, mp), (DEACTIVATED, None, None))
+        self.assertRaises(requests.exceptions.HTTPError, self.fetch, fail=500)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os, unittest
+
+from synthetic_store import SyntheticStoreTest, optimizer
+from config import Config
+from synthetic_corpus import REAL_USERNAME, SHADOW_USERNAME
+
+# Scripts written before config.py read BASE_FOLDER, REAL_USERNAME,
+# real_backup and the like off optimizer, or got them with import *.
+
+class LegacyNamesTest(SyntheticStoreTest):
+    def test_read_from_config(self):
+        # without setup() having run
+        self.assertEqual(optimizer.REAL_USERNAME, REAL_USERNAME)
+        self.assertEqual(optimizer.SHADOW_USERNAME, SHADOW_USERNAME)
+        self.assertEqual(optimizer.PROFILE_FOLDER, os.path.join(self.folder, 'profiles'))
+        self.assertIs(optimizer.real_backup, optimizer.config.real_backup)
+        self.assertEqual(len(list(optimizer.shadow_backup.questions)), len(self.pool.shadow))
+
+    def test_follow_use_config(self):
+        optimizer.use_config(Config(self.folder, real_username=u'someone', shadow_username=u''))
+        self.assertEqual(optimizer.REAL_USERNAME, u'someone')
+        self.assertIsNone(optimizer.real_backup)
+
+    def test_assigned(self):
+        # as before, a script may set them itself
+        optimizer.REAL_USERNAME = u'someone'
+        try:
+            self.assertEqual(optimizer.REAL_USERNAME, u'someone')
+        finally:
+            del optimizer.REAL_USERNAME
+        self.assertEqual(optimizer.REAL_USERNAME, REAL_USERNAME)
+
+    def test_import_star(self):
+        namespace = {}
+        exec "from optimizer import *" in namespace
+        self.assertEqual(namespace['REAL_USERNAME'], REAL_USERNAME)
+        self.assertEqual(namespace['VALUATION_FOLDER'], os.path.join(self.folder, 'valuations'))
+        self.assertIs(namespace['real_backup'], optimizer.config.real_backup)
+        self.assertIs(namespace['transfer_questions'], optimizer.transfer_questions)
+        # not given, and config.ini would have to be asked for
+        self.assertNotIn('REAL_PASSWORD', namespace)
+        self.assertNotIn('_LegacyNames', namespace)
+
+if __name__ == '__main__':
+    unittest.main()
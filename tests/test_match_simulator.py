@@ -0,0 +1,105 @@
+import sys, os, random, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from match_simulator import MatchSimulator, IMPORTANCE_WEIGHTS
+
+class Question(object):
+    # Reads like a profile's StaticQuestion.
+    def __init__(self, id, their_answer, my_answer, their_answer_matches, my_answer_matches):
+        self.id = id
+        self.their_answer = their_answer
+        self.my_answer = my_answer
+        self.their_answer_matches = their_answer_matches
+        self.my_answer_matches = my_answer_matches
+
+class Option(object):
+    def __init__(self, text):
+        self.text = text
+
+class MyQuestion(object):
+    # Reads like one of QuestionAnalyzer.shadow_questions.
+    def __init__(self, importance, answer, matches, options):
+        self.importance = importance
+        self.answer = answer
+        self.matches = matches
+        self.answer_options = [Option(text) for text in options]
+
+class Profile(object):
+    def __init__(self, username, questions, match_percentage=None):
+        self.username = username
+        self.questions = questions
+        self.match_percentage = match_percentage
+
+OPTIONS = [u"Yes", u"No", u"Maybe"]
+
+class MatchSimulatorTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(4)
+        importances = sorted(IMPORTANCE_WEIGHTS)
+        self.my_questions = dict((id, MyQuestion(rnd.choice(importances), rnd.choice(OPTIONS),
+                                                 rnd.sample(OPTIONS, rnd.randint(1, 3)), OPTIONS))
+                                 for id in range(1, 6))
+        self.profiles = []
+        for n in range(40):
+            questions = []
+            for id in rnd.sample(range(1, 8), rnd.randint(0, 6)):
+                answer = rnd.choice(OPTIONS)
+                mine = self.my_questions.get(id)
+                questions.append(Question(id, answer, mine and mine.answer,
+                                          mine is not None and answer in mine.matches, rnd.random() < 0.6))
+            self.profiles.append(Profile(u'user%s'%(n), questions, rnd.randint(0, 100)))
+
+    def simulator(self, my_questions=None, profiles=None):
+        return MatchSimulator(profiles or self.profiles, my_questions or self.my_questions)
+
+    def test_baseline(self):
+        simulator = self.simulator()
+        for i, profile in enumerate(self.profiles):
+            common = [q for q in profile.questions if q.id in self.my_questions]
+            if not common:
+                self.assertEqual(simulator.baseline[i], 0)
+                continue
+            weights = [IMPORTANCE_WEIGHTS[self.my_questions[q.id].importance] for q in common]
+            mine = (float(sum(w for w, q in zip(weights, common) if q.their_answer_matches)) / sum(weights)
+                    if sum(weights) else 1.0)
+            theirs = float(sum(1 for q in common if q.my_answer_matches)) / len(common)
+            expected = max(0, min(1, (mine * theirs) ** 0.5 - 1.0 / len(common))) * 100
+            self.assertAlmostEqual(simulator.baseline[i], expected)
+        self.assertIsNotNone(simulator.error(self.profiles))
+
+    def gain(self, my_questions=None, profiles=None):
+        # the mean change in match of actually making a change
+        simulator = self.simulator(my_questions, profiles)
+        return (simulator.baseline - self.simulator().baseline).mean()
+
+    def test_importance_and_acceptance(self):
+        ranked = self.simulator().rank()
+        self.assertEqual(ranked, sorted(ranked, key=lambda item: -item[0]))
+        for gain, n, id, kind, value in ranked:
+            question = self.my_questions[id]
+            if kind == 'importance':
+                changed = dict(self.my_questions)
+                changed[id] = MyQuestion(value, question.answer, question.matches, OPTIONS)
+                self.assertAlmostEqual(gain, self.gain(my_questions=changed))
+            elif kind in ('accept', 'reject'):
+                profiles = [Profile(p.username, [Question(q.id, q.their_answer, q.my_answer,
+                                                          (kind == 'accept') if (q.id, q.their_answer) == (id, value)
+                                                          else q.their_answer_matches, q.my_answer_matches)
+                                                 for q in p.questions])
+                            for p in self.profiles]
+                self.assertAlmostEqual(gain, self.gain(profiles=profiles))
+
+    def test_answer_to_their_own(self):
+        # a profile that gave the answer I would switch to accepts it: with the
+        # other question in common acceptable both ways, theirs goes from 1/2 to 1
+        labels = self.simulator().answer_changes()[0]
+        id, kind, value = labels[0]
+        other = [other for other in sorted(self.my_questions) if other != id][0]
+        profiles = [Profile(u'only', [Question(id, value, self.my_questions[id].answer, True, False),
+                                      Question(other, u"Yes", self.my_questions[other].answer, True, True)])]
+        labels, gains, affected = self.simulator(profiles=profiles).answer_changes()
+        gain = dict(zip(labels, gains))[(id, 'answer', value)]
+        self.assertAlmostEqual(gain, 100 * ((1 - 0.5) - (0.5 ** 0.5 - 0.5)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+from cPickle import dumps, loads
+
+from synthetic_store import SyntheticStoreTest, optimizer
+from metrics import Metrics, metrics
+
+class MetricsTest(unittest.TestCase):
+    def test_merge(self):
+        parent, worker = Metrics(), Metrics()
+        parent.record('build seconds', 1.0, 10)
+        parent.add('logins')
+        worker.record('build seconds', 3.0, 30)
+        worker.record('filter seconds', 0.5)
+        worker.add('logins', 2)
+        parent.merge(loads(dumps(worker.state())))
+        data = parent.as_dict()
+        self.assertEqual(data['counters'], {'logins': 3})
+        build = data['timings']['build seconds']
+        self.assertEqual((build['samples'], build['total'], build['max'], build['items']), (2, 4.0, 3.0, 40))
+        self.assertEqual(build['per_second'], 10)
+        self.assertEqual(data['timings']['filter seconds']['samples'], 1)
+
+class WorkerMetricsTest(SyntheticStoreTest):
+    def test_parallel_build_is_counted(self):
+        # the filter timings recorded in the worker processes reach this one
+        profile_filter = optimizer.ProfileFilter(None).add_mp_filter(50)
+        metrics.reset()
+        optimizer.QuestionAnalyzer(profile_filter, workers=2)
+        self.assertEqual(metrics.as_dict()['timings']['filter seconds']['items'], self.n_profiles)
+
+if __name__ == '__main__':
+    unittest.main()
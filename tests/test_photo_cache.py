@@ -0,0 +1,154 @@
+import sys, os, shutil, tempfile, threading, unittest
+import BaseHTTPServer, SocketServer
+from StringIO import StringIO
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from photo_cache import PhotoCache, MISSING
+
+try:
+    import requests
+    from rate_limit import AdaptiveRateLimiter, mount_retrying_adapter
+except ImportError:
+    requests = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+def image_data(shade):
+    # a small JPEG, or stand-in bytes without PIL
+    if Image is None:
+        return 'JPEG %s'%(shade)
+    F = StringIO()
+    Image.new('RGB', (120, 90), (shade, 255 - shade, 128)).save(F, 'JPEG')
+    return F.getvalue()
+
+class PhotoServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    # Serves /photo/N.jpg, /dup/N.jpg (all the same image), /gone.jpg (404)
+    # and /busy.jpg (429 the first time it is asked for).
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), PhotoHandler)
+        self.hits = []
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%s%s'%(self.server_port, path)
+
+class PhotoHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits.append(self.path)
+            busy = server.hits.count(self.path) == 1 and self.path == '/busy.jpg'
+        if self.path == '/gone.jpg':
+            self.send_response(404)
+            self.end_headers()
+            return
+        if busy:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path.startswith('/dup/'):
+            body = image_data(0)
+        else:
+            body = image_data(sum(ord(c) for c in self.path) % 256)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class Photo(object):
+    # Reads like a StaticPhotoInfo.
+    def __init__(self, id, uri, box=(10, 20, 70, 80)):
+        self.id = id
+        self.jpg_uri = uri
+        self.thumb_nail_left, self.thumb_nail_top, self.thumb_nail_right, self.thumb_nail_bottom = box
+
+@unittest.skipIf(requests is None, "needs requests")
+class PhotoCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.server = PhotoServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.folder = tempfile.mkdtemp()
+        self.limiter = AdaptiveRateLimiter(0, max_interval=0.01, backoff=0.01)
+        self.sessions = []
+        for i in range(3):
+            session = requests.Session()
+            mount_retrying_adapter(session, self.limiter)
+            self.sessions.append(session)
+        url = self.server.url
+        self.photos = ([Photo(n, url('/photo/%s.jpg'%(n))) for n in range(8)] +
+                       [Photo(100 + n, url('/dup/%s.jpg'%(n))) for n in range(3)] +
+                       [Photo(200, url('/gone.jpg')), Photo(300, url('/busy.jpg')),
+                        # listed twice, fetched once
+                        Photo(3, url('/photo/3.jpg'))])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for session in self.sessions:
+            session.close()
+        shutil.rmtree(self.folder)
+
+    def prefetch(self, **kwargs):
+        cache = PhotoCache(self.folder)
+        try:
+            return cache, cache.prefetch(self.photos, self.sessions, self.limiter, **kwargs)
+        finally:
+            cache.close()
+
+    def objects(self):
+        return [name for dirpath, dirnames, filenames in os.walk(os.path.join(self.folder, 'objects'))
+                for name in filenames]
+
+    def test_prefetch(self):
+        cache, counts = self.prefetch()
+        self.assertEqual(counts, (12, 1, 0))
+        # the three copies of one image are kept once
+        self.assertEqual(len(set(cache.digest(photo) for photo in self.photos[8:11])), 1)
+        self.assertEqual(len(self.objects()), 10)
+        # the 429 was retried
+        self.assertEqual(self.server.hits.count('/busy.jpg'), 2)
+        self.assertTrue(os.path.exists(cache.path(self.photos[12])))
+        # the 404 is remembered as gone
+        self.assertIn(self.photos[11], cache)
+        self.assertEqual(cache.digests['200'], MISSING)
+        self.assertIsNone(cache.path(self.photos[11]))
+        self.assertEqual(self.server.hits.count('/photo/3.jpg'), 1)
+
+    def test_second_run_fetches_nothing(self):
+        self.prefetch()
+        hits = len(self.server.hits)
+        cache, counts = self.prefetch()
+        self.assertEqual(counts, (0, 0, 0))
+        self.assertEqual(len(self.server.hits), hits)
+        self.assertEqual(len(cache), 13)
+        # photos that were gone are asked for again only with retry_missing
+        cache, counts = self.prefetch(retry_missing=True)
+        self.assertEqual(counts, (0, 1, 0))
+        self.assertEqual(self.server.hits[hits:], ['/gone.jpg'])
+
+    @unittest.skipIf(Image is None, "thumbnails need PIL")
+    def test_thumbnails(self):
+        cache, counts = self.prefetch(thumbnails=True)
+        thumbs = [name for dirpath, dirnames, filenames in os.walk(os.path.join(self.folder, 'thumbs'))
+                  for name in filenames]
+        # one per image and crop box
+        self.assertEqual(len(thumbs), 10)
+        self.assertEqual(Image.open(cache.thumbnail(self.photos[0])).size, (60, 60))
+        self.assertEqual(Image.open(cache.thumbnail(self.photos[0], size=(30, 30))).size, (30, 30))
+        whole = Photo(5, self.photos[5].jpg_uri, (0, 0, 0, 0))
+        self.assertEqual(Image.open(cache.thumbnail(whole)).size, (120, 90))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import sys, os, shutil, tempfile, random, unittest
+from cPickle import dump, HIGHEST_PROTOCOL
+from StringIO import StringIO
+sys.path[:0] = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')]
+
+from profile_store import ProfileStore, StoredProfile, migrate_profile_folder, SECTIONS
+from synthetic_corpus import QuestionPool, synthetic_profile
+
+QUESTION_FIELDS = ('id', 'text', 'their_answer', 'my_answer', 'answered', 'their_answer_matches',
+                   'my_answer_matches', 'their_note', 'my_note')
+
+class ProfileStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'profiles.db')
+        self.rnd = random.Random(5)
+        self.pool = QuestionPool(self.rnd, n_questions=300, n_shadow=60, n_real=40)
+        self.store = ProfileStore(self.filename)
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.addCleanup(setattr, sys, 'stdout', stdout)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.folder)
+
+    def profile(self, n):
+        return synthetic_profile(self.rnd, self.pool, n)
+
+    def reopen(self):
+        self.store.close()
+        self.store = ProfileStore(self.filename)
+
+    def assertSameProfile(self, stored, profile):
+        self.assertIsInstance(stored, StoredProfile)
+        for name in ('username', 'age', 'match_percentage', 'location', 'details', 'responds'):
+            self.assertEqual(getattr(stored, name), getattr(profile, name))
+        self.assertEqual([[getattr(q, name) for name in QUESTION_FIELDS] for q in stored.questions],
+                         [[getattr(q, name) for name in QUESTION_FIELDS] for q in profile.questions])
+        self.assertEqual(stored.essays.__dict__, profile.essays.__dict__)
+        self.assertEqual([photo.__dict__ for photo in stored.photos], [photo.__dict__ for photo in profile.photos])
+
+    def assertIndexed(self, profiles):
+        # the question index agrees with the live profiles' questions
+        expected = {}
+        for profile in profiles.itervalues():
+            for question in profile.questions:
+                expected.setdefault(question.id, set()).add(profile.username)
+        for id in set(expected) | set(self.store.qindex):
+            usernames = self.store.usernames_with_question(id)
+            self.assertEqual(len(usernames), len(set(usernames)))
+            self.assertEqual(set(usernames), expected.get(id, set()))
+
+    def test_round_trip(self):
+        profiles = dict((p.username, p) for p in (self.profile(n) for n in range(20)))
+        for profile in profiles.itervalues():
+            self.assertIsNone(self.store.put(profile))
+        for reopen in (False, True):
+            if reopen:
+                self.reopen()
+            self.assertEqual(len(self.store), 20)
+            for username, profile in profiles.iteritems():
+                self.assertSameProfile(self.store.get(username), profile)
+            self.assertEqual(sorted(p.username for p in self.store.iterprofiles()), sorted(profiles))
+            self.assertIndexed(profiles)
+
+    def test_sections_load_on_demand(self):
+        profile = self.profile(1)
+        self.store.put(profile)
+        stored = self.store.get(profile.username)
+        self.assertEqual(sorted(stored._sections), sorted(SECTIONS[1:]))
+        self.assertTrue(all(isinstance(source, tuple) for source in stored._sections.itervalues()))
+        stored.essays
+        self.assertNotIn('essays', stored._sections)
+        self.assertIn('photos', stored._sections)
+
+    def test_refresh_and_delete(self):
+        profiles = dict((p.username, p) for p in (self.profile(n) for n in range(10)))
+        for profile in profiles.itervalues():
+            self.store.put(profile)
+        # fetched again just as it was
+        self.store.put(synthetic_profile(random.Random(9), self.pool, 3))
+        self.assertEqual(self.store.refresh(synthetic_profile(random.Random(9), self.pool, 3)), ((), None))
+        changed = self.profile(3)
+        changed.essays = synthetic_profile(random.Random(9), self.pool, 3).essays
+        sections, old = self.store.refresh(changed)
+        self.assertIn('questions', sections)
+        self.assertNotIn('essays', sections)
+        self.assertEqual(old.username, u'synthetic000003')
+        profiles[changed.username] = changed
+        self.assertEqual(self.store.delete(u'synthetic000005').username, u'synthetic000005')
+        self.assertIsNone(self.store.delete(u'synthetic000005'))
+        del profiles[u'synthetic000005']
+        self.assertIndexed(profiles)
+        # from the index checkpoint, and replayed from the file alone
+        self.reopen()
+        self.assertIndexed(profiles)
+        self.assertSameProfile(self.store.get(u'synthetic000003', load=SECTIONS), changed)
+        self.store.close()
+        os.remove(self.filename + '.idx')
+        self.store = ProfileStore(self.filename)
+        self.assertNotIn(u'synthetic000005', self.store)
+        self.assertIndexed(profiles)
+        self.store.compact()
+        self.assertEqual(self.store.generation, 1)
+        self.assertIndexed(profiles)
+        self.assertSameProfile(self.store.get(u'synthetic000003', load=SECTIONS), changed)
+
+    def test_restored_often(self):
+        # the same profiles stored again and again with other answers
+        profiles = {}
+        for i in range(200):
+            profile = self.profile(i % 7)
+            profiles[profile.username] = profile
+            self.store.put(profile)
+            if i % 50 == 49:
+                self.assertIndexed(profiles)
+                self.reopen()
+        self.assertIndexed(profiles)
+        self.assertLess(os.path.getsize(self.filename + '.idx'), 50000)
+
+    def test_interrupted_write(self):
+        self.store.put(self.profile(1))
+        self.store.flush()
+        self.store.put(self.profile(2))
+        self.store._file.truncate(self.store.end - 10)
+        self.store._file.close()
+        self.store = ProfileStore(self.filename)
+        self.assertEqual(self.store.usernames(), [u'synthetic000001'])
+
+    def test_migrate(self):
+        folder = os.path.join(self.folder, 'profiles')
+        os.makedirs(folder)
+        profiles = [self.profile(n) for n in range(5)]
+        for profile in profiles:
+            with open(os.path.join(folder, profile.username), 'wb') as F:
+                dump(profile, F, HIGHEST_PROTOCOL)
+        self.assertEqual(migrate_profile_folder(folder, self.store, remove=True), 5)
+        self.assertFalse(os.path.exists(folder))
+        self.reopen()
+        for profile in profiles:
+            self.assertSameProfile(self.store.get(profile.username, load=SECTIONS), profile)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import sys, os, shutil, tempfile, random, unittest
+from StringIO import StringIO
+sys.path[:0] = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')]
+
+import optimizer
+from config import Config
+from synthetic_corpus import write_corpus, synthetic_profile, REAL_USERNAME, SHADOW_USERNAME
+
+class QuestionAnalyzerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.pool = write_corpus(self.folder, 40)
+        optimizer.use_config(Config(self.folder, real_username=REAL_USERNAME, shadow_username=SHADOW_USERNAME))
+
+    def tearDown(self):
+        optimizer.use_config(None)
+        shutil.rmtree(self.folder)
+
+    def best_to_answer(self, Q):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            Q.best_to_answer(show_mismatch_users=True)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_profile_saved_after_analyzer_built(self):
+        Q = optimizer.QuestionAnalyzer()
+        before = self.best_to_answer(Q)
+        profile = synthetic_profile(random.Random(1), self.pool, 1000)
+        profile.username = u'brand_new'
+        optimizer.record_profile(u'brand_new', optimizer.FETCHED, profile, profile.match_percentage)
+        self.assertNotIn(u'brand_new', Q.profiles)
+        self.assertEqual(self.best_to_answer(Q), before)
+        # a new analyzer sees it
+        self.assertIn(u'brand_new', self.best_to_answer(optimizer.QuestionAnalyzer()))
+
+    def test_workers_same_as_serial(self):
+        # store shards filtered and aggregated in worker processes, merged back in store order
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            optimizer.record_profile(u'synthetic000003', optimizer.DEACTIVATED, None)
+        finally:
+            sys.stdout = stdout
+        sizes = []
+        for profile_filter in (None, optimizer.ProfileFilter(None).add_mp_filter(75)):
+            serial = optimizer.QuestionAnalyzer(profile_filter)
+            parallel = optimizer.QuestionAnalyzer(profile_filter, workers=3)
+            self.assertEqual(sorted(parallel.profiles), sorted(serial.profiles))
+            self.assertEqual(parallel.question_users, serial.question_users)
+            for name in ('qstats', 'answered', 'unanswered', 'mine_mismatches', 'theirs_mismatches'):
+                self.assertEqual(getattr(parallel, name), getattr(serial, name))
+            sizes.append(len(parallel.profiles))
+        self.assertEqual(sizes[0], 39)
+        self.assertTrue(0 < sizes[1] < 39)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import sys, os, shutil, tempfile, random, unittest
+sys.path[:0] = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')]
+
+import optimizer
+from question_history import QuestionHistory, IMPORTANCES, state
+from synthetic_corpus import QuestionPool, synthetic_backup
+
+def layout(qbackup):
+    # {importance: [(id, text, state)]}, what a backup says about each question
+    return dict((importance, [(q.id, q.text, state(q, importance)) for q in getattr(qbackup, importance)])
+                for importance in IMPORTANCES)
+
+class QuestionHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'qbackup', 'someone.history')
+        rnd = random.Random(2)
+        self.pool = QuestionPool(rnd, n_questions=60, n_shadow=30, n_real=20)
+        self.answers = dict(self.pool.shadow)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def backup(self):
+        return synthetic_backup(self.pool, self.answers)
+
+    def test_versions(self):
+        history = QuestionHistory(self.filename)
+        first = self.backup()
+        self.assertEqual(history.record(first), 1)
+        self.assertIsNone(history.record(self.backup()))
+        # one question answered otherwise, one no longer answered, one new
+        ids = sorted(self.answers)
+        answer, matches, importance = self.answers[ids[0]]
+        self.answers[ids[0]] = ((answer + 1) % len(self.pool.options[ids[0]]), matches, importance)
+        del self.answers[ids[1]]
+        new = [id for id in self.pool.texts if id not in self.answers][0]
+        self.answers[new] = (0, set([0]), 'mandatory')
+        second = self.backup()
+        self.assertEqual(history.record(second, full=False), 2)
+        self.assertEqual([(version, full, changed) for version, when, full, changed in history.versions()],
+                         [(1, True, 30), (2, False, 3)])
+        self.assertEqual(history.since_full(), 1)
+        for history in (history, QuestionHistory(self.filename)):
+            self.assertEqual(layout(history.snapshot(1)), layout(first))
+            self.assertEqual(layout(history.snapshot()), layout(second))
+            self.assertEqual(layout(history.snapshot(-2)), layout(first))
+            self.assertRaises(KeyError, history.snapshot, 3)
+
+    def test_cut_short(self):
+        history = QuestionHistory(self.filename)
+        history.record(self.backup())
+        with open(self.filename, 'ab') as F:
+            F.write('\x80\x02(K\x02')
+        history = QuestionHistory(self.filename)
+        self.assertEqual(len(history), 1)
+        del self.answers[sorted(self.answers)[0]]
+        self.assertEqual(history.record(self.backup()), 2)
+        self.assertEqual(len(QuestionHistory(self.filename)), 2)
+
+class Questions(object):
+    # Stands in for okcupyd's UserQuestionFetcher: one list per importance,
+    # counting how many questions were read off each.
+    def __init__(self, qbackup):
+        self.qbackup = qbackup
+        self.read = 0
+
+    def __getattr__(self, importance):
+        if importance not in IMPORTANCES:
+            raise AttributeError(importance)
+        return self._iterate(getattr(self.qbackup, importance))
+
+    def _iterate(self, questions):
+        for question in questions:
+            self.read += 1
+            yield question
+
+class Me(object):
+    def __init__(self, qbackup):
+        self.questions = Questions(qbackup)
+
+class IncrementalBackupTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(6)
+        self.pool = QuestionPool(rnd, n_questions=200, n_shadow=120, n_real=100)
+
+    def test_incremental(self):
+        # OkCupid lists the most recently answered first: a question answered
+        # anew and one answered otherwise come to the top of their lists
+        account = synthetic_backup(self.pool, self.pool.shadow)
+        previous = optimizer.StaticQuestionBackup(Me(account))
+        for importance in IMPORTANCES:
+            questions = getattr(account, importance)
+            if len(questions) > 20:
+                changed = questions.pop(15)
+                for option in changed.answer_options:
+                    option.is_match = not option.is_match
+                questions.insert(0, changed)
+        extra = synthetic_backup(self.pool, dict((id, (0, set([0, 1]), 'somewhat_important'))
+                                                 for id in self.pool.texts if id not in self.pool.shadow))
+        account.somewhat_important[:0] = extra.somewhat_important[:3]
+        full = optimizer.StaticQuestionBackup(Me(account))
+        me = Me(account)
+        incremental = optimizer.StaticQuestionBackup(me, previous)
+        self.assertTrue(incremental.incremental)
+        self.assertEqual(layout(incremental), layout(full))
+        self.assertLess(me.questions.read, len(list(full.questions)))
+
+if __name__ == '__main__':
+    unittest.main()
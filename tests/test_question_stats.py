@@ -0,0 +1,51 @@
+import os, random, unittest
+from cPickle import dump, HIGHEST_PROTOCOL
+
+from synthetic_store import SyntheticStoreTest, optimizer, synthetic_profile
+from question_stats import QuestionStats
+
+# QuestionStats follows the profile store as profiles are stored, replaced
+# and deleted, and a saved copy catches up when opened; either way it must
+# end up as a rebuild would.
+
+class QuestionStatsTest(SyntheticStoreTest):
+    def assertStatsEqual(self, stats):
+        rebuilt = QuestionStats()
+        rebuilt.build(optimizer.open_profile_store())
+        self.assertEqual(stats.qstats, rebuilt.qstats)
+        self.assertEqual(stats.answered, rebuilt.answered)
+        self.assertEqual(stats.unanswered_counts, rebuilt.unanswered_counts)
+        # a profile stored again with the same answers keeps its place in them
+        for D, rebuilt_D in ((stats.mine_mismatches, rebuilt.mine_mismatches),
+                             (stats.theirs_mismatches, rebuilt.theirs_mismatches)):
+            self.assertEqual(dict((id, sorted(L)) for id, L in D.iteritems() if L),
+                             dict((id, sorted(L)) for id, L in rebuilt_D.iteritems()))
+
+    def test_recorded(self):
+        self.change_store()
+        self.assertStatsEqual(optimizer.open_question_stats())
+
+    def test_caught_up(self):
+        self.change_store()
+        # the saved copy predates the changes
+        self.reopen()
+        self.assertStatsEqual(optimizer.open_question_stats())
+
+    def test_migrated_while_open(self):
+        folder = os.path.join(self.folder, 'profiles')
+        os.makedirs(folder)
+        rnd = random.Random(3)
+        for n in range(100, 110):
+            profile = synthetic_profile(rnd, self.pool, n)
+            with open(os.path.join(folder, profile.username), 'wb') as F:
+                dump(profile, F, HIGHEST_PROTOCOL)
+        stats = optimizer.open_question_stats()
+        self.assertEqual(self.quietly(optimizer.migrate_profiles), 10)
+        self.assertIs(optimizer.open_question_stats(), stats)
+        self.assertStatsEqual(stats)
+        self.assertIn(u'synthetic000105', optimizer.open_similarity_index())
+        self.reopen()
+        self.assertStatsEqual(optimizer.open_question_stats())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import sys, os, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import requests
+    import rate_limit
+    from rate_limit import AdaptiveRateLimiter, is_gone
+except ImportError:
+    requests = None
+
+class Clock(object):
+    # Stands in for the time module: sleeping moves the clock on.
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+@unittest.skipIf(requests is None, "requests is not installed")
+class AdaptiveRateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.time = rate_limit.time
+        rate_limit.time = self.clock
+
+    def tearDown(self):
+        rate_limit.time = self.time
+
+    def test_spacing(self):
+        limiter = AdaptiveRateLimiter(1.0, burst=3)
+        for i in range(5):
+            limiter.wait()
+        # three back to back, then one a second
+        self.assertEqual(self.clock.slept, [1.0, 1.0])
+
+    def test_backoff(self):
+        limiter = AdaptiveRateLimiter(1.0, max_interval=3.0, backoff=2.0)
+        pauses = []
+        for i in range(4):
+            limiter.throttled()
+            pauses.append(limiter.resume_at - self.clock.now)
+            self.clock.now = limiter.resume_at
+        # the interval doubles once per run of throttled responses, up to max_interval
+        self.assertEqual(limiter.interval, 2.0)
+        # the pauses double, jittered into their upper half
+        for i, pause in enumerate(pauses):
+            self.assertTrue(2.0 * 2 ** i / 2 <= pause <= 2.0 * 2 ** i, pauses)
+        limiter.wait()
+        self.assertEqual(self.clock.slept, [])
+        # a healthy response ends the run; the next throttled one doubles again
+        limiter.success()
+        self.assertEqual(limiter.failures, 0)
+        self.assertAlmostEqual(limiter.interval, 1.96)
+        limiter.throttled()
+        self.assertEqual((limiter.failures, limiter.interval), (1, 3.0))
+
+    def test_retry_after(self):
+        limiter = AdaptiveRateLimiter(1.0, backoff=1.0)
+        limiter.throttled(retry_after=30)
+        self.assertEqual(limiter.resume_at, self.clock.now + 30)
+        limiter.wait()
+        self.assertEqual(self.clock.slept, [30])
+
+    def test_speedup(self):
+        limiter = AdaptiveRateLimiter(2.0, min_interval=1.0, speedup=0.5)
+        limiter.success()
+        self.assertEqual(limiter.interval, 1.0)
+        limiter.success()
+        self.assertEqual(limiter.interval, 1.0)
+
+    def test_is_gone(self):
+        def error(status_code):
+            response = requests.Response()
+            response.status_code = status_code
+            return requests.exceptions.HTTPError(response=response)
+        self.assertTrue(is_gone(error(404)))
+        self.assertTrue(is_gone(error(410)))
+        self.assertFalse(is_gone(error(500)))
+        self.assertFalse(is_gone(requests.exceptions.HTTPError()))
+        self.assertFalse(is_gone(requests.exceptions.ConnectionError()))
+
+if __name__ == '__main__':
+    unittest.main()
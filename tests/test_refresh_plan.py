@@ -0,0 +1,37 @@
+import time, unittest
+
+from synthetic_store import SyntheticStoreTest, optimizer
+from username_registry import PENDING, FETCHED, LOW_MP
+
+DAY = 86400.0
+
+class RefreshPlanTest(SyntheticStoreTest):
+    n_profiles = 6
+
+    def setUp(self):
+        SyntheticStoreTest.setUp(self)
+        self.registry = optimizer.open_username_registry()
+        now = time.time()
+        # the stored profiles were imported with no fetch time; all but one
+        # are made fresh
+        stored = sorted(self.registry.by_state[FETCHED])
+        self.unknown = stored[0]
+        for username in stored[1:]:
+            self.registry.record(username, FETCHED, match_percentage=50, fetched_at=now)
+        # the best match is due after 15 days, the worst after nearly 30
+        self.registry.record(u'best', FETCHED, match_percentage=100, fetched_at=now - 20 * DAY)
+        self.registry.record(u'worst', LOW_MP, match_percentage=0, fetched_at=now - 25 * DAY)
+        self.registry.record(u'worst_old', LOW_MP, match_percentage=1, fetched_at=now - 30 * DAY)
+        self.registry.record(u'harvested', PENDING)
+
+    def test_order(self):
+        self.assertEqual(optimizer.refresh_plan(max_age_days=30),
+                         [self.unknown, u'best', u'worst_old'])
+
+    def test_budget(self):
+        self.assertEqual(optimizer.refresh_plan(max_age_days=30, budget=2), [self.unknown, u'best'])
+        # everything fetched at all is due at once
+        self.assertEqual(len(optimizer.refresh_plan(max_age_days=0)), self.n_profiles + 3)
+
+if __name__ == '__main__':
+    unittest.main()
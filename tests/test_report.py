@@ -0,0 +1,105 @@
+import sys, os, shutil, tempfile, json, codecs, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from report import Report, report_format
+
+class Question(object):
+    # Reads like a StaticQuestion or a StaticUserQuestion.
+    def __init__(self, id, text, their_answer=None, my_answer=None, their_answer_matches=True,
+                 my_answer_matches=True):
+        self.id = id
+        self.text = text
+        self.their_answer = their_answer
+        self.my_answer = my_answer
+        self.their_answer_matches = their_answer_matches
+        self.my_answer_matches = my_answer_matches
+
+class Profile(object):
+    def __init__(self, username, match_percentage, questions):
+        self.username = username
+        self.match_percentage = match_percentage
+        self.age = 30
+        self.location = u'Boston, MA'
+        self.questions = questions
+
+class Backup(object):
+    def __init__(self, **importances):
+        for importance in ('mandatory', 'very_important', 'somewhat_important',
+                           'little_important', 'not_important'):
+            setattr(self, importance, [Question(id, u'') for id in importances.get(importance, [])])
+
+class Valuations(object):
+    # Rates a profile by the number in its username.
+    categories = {'a': 'looks'}
+
+    def _rate(self, profile):
+        n = int(profile.username[-1])
+        return {'looks': n, 'overall': 2 * n}, {'looks': 1, 'overall': 2}
+
+    def valued_answers(self, profile):
+        return [(int(profile.username[-1]), 'Cats?', 'Yes')]
+
+class Advice(object):
+    def answers(self, profile):
+        return [(u'Smoke?', u'No')]
+
+class ReportTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.profiles = [
+            Profile(u'user1', 90, [Question(1, u'Pets <or> not?', u'No', u'Yes', False, True),
+                                   Question(2, u'Cities?', u'Big', u'Small', False, False),
+                                   Question(3, u'Unanswered by me', u'Yes')]),
+            Profile(u'user3', 70, []),
+            Profile(u'user2', 80, [Question(2, u'Cities?', u'Small', u'Small')]),
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def report(self, **kwargs):
+        report = Report(qbackup=Backup(mandatory=[2], little_important=[1]), **kwargs)
+        for profile in self.profiles:
+            report.add(profile)
+        return report
+
+    def test_mismatches(self):
+        entry = self.report().entries[0]
+        # most important to me first; questions I did not answer are left out
+        self.assertEqual(entry['theirs'], [['mandatory', u'Cities?', u'Big'],
+                                           ['little_important', u'Pets <or> not?', u'No']])
+        self.assertEqual(entry['mine'], [['mandatory', u'Cities?', u'Small']])
+        self.assertEqual(Report().entry(self.profiles[0])['theirs'][0][0], None)
+
+    def test_order(self):
+        self.assertEqual([e['username'] for e in self.report()._sorted()], [u'user1', u'user2', u'user3'])
+        report = self.report(valuations=Valuations(), advice=Advice())
+        self.assertEqual([e['username'] for e in report._sorted()], [u'user3', u'user2', u'user1'])
+        self.assertEqual(report.entries[0]['ratings'], [['looks', 1, 1], ['overall', 2, 2]])
+        self.assertEqual(report.entries[0]['advice'], [[u'Smoke?', u'No']])
+
+    def test_write(self):
+        report = self.report(valuations=Valuations(), advice=Advice())
+        for name in ('report.json', 'report.html', 'report.txt'):
+            report.write(os.path.join(self.folder, name))
+        with open(os.path.join(self.folder, 'report.json')) as F:
+            data = json.load(F)
+        self.assertEqual(data['categories'], ['looks', 'overall'])
+        self.assertEqual(data['profiles'], report._sorted())
+        with codecs.open(os.path.join(self.folder, 'report.html'), 'r', 'utf-8') as F:
+            html = F.read()
+        self.assertIn(u'Pets &lt;or&gt; not?', html)
+        self.assertLess(html.index(u'user3'), html.index(u'user1'))
+        with codecs.open(os.path.join(self.folder, 'report.txt'), 'r', 'utf-8') as F:
+            text = F.read()
+        self.assertIn(u"==== user1 (90%, 30, Boston, MA) ====", text)
+        self.assertIn(u"Pets <or> not?\n  No [little_important]", text)
+        self.assertEqual(sorted(os.listdir(self.folder)), ['report.html', 'report.json', 'report.txt'])
+
+    def test_format(self):
+        self.assertEqual(report_format('x.HTM'), 'html')
+        self.assertEqual(report_format('x.json', 'text'), 'text')
+        self.assertRaises(ValueError, report_format, 'x', 'pdf')
+
+if __name__ == '__main__':
+    unittest.main()
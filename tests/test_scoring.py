@@ -0,0 +1,68 @@
+import random, unittest
+
+from synthetic_store import SyntheticStoreTest, optimizer, synthetic_profile
+from profile_store import SECTIONS
+from scoring import ProfileMatrix
+
+class ScoringTest(SyntheticStoreTest):
+    n_profiles = 60
+
+    def valuations(self, seed):
+        # random ratings of every answer to the shadow account's questions,
+        # some of them left uncategorized
+        rnd = random.Random(seed)
+        V = optimizer.Valuations(save_name='test%s'%(seed))
+        for question in optimizer.config.shadow_backup.questions:
+            cat = rnd.choice(V.categories.values() + [None])
+            V.qcategory[question.id] = cat
+            for option in question.answer_options:
+                V.qrating[question.id][option.text] = rnd.randint(-10, 10)
+        V.invalidate()
+        return V
+
+    def assertScoresEqual(self, matrix, profiles, V):
+        scores = matrix.score(V)[0]
+        for profile in profiles:
+            ratings, answered = V._compute_rate(profile)
+            for cat in V.categories.values() + ['overall']:
+                self.assertEqual(scores.rating(profile.username, cat), ratings[cat])
+                self.assertEqual(scores.n_answered(profile.username, cat), answered[cat])
+
+    def test_packed_profiles(self):
+        # encoded from the store's packed questions
+        store = optimizer.open_profile_store()
+        profiles = list(store.iterprofiles(load=('header', 'questions')))
+        matrix = ProfileMatrix(profiles)
+        self.assertTrue(all(profile.answer_arrays() is not None for profile in profiles))
+        for seed in range(3):
+            self.assertScoresEqual(matrix, profiles, self.valuations(seed))
+
+    def test_mixed_profiles(self):
+        # unpacked, packed and not stored at all, in one matrix
+        store = optimizer.open_profile_store()
+        profiles = list(store.iterprofiles(load=('header', 'questions')))
+        for profile in profiles[::3]:
+            profile.questions
+        # questions replaced after they were read are encoded one by one
+        profiles[1].questions = list(reversed(profiles[1].questions))
+        self.assertIsNone(profiles[1].answer_arrays())
+        self.assertIsNotNone(profiles[3].answer_arrays())
+        fetched = [synthetic_profile(random.Random(1), self.pool, 500)]
+        matrix = ProfileMatrix(profiles + fetched)
+        self.assertEqual(len(matrix), len(profiles) + 1)
+        self.assertScoresEqual(matrix, profiles + fetched, self.valuations(4))
+
+    def test_several_valuations(self):
+        store = optimizer.open_profile_store()
+        profiles = [store.get(username, load=SECTIONS) for username in sorted(store.usernames())]
+        matrix = ProfileMatrix(profiles)
+        valuations = [self.valuations(seed) for seed in range(3)]
+        for V, scores in zip(valuations, matrix.score(*valuations)):
+            self.assertEqual(scores.top(len(profiles)), sorted(scores.top(len(profiles)), reverse=True))
+            best = max((V._compute_rate(p)[0]['overall'], V._compute_rate(p)[1]['overall'], p.username)
+                       for p in profiles)
+            self.assertEqual(scores.top(1), [best])
+            self.assertEqual(scores.ranked()[-1], best)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import sys, os, shutil, tempfile, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_pool import SessionPool, auth_failed
+
+class Cookies(dict):
+    # Reads like a requests cookie jar, as far as the pool goes.
+    def clear_expired_cookies(self):
+        pass
+
+class Limiter(object):
+    def wait(self):
+        pass
+
+class Request(object):
+    def __init__(self, url, cookies=None):
+        self.url = url
+        self.headers = {'Cookie': cookies}
+
+    def copy(self):
+        return Request(self.url, self.headers['Cookie'])
+
+    def prepare_cookies(self, cookies):
+        self.headers['Cookie'] = dict(cookies)
+
+class Response(object):
+    def __init__(self, request, status_code=200, location=None):
+        self.request = request
+        self.status_code = status_code
+        self.is_redirect = location is not None
+        self.headers = {'location': location} if location else {}
+
+class Server(object):
+    # Answers requests from the token of the latest login; earlier ones have expired.
+    def __init__(self):
+        self.token = 0
+        self.sent = []
+
+    def login(self):
+        self.token += 1
+        return self.token
+
+    def send(self, request, **kwargs):
+        self.sent.append(request)
+        cookies = request.headers['Cookie'] or {}
+        return Response(request, 200 if cookies.get('token') == self.token else 401)
+
+class Session(object):
+    # Reads like an okcupyd Session: do_login, cookies, headers, response hooks.
+    def __init__(self, server):
+        self.server = server
+        self.cookies = Cookies()
+        self.headers = {}
+        self.hooks = {'response': []}
+        self.rate_limiter = Limiter()
+        self._requests_session = self
+        self.access_token = None
+        self.log_in_name = None
+
+    def do_login(self, username, password):
+        self.cookies['token'] = self.server.login()
+        self.log_in_name = username
+        self.access_token = 'access %s'%(self.server.token)
+
+    def send(self, request, **kwargs):
+        # as requests does, a hook may replace the response
+        response = self.server.send(request)
+        for hook in self.hooks['response']:
+            response = hook(response, **kwargs) or response
+        return response
+
+    def get(self, url):
+        return self.send(Request(url, dict(self.cookies)))
+
+    def close(self):
+        pass
+
+class Pool(SessionPool):
+    def __init__(self, folder, server):
+        SessionPool.__init__(self, folder, lambda username: Limiter())
+        self.server = server
+
+    def _new_session(self, username):
+        return Session(self.server)
+
+class SessionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.server = Server()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_restored(self):
+        pool = Pool(self.folder, self.server)
+        session = pool.get('me', 'secret')
+        self.assertEqual(pool.logins['me'], 1)
+        self.assertIs(pool.get('me', 'secret'), session)
+        # a later run makes no login request
+        pool = Pool(self.folder, self.server)
+        session = pool.get('me', 'secret')
+        self.assertEqual(pool.logins['me'], 0)
+        self.assertEqual(session.access_token, 'access 1')
+        self.assertEqual(session.get('/profile/someone').status_code, 200)
+
+    def test_relogin(self):
+        pool = Pool(self.folder, self.server)
+        first = pool.get('me', 'secret', slot=0)
+        second = pool.get('me', 'secret', slot=1)
+        self.assertEqual(pool.logins['me'], 1)
+        # the token expires: the first slot to notice logs in again and resends
+        self.server.login()
+        response = first.get('/profile/someone')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.sent), 2)
+        self.assertEqual(pool.logins['me'], 2)
+        # the other slot picks up that login instead of making its own
+        self.assertEqual(second.get('/profile/someone').status_code, 200)
+        self.assertEqual(pool.logins['me'], 2)
+        self.assertEqual(second.cookies['token'], self.server.token)
+
+    def test_second_failure_stands(self):
+        pool = Pool(self.folder, self.server)
+        session = pool.get('me', 'secret')
+        self.server.send = lambda request, **kwargs: Response(request, 403)
+        self.assertEqual(session.get('/profile/someone').status_code, 403)
+        self.assertEqual(pool.logins['me'], 2)
+        self.assertEqual(pool.get('me', 'secret').get('/profile/someone').status_code, 403)
+        self.assertEqual(pool.logins['me'], 3)
+
+    def test_auth_failed(self):
+        request = Request('/profile/someone')
+        self.assertTrue(auth_failed(Response(request, 401)))
+        self.assertTrue(auth_failed(Response(request, 302, 'https://www.okcupid.com/login/')))
+        self.assertFalse(auth_failed(Response(request, 302, 'https://www.okcupid.com/home')))
+        self.assertFalse(auth_failed(Response(request, 404)))
+
+if __name__ == '__main__':
+    unittest.main()
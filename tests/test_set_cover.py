@@ -0,0 +1,37 @@
+import sys, os, random, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from set_cover import greedy_cover, invert
+
+def plain_greedy(profiles_by_question, sizes):
+    # greedy_cover without the heap: every profile's fraction recomputed at every step
+    questions_by_profile = invert(profiles_by_question)
+    unclaimed = set(id for id, users in profiles_by_question.iteritems() if users)
+    groups = []
+    while unclaimed:
+        negf, username = min((-float(len(ids & unclaimed)) / sizes[username], username)
+                             for username, ids in questions_by_profile.iteritems())
+        ids = questions_by_profile[username] & unclaimed
+        unclaimed -= ids
+        groups.append((username, -negf, sorted(ids)))
+    return groups
+
+class GreedyCoverTest(unittest.TestCase):
+    def test_small(self):
+        profiles_by_question = {1: ['a', 'b'], 2: ['a'], 3: ['b', 'c'], 4: ['c'], 5: []}
+        sizes = {'a': 2, 'b': 4, 'c': 2}
+        self.assertEqual(greedy_cover(profiles_by_question, sizes),
+                         [('a', 1.0, [1, 2]), ('c', 1.0, [3, 4])])
+
+    def test_same_as_plain_greedy(self):
+        rnd = random.Random(3)
+        for trial in range(20):
+            users = ['user%s'%(i) for i in range(rnd.randint(1, 30))]
+            profiles_by_question = dict((id, rnd.sample(users, rnd.randint(0, len(users))))
+                                        for id in range(rnd.randint(1, 60)))
+            sizes = dict((username, len(ids) + rnd.randint(0, 10))
+                         for username, ids in invert(profiles_by_question).iteritems())
+            self.assertEqual(greedy_cover(profiles_by_question, sizes), plain_greedy(profiles_by_question, sizes))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from synthetic_store import SyntheticStoreTest, optimizer
+from similarity_index import SimilarityIndex, CLOSE_BANDS
+
+# SimilarityIndex follows the profile store as profiles are stored, replaced
+# and deleted, and a saved copy catches up when opened; either way it must
+# find what a rebuild would.
+
+class SimilarityIndexTest(SyntheticStoreTest):
+    def assertSimilarEqual(self, index):
+        rebuilt = SimilarityIndex()
+        rebuilt.build(optimizer.open_profile_store())
+        self.assertEqual(set(index.docs), set(rebuilt.docs))
+        for username in sorted(rebuilt.docs):
+            self.assertEqual(sorted(index.similar_to(username, k=None)), sorted(rebuilt.similar_to(username, k=None)))
+
+    def test_recorded(self):
+        self.change_store()
+        self.assertSimilarEqual(optimizer.open_similarity_index())
+
+    def test_caught_up(self):
+        self.change_store()
+        # the saved copy predates the changes
+        self.reopen()
+        self.assertSimilarEqual(optimizer.open_similarity_index())
+
+    def test_compacted(self):
+        self.change_store()
+        index = optimizer.open_similarity_index()
+        index.compact()
+        self.assertSimilarEqual(index)
+
+    def test_added_after_sorting(self):
+        # the profiles added after a lookup are found without sorting the bands again
+        index = optimizer.open_similarity_index()
+        index.similar_to(u'synthetic000001')
+        self.change_store()
+        self.assertLess(index._sorted[0], len(index.usernames))
+        self.assertSimilarEqual(index)
+
+    def test_candidates_only(self):
+        index = optimizer.open_similarity_index()
+        for username in sorted(index.docs):
+            doc = index.docs[username]
+            docs, shared = index._candidates(index.keys[doc * index.bands:(doc + 1) * index.bands])
+            found = set(index.usernames[d] for d in docs) - set([username])
+            close = set(index.usernames[d] for d, n in zip(docs, shared) if n >= CLOSE_BANDS) - set([username])
+            # never more than the candidates, however many are asked for
+            self.assertEqual(set(u for s, u in index.similar_to(username, k=len(index))), found)
+            # those sharing several bands first
+            if close:
+                self.assertEqual(set(u for s, u in index.similar_to(username, k=len(close))), close)
+
+if __name__ == '__main__':
+    unittest.main()
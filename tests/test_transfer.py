@@ -0,0 +1,77 @@
+import sys, os, unittest
+from StringIO import StringIO
+
+from synthetic_store import SyntheticStoreTest, optimizer
+from config import Config
+from synthetic_corpus import REAL_USERNAME, SHADOW_USERNAME
+
+class Target(object):
+    # Stands in for a logged in okcupyd User: records the responses sent to
+    # it, and fails those to the questions in fail.
+    def __init__(self, fail=()):
+        self.username = u'synthetic_target'
+        self.questions = self
+        self.fail = set(fail)
+        self.sent = []
+
+    def respond_from_user_question(self, question, importance):
+        if question.id in self.fail:
+            raise IOError("question %s failed"%(question.id))
+        self.sent.append(question.id)
+
+class TransferTest(SyntheticStoreTest):
+    def config(self):
+        return Config(self.folder, real_username=REAL_USERNAME, shadow_username=SHADOW_USERNAME,
+                      shadow_accounts=[])
+
+    def setUp(self):
+        SyntheticStoreTest.setUp(self)
+        self.source = optimizer.config.shadow_backup
+        self.target_backup = optimizer.config.real_backup
+        # the real account answered part of the shadow account's questions, the same way
+        self.diff = sorted(set(self.pool.shadow) - set(self.pool.real))
+
+    def transfer(self, target, select):
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), open(os.devnull, 'w')
+        try:
+            optimizer.transfer_questions(target, self.source, select=select, target_backup=self.target_backup)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def journal_exists(self):
+        return os.path.exists(optimizer.config.path('transfer_journal_synthetic_target'))
+
+    def test_diff(self):
+        todo = optimizer.questions_to_transfer(self.source, self.target_backup)
+        self.assertEqual(sorted(question.id for question, importance in todo), self.diff)
+        self.assertEqual(len(optimizer.questions_to_transfer(self.source)), len(self.pool.shadow))
+
+    def test_failed_resumed(self):
+        select = self.diff[:6]
+        target = Target(fail=select[1:3])
+        output = self.transfer(target, select)
+        self.assertEqual(sorted(target.sent), [select[0]] + select[3:])
+        self.assertIn("2 questions failed", output)
+        for id in select[1:3]:
+            self.assertIn("  %s: %s"%(id, self.pool.texts[id]), output)
+        self.assertTrue(self.journal_exists())
+        # run again the same way, only the failed ones are sent
+        target = Target()
+        self.transfer(target, select)
+        self.assertEqual(sorted(target.sent), select[1:3])
+        self.assertFalse(self.journal_exists())
+
+    def test_journal_of_another_diff(self):
+        select = self.diff[:6]
+        self.transfer(Target(fail=select[:1]), select)
+        self.assertTrue(self.journal_exists())
+        # what an earlier transfer sent is sent again as part of a different one
+        target = Target()
+        self.transfer(target, self.diff[:8])
+        self.assertEqual(sorted(target.sent), self.diff[:8])
+        self.assertFalse(self.journal_exists())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import sys, os, shutil, tempfile, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from username_registry import UsernameRegistry, import_username_files, PENDING, FETCHED, DEACTIVATED
+
+class ImportUsernameFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.registry = UsernameRegistry(os.path.join(self.folder, 'usernames'))
+
+    def tearDown(self):
+        self.registry.close()
+        shutil.rmtree(self.folder)
+
+    def write(self, name, usernames):
+        filename = os.path.join(self.folder, name)
+        with open(filename, 'w') as F:
+            F.write("".join(username + "\n" for username in usernames))
+        return filename
+
+    def test_seeded_from_files_and_store(self):
+        username_file = self.write('users.txt', ['a', 'b', 'c'])
+        deactivated_file = self.write('deactivated_users.txt', ['c'])
+        n = import_username_files(self.registry, username_file, deactivated_file, fetched=['b', 'd', 'e'])
+        self.assertEqual(n, 5)
+        self.assertEqual(self.registry['a'].state, PENDING)
+        self.assertEqual(self.registry['b'].state, FETCHED)
+        self.assertEqual(self.registry['c'].state, DEACTIVATED)
+        # stored profiles missing from users.txt
+        self.assertEqual(self.registry['d'].state, FETCHED)
+        self.assertEqual(self.registry['e'].state, FETCHED)
+
+    def test_seeded_from_store_alone(self):
+        import_username_files(self.registry, fetched=['x', 'y'])
+        self.assertEqual(self.registry.counts()[FETCHED], 2)
+        self.assertEqual(self.registry.to_fetch(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os, time, shutil
+
+# Every username we know of, with where it stands:
+#   pending     - harvested, never fetched
+#   fetched     - profile is in the profile store
+#   low_mp      - fetched, but below the match percentage cutoff, so not stored
+#   filtered    - fetched, but turned down by a ProfileFilter, so not stored
+#   deactivated - the profile is gone
+# plus when it was last fetched and the match percentage seen then.
+#
+# Kept as an append-only file of tab separated "username state fetched_at
+# match_percentage" lines, the last line for a username winning; it is
+# rewritten without the superseded lines when they pile up.
+
+PENDING, FETCHED, LOW_MP, FILTERED, DEACTIVATED = 'pending', 'fetched', 'low_mp', 'filtered', 'deactivated'
+STATES = (PENDING, FETCHED, LOW_MP, FILTERED, DEACTIVATED)
+
+class RegistryEntry(object):
+    __slots__ = ('username', 'state', 'fetched_at', 'match_percentage')
+
+    def __init__(self, username, state=PENDING, fetched_at=None, match_percentage=None):
+        self.username = username
+        self.state = state
+        self.fetched_at = fetched_at
+        self.match_percentage = match_percentage
+
+    def line(self):
+        return u"%s\t%s\t%s\t%s\n"%(self.username, self.state,
+                                    '' if self.fetched_at is None else self.fetched_at,
+                                    '' if self.match_percentage is None else self.match_percentage)
+
+class UsernameRegistry(object):
+    def __init__(self, filename):
+        self.filename = filename
+        # keys are usernames, values are RegistryEntries
+        self.entries = {}
+        # usernames in the order they were first added
+        self.order = []
+        # keys are states, values are sets of usernames
+        self.by_state = dict((state, set()) for state in STATES)
+        lines = 0
+        if os.path.exists(filename):
+            with open(filename) as F:
+                for line in F:
+                    parts = line.decode('utf-8').rstrip('\n').split('\t')
+                    if len(parts) != 4 or parts[1] not in STATES:
+                        continue
+                    username, state, fetched_at, mp = parts
+                    self._set(RegistryEntry(username, state,
+                                            float(fetched_at) if fetched_at else None,
+                                            int(mp) if mp else None))
+                    lines += 1
+        if lines > 2 * len(self.entries) + 1000:
+            self.compact()
+        self._file = open(filename, 'a')
+
+    def _set(self, entry):
+        old = self.entries.get(entry.username)
+        if old is None:
+            self.order.append(entry.username)
+        else:
+            self.by_state[old.state].discard(entry.username)
+        self.entries[entry.username] = entry
+        self.by_state[entry.state].add(entry.username)
+
+    def _write(self, entry):
+        self._set(entry)
+        self._file.write(entry.line().encode('utf-8'))
+
+    def __contains__(self, username):
+        return username in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, username):
+        return self.entries[username]
+
+    def add(self, usernames):
+        # Merges usernames in as pending; known ones keep their state.
+        # Returns how many were new.
+        n = 0
+        for username in usernames:
+            if username and username not in self.entries:
+                self._write(RegistryEntry(username))
+                n += 1
+        self.flush()
+        return n
+
+    def record(self, username, state, match_percentage=None, fetched_at=None):
+        if fetched_at is None and state != PENDING:
+            fetched_at = time.time()
+        self._write(RegistryEntry(username, state, fetched_at, match_percentage))
+        self.flush()
+
+    def counts(self):
+        return dict((state, len(names)) for state, names in self.by_state.iteritems())
+
+    def to_fetch(self, overwrite=False, mp_cutoff=None, deactivated=False):
+        # Usernames save_profiles should fetch, in the order they were added:
+        # pending ones, those that were below a cutoff they might now meet,
+        # and with overwrite, everything already fetched or filtered out.
+        # Deactivated ones only if asked for.
+        wanted = set(self.by_state[PENDING])
+        if deactivated:
+            wanted |= self.by_state[DEACTIVATED]
+        for username in self.by_state[LOW_MP]:
+            mp = self.entries[username].match_percentage
+            if overwrite or mp_cutoff is None or mp is None or mp >= mp_cutoff:
+                wanted.add(username)
+        if overwrite:
+            wanted |= self.by_state[FETCHED] | self.by_state[FILTERED]
+        return [username for username in self.order if username in wanted]
+
+    def flush(self):
+        self._file.flush()
+
+    def compact(self):
+        tmpfile = self.filename + '.tmp'
+        with open(tmpfile, 'w') as F:
+            for username in self.order:
+                F.write(self.entries[username].line().encode('utf-8'))
+        shutil.move(tmpfile, self.filename)
+
+    def close(self):
+        self._file.close()
+
+def import_username_files(registry, username_file=None, deactivated_file=None, fetched=()):
+    # One-time import of the old users.txt / deactivated_users.txt; usernames
+    # in fetched (e.g. those of a ProfileStore) are marked as fetched, and
+    # added if neither file lists them. Returns how many usernames were new.
+    fetched = set(fetched)
+    n = 0
+    if username_file is not None and os.path.exists(username_file):
+        with open(username_file) as F:
+            usernames = [line.strip().decode('utf-8') for line in F]
+        n += registry.add(usernames)
+    for username in sorted(fetched):
+        if username not in registry:
+            n += 1
+        elif registry[username].state != PENDING:
+            continue
+        registry.record(username, FETCHED, fetched_at=0)
+    if deactivated_file is not None and os.path.exists(deactivated_file):
+        with open(deactivated_file) as F:
+            for line in F:
+                username = line.strip().decode('utf-8')
+                if username:
+                    registry.record(username, DEACTIVATED)
+    return n